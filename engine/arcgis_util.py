@@ -1,24 +1,38 @@
 """Functions for getting file URLs from an ArcGIS server through its data.json file."""
-import requests, re, time
+import requests, re, time, threading
 from pprint import pprint
 
+from engine.etl_util import LazyField
+
 try:
     from icecream import ic
 except ImportError:  # Graceful fallback if IceCream isn't installed.
     ic = lambda *a: None if not a else (a[0] if len(a) == 1 else a)  # noqa
 
+catalogs_by_url = {} # The data.json files fetched so far (with the times they were fetched)
+catalog_locks = {} # One lock per URL, so that parallel jobs fetch each catalog once
+catalog_locks_lock = threading.Lock() # but can fetch different catalogs at the same time
+CATALOG_MAX_AGE = 15*60 # seconds (This only matters for long-running processes, like the scheduler daemon.)
+
+def get_arcgis_catalog(data_json_url):
+    """Fetch the data.json file at the given URL (just once per run)."""
+    with catalog_locks_lock:
+        lock = catalog_locks.setdefault(data_json_url, threading.Lock())
+    with lock:
+        if data_json_url not in catalogs_by_url or time.time() - catalogs_by_url[data_json_url][0] > CATALOG_MAX_AGE:
+            try:
+                r = requests.get(data_json_url)
+            except requests.exceptions.ConnectionError: # Retry on ConnectionError
+                time.sleep(10)
+                r = requests.get(data_json_url)
+            catalogs_by_url[data_json_url] = (time.time(), r.json())
+        return catalogs_by_url[data_json_url][1]
+
 def get_arcgis_dataset(title, data_json_url, catalog=None):
     if catalog is None:
-        try:
-            r = requests.get(data_json_url)
-        except requests.exceptions.ConnectionError: # Retry on ConnectionError
-            time.sleep(10)
-            r = requests.get(data_json_url)
-
-        catalog = r.json()
+        catalog = get_arcgis_catalog(data_json_url)
     candidates = [dataset for dataset in catalog['dataset'] if dataset['title'] == title]
     if len(candidates) == 1:
-        time.sleep(1)
         return candidates[0], catalog
     raise ValueError(f"{len(candidates)} datasets found with the title '{title}'.")
 
@@ -67,14 +81,20 @@ def get_arcgis_data_url(data_json_url, dataset_title, file_format, dataset=None,
             return url_without_query_string, filename
     raise ValueError(f"Unable to find title file of type {file_format} and the '{dataset_title}' dataset in {data_json_url}.")
 
+def lazy_arcgis_data_url(data_json_url, dataset_title, file_format, link=False):
+    """Return a LazyField for the URL that get_arcgis_data_url finds (so that
+    the catalog is only consulted if the job is run)."""
+    return LazyField(lambda: get_arcgis_data_url(data_json_url, dataset_title, file_format, link=link)[0])
+
 def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_title, base_job_code, package_id, schema, new_wave_format=True):
-    ag_dataset, data_json_content = get_arcgis_dataset(arcgis_dataset_title, data_json_url, data_json_content)
+    if data_json_content is not None:
+        catalogs_by_url.setdefault(data_json_url, (time.time(), data_json_content))
     if new_wave_format:
         job_dicts = [
             {
                 'job_code': f'{base_job_code}_csv',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'CSV', ag_dataset)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'CSV'),
                 'encoding': 'utf-8',
                 'schema': schema,
                 'always_wipe_data': True,
@@ -87,7 +107,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_geojson',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'GeoJSON', ag_dataset)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'GeoJSON'),
                 'encoding': 'utf-8',
                 'destination': 'ckan_filestore',
                 'package': package_id,
@@ -96,7 +116,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_kml',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'KML', ag_dataset)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'KML'),
                 'encoding': 'utf-8',
                 'destination': 'ckan_filestore',
                 'package': package_id,
@@ -105,7 +125,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_shapefile',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'Shapefile', ag_dataset)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'Shapefile'),
                 'encoding': 'binary',
                 'destination': 'ckan_filestore',
                 'package': package_id,
@@ -115,7 +135,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
                 'job_code': f'{base_job_code}_api',
                 'source_type': 'http',
                 #'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'Esri Rest API', ag_dataset, True)[0],
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'ArcGIS GeoService', ag_dataset, True)[0], # It looks like this got changed. Sure, why not?
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'ArcGIS GeoService', link=True), # It looks like this got changed. Sure, why not?
                 'encoding': 'utf-8',
                 'destination': 'ckan_link',
                 'package': package_id,
@@ -124,7 +144,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_web',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'ArcGIS Hub Dataset', ag_dataset, True)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'ArcGIS Hub Dataset', link=True),
                 'encoding': 'utf-8',
                 'destination': 'ckan_link',
                 'package': package_id,
@@ -136,7 +156,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_web',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'ArcGIS Hub Dataset', ag_dataset, True)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'ArcGIS Hub Dataset', link=True),
                 'encoding': 'utf-8',
                 'destination': 'ckan_link',
                 'package': package_id,
@@ -145,7 +165,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_api',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'ArcGIS GeoService', ag_dataset, True)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'ArcGIS GeoService', link=True),
                 'encoding': 'utf-8',
                 'destination': 'ckan_link',
                 'package': package_id,
@@ -154,7 +174,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_geojson',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'GeoJSON', ag_dataset)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'GeoJSON'),
                 'encoding': 'utf-8',
                 'destination': 'ckan_filestore',
                 'package': package_id,
@@ -163,7 +183,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_csv',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'CSV', ag_dataset)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'CSV'),
                 'encoding': 'utf-8',
                 'schema': schema,
                 'always_wipe_data': True,
@@ -176,7 +196,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_kml',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'KML', ag_dataset)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'KML'),
                 'encoding': 'utf-8',
                 'destination': 'ckan_filestore',
                 'package': package_id,
@@ -185,7 +205,7 @@ def standard_arcgis_job_dicts(data_json_url, data_json_content, arcgis_dataset_t
             {
                 'job_code': f'{base_job_code}_shapefile',
                 'source_type': 'http',
-                'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'Shapefile', ag_dataset)[0],
+                'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'Shapefile'),
                 'encoding': 'binary',
                 'destination': 'ckan_filestore',
                 'package': package_id,
@@ -1,4 +1,4 @@
-import csv, json, requests, sys, traceback, re, time, ckanapi
+import csv, json, sys, traceback, re, time
 from pprint import pprint
 
 from engine.parameters.local_parameters import SOURCE_DIR
@@ -6,15 +6,11 @@ from engine.parameters.remote_parameters import TEST_PACKAGE_ID
 from engine.notify import send_to_slack
 from engine.credentials import site, API_key
 
-try:
-    from icecream import ic
-except ImportError:  # Graceful fallback if IceCream isn't installed.
-    ic = lambda *a: None if not a else (a[0] if len(a) == 1 else a)  # noqa
-
 def get_resource_fields(site, resource_id, API_key=None):
     # Use the datastore_search API endpoint to get the field names (and schema)
     # from the given CKAN resource.
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     response = ckan.action.datastore_search(id=resource_id, limit=0)
     # A typical response is a dictionary like this
     #{u'_links': {u'next': u'/api/action/datastore_search?offset=3',
@@ -45,7 +41,8 @@ def get_resource_data(site, resource_id, API_key=None, count=50, offset=0, field
     # a CKAN resource starting at the given offset and only returning the
     # specified fields in the given order (defaults to all fields in the
     # default datastore order).
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     if fields is None:
         response = ckan.action.datastore_search(id=resource_id, limit=count, offset=offset)
     else:
@@ -93,6 +90,7 @@ def datastore_exists(package_id, resource_name):
     If there should be a datastore but it's inactive, try to restore it. If
     restoration fails, send a notification.
     """
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     from engine.credentials import site, API_key
     resource_id = find_resource_id(package_id, resource_name)
     if resource_id is None:
@@ -105,7 +103,7 @@ def datastore_exists(package_id, resource_name):
         if re.search('datastore/dump', url) is not None:
             # This looks like a resource that has a datastore that is inactive.
             # Try restoring it.
-            ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+            ckan = TracedRemoteCKAN(site, apikey=API_key)
             response = ckan.action.resource_patch(id=resource_id, datastore_active=True)
             if response['datastore_active']:
                 print("Restored inactive datastore.")
@@ -133,8 +131,9 @@ def get_package_parameter(site, package_id, parameter=None, API_key=None):
     # 'name', 'isopen', 'url', 'notes', 'license_title',
     # 'temporal_coverage', 'related_documents', 'license_url',
     # 'organization', 'revision_id'
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     try:
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+        ckan = TracedRemoteCKAN(site, apikey=API_key)
         metadata = ckan.action.package_show(id=package_id)
         if parameter is None:
             return metadata
@@ -153,7 +152,8 @@ def get_resource_parameter(site, resource_id, parameter=None, API_key=None):
     # 'revision_id', 'resource_type'
     # Note that 'size' does not seem to be defined for tabular
     # data on WPRDC.org. (It's not the number of rows in the resource.)
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     metadata = ckan.action.resource_show(id=resource_id)
     if parameter is None:
         return metadata
@@ -161,7 +161,8 @@ def get_resource_parameter(site, resource_id, parameter=None, API_key=None):
         return metadata[parameter]
 
 def set_package_parameters_to_values(site, package_id, parameters, new_values, API_key):
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     original_values = [] # original_values = [get_package_parameter(site, package_id, p, API_key) for p in parameters]
     for p in parameters:
         try:
@@ -181,7 +182,8 @@ def set_resource_parameters_to_values(site, resource_id, parameters, new_values,
 
     This fails if the parameter does not currently exist. (In this case, use
     create_resource_parameter().)"""
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     original_values = [get_resource_parameter(site, resource_id, p, API_key) for p in parameters]
     payload = {}
     payload['id'] = resource_id
@@ -193,27 +195,13 @@ def set_resource_parameters_to_values(site, resource_id, parameters, new_values,
     print(results)
     print("Changed the parameters {} from {} to {} on resource {}".format(parameters, original_values, new_values, resource_id))
 
-def set_resource_description(job, **kwparameters):
-    if hasattr(job, 'resource_description') and job.resource_description is not None:
-        if not kwparameters['use_local_output_file'] and job.destination in ['ckan', 'ckan_filestore']:
-            if kwparameters['test_mode']:
-                assert job.package_id == TEST_PACKAGE_ID # This should be taken care of in etl_util.py
-            ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
-            resource_id = find_resource_id(job.package_id, job.resource_name)
-            if resource_id is not None:
-                existing_resource_description = get_resource_parameter(site, resource_id, 'description', API_key)
-                if existing_resource_description == '':
-                    set_resource_parameters_to_values(site, resource_id, ['description'], [job.resource_description], API_key)
-                    print("Updating the resource description")
-                else:
-                    print(f"Not updating the resource description because existing_resource_description = {existing_resource_description}.")
-
 def get_number_of_rows(resource_id):
     # On other/later versions of CKAN it would make sense to use
     # the datastore_info API endpoint here, but that endpoint is
     # broken on WPRDC.org.
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     try:
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+        ckan = TracedRemoteCKAN(site, apikey=API_key)
         results_dict = ckan.action.datastore_search(resource_id=resource_id, limit=1) # The limit
         # must be greater than zero for this query to get the 'total' field to appear in
         # the API response.
@@ -230,7 +218,8 @@ def query_resource(site, query, API_key=None):
     # Note that this doesn't work for private datasets.
     # The relevant CKAN GitHub issue has been closed.
     # https://github.com/ckan/ckan/issues/1954
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     response = ckan.action.datastore_search_sql(sql=query)
     # A typical response is a dictionary like this
     #{u'fields': [{u'id': u'_id', u'type': u'int4'},
@@ -1,26 +1,25 @@
-import os, ckanapi, re, sys, requests, csv, json, decimal
+import os, re, sys, csv, json, decimal
 from datetime import datetime
 # It's also possible to do this in interactive mode:
 # > sudo su -c "sftp -i /home/sds25/keys/pitt_ed25519 pitt@ftp.pittsburghpa.gov" sds25
 from engine.wprdc_etl import pipeline as pl
-from engine.wprdc_etl.pipeline.schema import NullSchema
 from engine.leash_util import fill_bowl
 from engine.parameters.remote_parameters import TEST_PACKAGE_ID
 from engine.parameters.local_parameters import SETTINGS_FILE
 
-from icecream import ic
-
 from engine.credentials import site, API_key as API_KEY
 from engine.parameters.local_parameters import SOURCE_DIR, WAITING_ROOM_DIR, DESTINATION_DIR
 
 from engine.ckan_util import (set_resource_parameters_to_values,
         set_package_parameters_to_values, find_resource_id, resource_exists,
-        datastore_exists, get_package_parameter, get_resource_parameter,
-        set_resource_description
+        datastore_exists, get_package_parameter, get_resource_parameter
 )
 
 BASE_URL = 'https://data.wprdc.org/api/3/action/'
 
+BULK_LOAD_ROW_THRESHOLD = 250000 # Jobs that replace all the records in a datastore with more
+# than this many (estimated) records are bulk-loaded (see Job.should_bulk_load).
+
 def write_to_csv(filename, list_of_dicts, keys=None):
     if keys is None: # Extract fieldnames if none were passed.
         print(f'Since keys == None, write_to_csv is inferring the fields to write from the list of dicts.')
@@ -53,6 +52,7 @@ def simplify_string(s):
 def download_file_to_path(url, local_dir, path = SOURCE_DIR):
     """Stream the file to disk without using excessive memory."""
     # From https://stackoverflow.com/a/39217788
+    import requests
     import shutil
 
     local_filepath = f"{local_dir}/{url.split('/')[-1]}"
@@ -76,9 +76,11 @@ def save_to_waiting_room(list_of_dicts, resource_id, resource_name):
     return filepath
 
 def get_data_dictionary(resource_id):
+    import ckanapi
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     from engine.credentials import site, API_key
     try:
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+        ckan = TracedRemoteCKAN(site, apikey=API_key)
         results = ckan.action.datastore_search(resource_id=resource_id)
         return results['fields']
     except ckanapi.errors.NotFound: # Either the resource doesn't exist, or it doesn't have a datastore.
@@ -88,13 +90,15 @@ def set_data_dictionary(resource_id, old_fields):
     # Here "old_fields" needs to be in the same format as the data dictionary
     # returned by get_data_dictionary: a list of type dicts and info dicts.
     # Though the '_id" field needs to be removed for this to work.
+    import ckanapi
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     from engine.credentials import site, API_key
     if old_fields[0]['id'] == '_id':
         old_fields = old_fields[1:]
 
     # Note that a subset can be sent, and they will update part of
     # the integrated data dictionary.
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     present_fields = get_data_dictionary(resource_id)
     new_fields = []
     # Attempt to restore data dictionary, taking into account the deletion and addition of fields, and ignoring any changes in type.
@@ -114,6 +118,130 @@ def set_data_dictionary(resource_id, old_fields):
 
     return results
 
+DATASTORE_TYPE_NAMES = {'int': 'int4', 'float': 'float8'} # The names that the datastore reports some CKAN field types by
+
+def mistyped_fields(resource_id, fields):
+    """Compare the column types of a datastore to the types of a list of CKAN
+    fields (like the ones returned by serialize_to_ckan_fields).
+
+    Returns:
+        The IDs of the fields whose columns have some other type
+    """
+    present_types = {f['id']: f['type'] for f in get_data_dictionary(resource_id) or []}
+    return [f['id'] for f in fields if f['id'] in present_types
+        and present_types[f['id']] != DATASTORE_TYPE_NAMES.get(f['type'], f['type'])]
+
+def set_type_overrides(resource_id, fields):
+    """Set the type_override of each field in a datastore's data dictionary to
+    the field's type (from a list of CKAN fields), so that the next time the
+    Express Loader loads the resource's file, it gives the columns those types
+    (rather than loading everything as text).
+
+    Returns:
+        False if the resource has no datastore (so nothing could be set)
+    """
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    from engine.credentials import site, API_key
+    present_fields = get_data_dictionary(resource_id)
+    if present_fields is None:
+        return False
+    types = {f['id']: f['type'] for f in fields}
+    new_fields = []
+    for field in present_fields:
+        if field['id'] != '_id':
+            info = dict(field.get('info') or {})
+            if field['id'] in types:
+                info['type_override'] = types[field['id']]
+            new_fields.append(dict(field, info=info))
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
+    ckan.action.datastore_create(resource_id=resource_id, fields=new_fields, force=True)
+    return True
+
+def express_load_file(csv_file_path, package_id, resource_name, resource_id=None):
+    """Upload a CSV file to a CKAN resource (creating the resource if necessary),
+    so that CKAN loads the whole file into the datastore at once. This is faster
+    (particularly for large files) than upserting the records in chunks and avoids
+    504 errors and unneeded API requests.
+
+    The resource ID can be passed if the caller has already looked it up.
+
+    Returns:
+        The resource ID
+    """
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    from engine.credentials import site, API_key
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
+    if resource_id is None:
+        resource_id = find_resource_id(package_id, resource_name)
+
+    if resource_id is None:
+        # If the resource does not already exist, create it.
+        print(f"Unable to find a resource with name '{resource_name}' in package with ID {package_id}.")
+        print(f"Creating new resource, and uploading CSV file {csv_file_path} to resource with name '{resource_name}' in package with ID {package_id}.")
+        with open(csv_file_path, 'r') as f:
+            resource_as_dict = ckan.action.resource_create(package_id=package_id,
+                name = resource_name,
+                upload=f)
+        return resource_as_dict['id']
+
+    print(f"Uploading CSV file {csv_file_path} to resource with name '{resource_name}' in package with ID {package_id}.")
+    with open(csv_file_path, 'r') as f:
+        resource_as_dict = ckan.action.resource_patch(id = resource_id,
+            upload=f)
+    # Running resource_update once sets the file to the correct file and triggers some datastore action and
+    # the Express Loader, but for some reason, it seems to be processing the old file.
+
+    # So instead, let's run resource_patch (which just sets the file) and then run resource_update.
+    with open(csv_file_path, 'r') as f:
+        resource_as_dict = ckan.action.resource_update(id = resource_id,
+            upload=f)
+    return resource_id
+
+def wait_for_datastore_load(resource_id, expected_rows, started_at, timeout=3600, poll_interval=15):
+    """Wait until CKAN has finished loading an uploaded file into the datastore.
+
+    The status of the Express Loader job is checked (via xloader_status) until
+    a job that was last updated after started_at (a naive UTC datetime) is
+    complete. If xloader_status is not available, this just waits until the
+    datastore has the expected number of rows.
+
+    Raises:
+        RuntimeError if the load fails, times out, or results in the wrong number of rows
+
+    Returns:
+        The number of rows in the datastore
+    """
+    import ckanapi
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    import time
+    from dateutil import parser
+    from engine.credentials import site, API_key
+    from engine.ckan_util import get_number_of_rows
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
+    deadline = time.time() + timeout
+    use_loader_status = True
+    while time.time() < deadline:
+        time.sleep(poll_interval)
+        if use_loader_status:
+            try:
+                status = ckan.action.xloader_status(resource_id=resource_id)
+            except ckanapi.errors.CKANAPIError:
+                print("xloader_status is not available, so the row count will be polled instead.")
+                use_loader_status = False
+                continue
+            if status.get('last_updated') is None or parser.parse(status['last_updated']) < started_at:
+                continue # The load of the new file hasn't started yet.
+            if status['status'] == 'error':
+                raise RuntimeError(f"Loading the file into the datastore for resource ID {resource_id} failed: {status.get('task_info')}")
+            if status['status'] != 'complete':
+                continue
+        rows = get_number_of_rows(resource_id)
+        if rows == expected_rows:
+            return rows
+        if use_loader_status:
+            raise RuntimeError(f"The datastore for resource ID {resource_id} has {rows} rows rather than the {expected_rows} rows that were uploaded.")
+    raise RuntimeError(f"Timed out waiting for the datastore for resource ID {resource_id} to be loaded.")
+
 def scientific_notation_to_integer(s):
     # Source files may contain scientific-notation representations of
     # what should be integers (e.g., '2e+05'). This function can be
@@ -121,7 +249,8 @@ def scientific_notation_to_integer(s):
     return int(decimal.Decimal(s))
 
 def add_datatable_view(resource, job):
-    r = requests.post(
+    from engine.wprdc_etl.pipeline.ckan_trace import traced_post
+    r = traced_post(
         BASE_URL + 'resource_create_default_resource_views',
         json={
             'resource': resource,
@@ -138,30 +267,34 @@ def add_datatable_view(resource, job):
 
 def configure_datatable(view, job):
     # setup new view
+    from engine.wprdc_etl.pipeline.ckan_trace import traced_post
     view['col_reorder'] = True
     view['export_buttons'] = True
     view['responsive'] = False
-    r = requests.post(BASE_URL + 'resource_view_update', json=view, headers={"Authorization": API_KEY}, verify=job.verify_requests)
+    r = traced_post(BASE_URL + 'resource_view_update', json=view, headers={"Authorization": API_KEY}, verify=job.verify_requests)
 
 def reorder_views(resource, views, job):
+    from engine.wprdc_etl.pipeline.ckan_trace import traced_post
     resource_id = resource['id']
 
     temp_view_list = [view_item['id'] for view_item in views if
                       view_item['view_type'] not in ('datatables_view',)]
 
     new_view_list = [datatable_view['id']] + temp_view_list
-    r = requests.post(BASE_URL + 'resource_view_reorder', json={'id': resource_id, 'order': new_view_list},
+    r = traced_post(BASE_URL + 'resource_view_reorder', json={'id': resource_id, 'order': new_view_list},
                       headers={"Authorization": API_KEY}, verify=job.verify_requests)
 
 def deactivate_datastore(resource):
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     from engine.credentials import site, API_key
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     set_resource_parameters_to_values(site, resource['id'], ['datastore_active'], [False], API_key)
     # How does this differ from deleting the datastore?
 
 def query_resource(site,query,API_key=None):
     """Use the datastore_search_sql API endpoint to query a CKAN resource."""
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     response = ckan.action.datastore_search_sql(sql=query)
     # A typical response is a dictionary like this
     #{u'fields': [{u'id': u'_id', u'type': u'int4'},
@@ -192,8 +325,9 @@ def get_package_id(job, test_mode):
     return job.production_package_id if not test_mode else TEST_PACKAGE_ID
 
 def delete_datatable_views(resource_id):
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     from engine.credentials import site, API_key
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     resource = get_resource_by_id(resource_id)
     extant_views = ckan.action.resource_view_list(id=resource_id)
     if len(extant_views) > 0:
@@ -243,13 +377,14 @@ def create_data_table_view(resource, job):
 
         #good_resources = [resource for resource in resources
         #                  if resource['format'].lower() == 'csv' and resource['url_type'] in ('datapusher', 'upload')]
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     from engine.credentials import site, API_key
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     resource_id = resource['id']
-    extant_views = ckan.action.resource_view_list(id=resource_id)
     title = 'Data Table'
 
-    if resource['format'].lower() == 'csv' and resource['url_type'] in ('datapusher', 'upload') and resource['datastore_active']:
+    if resource['format'].lower() == 'csv' and resource['url_type'] in ('datapusher', 'upload') and resource.get('datastore_active'):
+        extant_views = ckan.action.resource_view_list(id=resource_id) # (Only resources that could get a view are checked.)
         if 'datatables_view' not in [v['view_type'] for v in extant_views]:
             print("Adding view for {}".format(resource['name']))
             datatable_view = add_datatable_view(resource, job)[0]
@@ -279,39 +414,35 @@ def create_data_table_view(resource, job):
     #    #result = ckan.action.resource_view_create(resource_id = resource_id, title="Data Table", view_type='datatables_view', config=json.dumps(config_dict))
     #    result = ckan.action.resource_view_create(resource_id=resource_id, title="Data Table", view_type='datatables_view')
 
-def add_tag(package, tag='_etl'):
-    tag_dicts = package['tags']
+def add_tag(package, changes, tag='_etl'):
+    """Add a tag to the package (in the dict of changes to be patched)."""
+    tag_dicts = changes.get('tags', package['tags'])
     tags = [td['name'] for td in tag_dicts]
     if tag not in tags:
-        from engine.credentials import site, API_key
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
-        new_tag_dict = {'name': tag}
-        tag_dicts.append(new_tag_dict)
-        set_package_parameters_to_values(site,package['id'],['tags'],[tag_dicts],API_key)
+        changes['tags'] = tag_dicts + [{'name': tag}]
 
 def convert_extras_dict_to_list(extras):
     extras_list = [{'key': ekey, 'value': evalue} for ekey,evalue in extras.items()]
     return extras_list
 
-def set_extra_metadata_field(package,key,value):
-    if 'extras' in package:
-        extras_list = package['extras']
-        # Keep definitions and uses of extras metadata updated here:
-        # https://github.com/WPRDC/data-guide/blob/master/docs/metadata_extras.md
+def get_extras(package, changes):
+    # Keep definitions and uses of extras metadata updated here:
+    # https://github.com/WPRDC/data-guide/blob/master/docs/metadata_extras.md
 
-        # The format as obtained from the CKAN API is like this:
-        #       u'extras': [{u'key': u'dcat_issued', u'value': u'2014-01-07T15:27:45.000Z'}, ...
-        # not a dict, but a list of dicts.
-        extras = {d['key']: d['value'] for d in extras_list}
-    else:
-        extras = {}
+    # The format as obtained from the CKAN API is like this:
+    #       u'extras': [{u'key': u'dcat_issued', u'value': u'2014-01-07T15:27:45.000Z'}, ...
+    # not a dict, but a list of dicts.
+    extras_list = changes.get('extras', package.get('extras', []))
+    return {d['key']: d['value'] for d in extras_list}
 
+def set_extra_metadata_field(package, changes, key, value):
+    """Set an extras metadata field of the package (in the dict of changes
+    to be patched, which may already have other changes to the extras)."""
+    extras = get_extras(package, changes)
     extras[key] = value
-    extras_list = convert_extras_dict_to_list(extras)
-    from engine.credentials import site, API_key
-    set_package_parameters_to_values(site,package['id'],['extras'],[extras_list],API_key)
+    changes['extras'] = convert_extras_dict_to_list(extras)
 
-def add_time_field(package, resource, job):
+def add_time_field(package, resource, job, changes):
     if job.time_field is None:
         # Note that if the job does not specify a time_field or gives a time_field of None,
         # add_time_field is currently not checking this against what's in the CKAN package
@@ -319,18 +450,7 @@ def add_time_field(package, resource, job):
         # resources with time_fields and add them to the ETL jobs (which in some cases
         # will necessitate migrating the job to rocket-etl, which may not be trivial).
         return
-    if 'extras' in package:
-        extras_list = package['extras']
-        # Keep definitions and uses of extras metadata updated here:
-        # https://github.com/WPRDC/data-guide/blob/master/docs/metadata_extras.md
-
-        # The format as obtained from the CKAN API is like this:
-        #       u'extras': [{u'key': u'dcat_issued', u'value': u'2014-01-07T15:27:45.000Z'}, ...
-        # not a dict, but a list of dicts.
-        extras = {d['key']: d['value'] for d in extras_list}
-    else:
-        extras = {}
-
+    extras = get_extras(package, changes)
     if 'time_field' in extras:
         time_field_by_resource_id = json.loads(extras['time_field'])
         # The time_field metadata is a dict where resource IDs are the keys, and
@@ -345,30 +465,62 @@ def add_time_field(package, resource, job):
         time_field_by_resource_id = {resource['id']: job.time_field}
 
     print(f"Setting time_field to {time_field_by_resource_id}.")
-    set_extra_metadata_field(package, 'time_field', json.dumps(time_field_by_resource_id))
+    set_extra_metadata_field(package, changes, 'time_field', json.dumps(time_field_by_resource_id))
 
-def update_etl_timestamp(package,resource):
-    from engine.credentials import site, API_key
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
-    set_extra_metadata_field(package,key='last_etl_update',value=datetime.now().isoformat())
+def update_etl_timestamp(package, changes):
+    set_extra_metadata_field(package, changes, key='last_etl_update', value=datetime.now().isoformat())
     # Keep definitions and uses of extras metadata updated here:
     # https://github.com/WPRDC/data-guide/blob/master/docs/metadata_extras.md
 
+def set_resource_description(resource, job, changes, **kwparameters):
+    """Set the description of the resource (in the dict of changes to be
+    patched) if the job has one and the resource's description is empty."""
+    if getattr(job, 'resource_description', None) is not None:
+        if not kwparameters.get('use_local_output_file', False) and job.destination in ['ckan', 'ckan_filestore']:
+            if kwparameters.get('test_mode', False):
+                assert job.package_id == TEST_PACKAGE_ID # This should be taken care of in etl_util.py
+            existing_resource_description = resource.get('description', '')
+            if existing_resource_description == '':
+                changes['description'] = job.resource_description
+                print("Updating the resource description")
+            else:
+                print(f"Not updating the resource description because existing_resource_description = {existing_resource_description}.")
+
 def get_resource_by_id(resource_id):
     """Get all metadata for a given resource."""
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     from engine.credentials import site, API_key
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     return ckan.action.resource_show(id=resource_id)
 
 def get_package_by_id(package_id):
     """Get all metadata for a given resource."""
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     from engine.credentials import site, API_key
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     return ckan.action.package_show(id=package_id)
 
-def create_data_table_view_if_needed(resource_id, job):
-    """Create a DataTable view if the resource has a datastore."""
+def find_package_and_resource(resource_id, job):
+    """Fetch the metadata of the resource and its package, usually with just
+    a package_show (of the job's package). If the resource isn't in the
+    job's package, it's looked up with a resource_show.
+
+    Returns:
+        The package and resource metadata (with None for either one
+        that can't be found)
+    """
+    import ckanapi
     import time
+    package_id = getattr(job, 'package_id', None)
+    if package_id is not None:
+        try:
+            package = get_package_by_id(package_id)
+        except ckanapi.errors.NotFound:
+            package = None
+        if package is not None:
+            for resource in package.get('resources', []):
+                if resource['id'] == resource_id:
+                    return package, resource
     try:
         resource = get_resource_by_id(resource_id)
     except ckanapi.errors.NotFound:
@@ -377,25 +529,56 @@ def create_data_table_view_if_needed(resource_id, job):
             resource = get_resource_by_id(resource_id)
         except ckanapi.errors.NotFound:
             print("Unable to perform resource-level post-processing, as this resource does not exist.")
-            resource = None
-    if resource is not None:
-        package_id = resource['package_id']
-        create_data_table_view(resource, job)
-        try:
-            package = get_package_by_id(package_id)
-        except ckanapi.errors.NotFound:
-            print("Unable to perform package-level post-processing, as this package does not exist.")
-        else:
-            return package, resource
-    return None, None
+            return None, None
+    try:
+        package = get_package_by_id(resource['package_id'])
+    except ckanapi.errors.NotFound:
+        print("Unable to perform package-level post-processing, as this package does not exist.")
+        return None, resource
+    return package, resource
+
+def create_data_table_view_if_needed(resource_id, job):
+    """Create a DataTable view if the resource has a datastore.
+
+    Returns:
+        The package and resource metadata (or None, None if either one
+        can't be found)
+    """
+    package, resource = find_package_and_resource(resource_id, job)
+    if resource is None:
+        return None, None
+    create_data_table_view(resource, job)
+    if package is None:
+        return None, None
+    return package, resource
 
 def post_process(resource_id, job, **kwparameters):
+    """Update the metadata of the package and resource after a job has run.
+
+    All the changes (the _etl tag, the last_etl_update and time_field extras,
+    and the resource description) are worked out from the package and
+    resource metadata fetched by create_data_table_view_if_needed and then
+    applied with one package_patch call and (only if the resource changed)
+    one resource_patch call, so post-processing usually takes a
+    package_show and a package_patch (plus a resource_view_list for
+    datastore resources).
+    """
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     package, resource = create_data_table_view_if_needed(resource_id, job)
     if resource is not None and package is not None:
-        add_tag(package, '_etl')
-        update_etl_timestamp(package, resource)
-        add_time_field(package, resource, job)
-        set_resource_description(job, **kwparameters)
+        package_changes, resource_changes = {}, {}
+        add_tag(package, package_changes, '_etl')
+        update_etl_timestamp(package, package_changes)
+        add_time_field(package, resource, job, package_changes)
+        set_resource_description(resource, job, resource_changes, **kwparameters)
+
+        from engine.credentials import site, API_key
+        ckan = TracedRemoteCKAN(site, apikey=API_key)
+        ckan.action.package_patch(id=package['id'], **package_changes)
+        print(f"Changed the parameters {sorted(package_changes)} on package {package['id']}")
+        if resource_changes:
+            ckan.action.resource_patch(id=resource['id'], **resource_changes)
+            print(f"Changed the parameters {sorted(resource_changes)} on resource {resource['id']}")
         if job.make_datastore_queryable:
             fill_bowl(resource_id)
 
@@ -470,14 +653,42 @@ def fetch_city_file(jobject):
 
 #############################################
 
+class LazyField:
+    """A job_dict value that isn't computed (by calling the function with
+    the given arguments) until the job is run, so that slow lookups (like
+    finding a source URL in an ArcGIS catalog) only happen for the jobs that
+    are selected.
+
+    Example:
+        'source_full_url': LazyField(find_the_url, 'Pittsburgh Steps'),
+    """
+    def __init__(self, function, *args, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+    def resolve(self):
+        return self.function(*self.args, **self.kwargs)
+
+    def __repr__(self):
+        return f'LazyField({getattr(self.function, "__name__", self.function)})'
+
+LAZY_FIELD_ATTRIBUTES = {'package': 'production_package_id'} # Job attributes that aren't named after their job_dict fields
+
 class Job:
     # It may be a good idea to make a BaseJob and then add different features
     # based on source_type.
     def __init__(self, job_dict):
+        self.lazy_fields = {k: v for k, v in job_dict.items() if isinstance(v, LazyField)} # These are
+        # resolved by configure_pipeline_with_options (and their attributes are None until then).
+        for key in ['job_code', 'job_directory']: # These identify the job before it's run.
+            if key in self.lazy_fields:
+                raise ValueError(f"The '{key}' field of a job can't be a LazyField (like {self.lazy_fields[key]}).")
+        job_dict = {k: v for k, v in job_dict.items() if k not in self.lazy_fields}
         self.job_directory = job_dict['job_directory']
         self.source_type = job_dict['source_type']
         self.source_full_url = job_dict['source_full_url'] if 'source_full_url' in job_dict else None
-        self.source_file = job_dict['source_file'] if 'source_file' in job_dict else job_dict['source_full_url'].split('/')[-1] if 'source_full_url' in job_dict else None
+        self.source_file = job_dict['source_file'] if 'source_file' in job_dict else None
         self.source_dir = job_dict['source_dir'] if 'source_dir' in job_dict else ''
         self.source_site = job_dict['source_site'] if 'source_site' in job_dict else None
         self.verify_requests = not job_dict['ignore_certificate_errors'] if 'ignore_certificate_errors' in job_dict else True
@@ -490,8 +701,17 @@ class Job:
         self.custom_parameters = job_dict['custom_parameters'] if 'custom_parameters' in job_dict else {}
         self.make_datastore_queryable = job_dict['make_datastore_queryable'] if 'make_datastore_queryable' in job_dict else False
         self.custom_post_processing = job_dict['custom_post_processing'] if 'custom_post_processing' in job_dict else (lambda *args, **kwargs: None)
-        self.schema = job_dict['schema'] if 'schema' in job_dict and job_dict['schema'] is not None else NullSchema
+        self.schema = job_dict['schema'] if 'schema' in job_dict and job_dict['schema'] is not None else pl.NullSchema
         self.filters = job_dict['filters'] if 'filters' in job_dict else []
+        self.columnar = job_dict.get('columnar', False) # Queue validated records column-wise (which uses less memory for numeric data).
+        self.compress_upserts = job_dict.get('compress_upserts', False) # Gzip the bodies of datastore_upsert requests.
+        self.bulk_load = job_dict.get('bulk_load', None) # None means bulk-load the data only if the job is big enough.
+        self.delta_upserts = job_dict.get('delta_upserts', False) # Only upsert records that are new or have changed since the last run.
+        self.delete_vanished_rows = job_dict.get('delete_vanished_rows', False) # With delta_upserts, delete records that have vanished from the source.
+        self.swap_on_wipe = job_dict.get('swap_on_wipe', False) # Wipe data by loading a staging resource and then swapping it in.
+        self.spool_chunks = job_dict.get('spool_chunks', False) # Spool validated records to disk (for replaying failed datastore loads).
+            # This is opt-in, since it writes a compressed copy of every record loaded to the waiting room.
+        self.dead_letter_records = job_dict.get('dead_letter_records', False) # Write records that the datastore rejects to a file and load the rest.
         self.primary_key_fields = job_dict['primary_key_fields'] if 'primary_key_fields' in job_dict else None
         self.time_field = job_dict['time_field'] if 'time_field' in job_dict else None # Specify the field that provides a good temporal key.
         self.upload_method = job_dict['upload_method'] if 'upload_method' in job_dict else None
@@ -504,25 +724,73 @@ class Job:
             # file ever appears.)
 
         self.destination = job_dict['destination'] if 'destination' in job_dict else 'ckan'
+        self.extra_destinations = [] # Destinations (besides self.destination) fed by the same extraction
+        if 'destinations' in job_dict: # Each destination can be a string or a dict of destination-specific
+            # options (like {'destination': 'ckan_filestore', 'resource_name': 'Raw Data'}).
+            destinations = [d if isinstance(d, dict) else {'destination': d} for d in job_dict['destinations']]
+            primary = next((d for d in destinations if d['destination'] != 'ckan_filestore'), destinations[0]) # The
+                # primary destination determines the extractor, so prefer one that takes records.
+            self.destination = primary['destination']
+            self.extra_destinations = [d for d in destinations if d is not primary]
+            names = [d['destination'] for d in destinations]
+            duplicates = sorted(set(name for name in names if names.count(name) > 1))
+            if duplicates: # Loaders, metrics, and locators are all keyed by destination.
+                raise ValueError(f"Each destination can only be listed once, but {', '.join(duplicates)} appears more than once in {names}.")
         self.destination_file = job_dict.get('destination_file', None)
+        for d in self.extra_destinations:
+            if d['destination'] == 'file': # The source file's name could end in .xlsx or .json, which the file loaders can't write.
+                destination_file = d.get('destination_file', self.destination_file)
+                if destination_file is None or destination_file.split('.')[-1].lower() not in ['csv', 'parquet']:
+                    raise ValueError(f"An additional file destination needs a destination_file that ends in .csv or .parquet (not {destination_file}).")
         self.production_package_id = job_dict['package'] if 'package' in job_dict else None
         self.resource_name = job_dict['resource_name'] if 'resource_name' in job_dict else None # resource_name is expecting to have a string value
         # for use in naming pipelines. For non-CKAN destinations, this field could be eliminated, but then a different field (like job_code)
         # should be used instead.
         self.resource_description = job_dict['resource_description'] if 'resource_description' in job_dict else None
         self.job_code = job_dict.get('job_code', job_dict.get('resource_name', None)) # If there's no job_code, use the resource_name.
+        self.depends_on = job_dict.get('depends_on', []) # The codes of jobs that must succeed before this one
+        # can be run (when launchpad runs jobs in parallel).
+        if isinstance(self.depends_on, str):
+            self.depends_on = [self.depends_on]
 
+        from icecream import ic # (Imported here since it's slow to import.)
         ic(self.job_code, self.resource_name)
         #self.clear_first = job['clear_first'] if 'clear_first' in job else False
-        self.target, self.local_directory = local_file_and_dir(self, base_dir = SOURCE_DIR)
-        self.local_cache_filepath = self.local_directory + self.source_file
+        if not {'source_file', 'source_full_url'} & set(self.lazy_fields):
+            self.set_source_paths()
+        for key in self.lazy_fields:
+            if LAZY_FIELD_ATTRIBUTES.get(key, key) not in self.__dict__:
+                raise ValueError(f"The '{key}' field of job {self.job_code} can't be a LazyField.")
 
         self.loader_config_string = 'production' # Note that loader_config_string's use
         # can be seen in the load() function of Pipeline from wprdc-etl.
+        self.metrics = {} # The counts gathered by the last pipeline run (like records_loaded).
+
+    def set_source_paths(self):
+        """Derive the source filename (from source_full_url, if it's not
+        given) and the local paths for the source file."""
+        if self.source_file is None and self.source_full_url is not None:
+            self.source_file = self.source_full_url.split('/')[-1]
+        self.multiple_files = self.source_type == 'local' and self.source_file is not None and any(c in self.source_file for c in '*?[')
+            # For local sources, a glob pattern (like 'snow_plow_data/*.geojson') selects all the matching files, each of
+            # which is loaded to its own resource. (Remote filenames can contain these characters, as in query strings.)
+        self.target, self.local_directory = local_file_and_dir(self, base_dir = SOURCE_DIR)
+        self.local_cache_filepath = self.local_directory + self.source_file
+
+    def resolve_lazy_fields(self):
+        """Compute the values of the job_dict's LazyFields."""
+        if not self.lazy_fields:
+            return
+        for key, lazy_field in self.lazy_fields.items():
+            setattr(self, LAZY_FIELD_ATTRIBUTES.get(key, key), lazy_field.resolve())
+        self.lazy_fields = {}
+        self.set_source_paths()
 
     def select_extractor(self):
         extension = (self.source_file.split('.')[-1]).lower()
-        if self.destination == 'ckan_filestore': # If destination == 'ckan_filestore' (meaning there's no schema)
+        if self.multiple_files:
+            self.extractor = pl.MultiFileExtractor
+        elif self.destination == 'ckan_filestore': # If destination == 'ckan_filestore' (meaning there's no schema)
             self.extractor = pl.FileExtractor # we just want to extract the file, not tabular data.
         elif extension == 'csv':
             self.extractor = pl.CSVExtractor
@@ -534,6 +802,8 @@ class Job:
             self.extractor = pl.ExcelExtractor
         elif extension in ['zip']:
             self.extractor = pl.CompressedFileExtractor
+        elif extension in ['parquet']:
+            self.extractor = pl.ParquetExtractor
         else:
             self.extractor = pl.FileExtractor
 
@@ -552,6 +822,7 @@ class Job:
         test_mode = kwargs['test_mode']
 
         print("==============\n" + self.job_code)
+        self.resolve_lazy_fields()
         if self.production_package_id == TEST_PACKAGE_ID:
             print(" *** Note that this job currently only writes to the test package. ***")
 
@@ -582,7 +853,7 @@ class Job:
                 self.target = self.source_file
                 self.source_connector = pl.GoogleCloudStorageFileConnector
             elif self.source_type == 'local':
-                self.source_connector = pl.FileConnector
+                self.source_connector = pl.DirectoryConnector if self.multiple_files else pl.FileConnector
             else:
                 raise ValueError("The source_type {} has no specified connector in default_job_setup().".format(self.source_type))
         else:
@@ -603,6 +874,18 @@ class Job:
 
         if use_local_output_file:
             self.destination = 'file'
+            self.extra_destinations = []
+
+        self.cache_download = False
+        self.source_filepath = None # Where the source file can be found on disk after extraction
+        if any(d['destination'] == 'ckan_filestore' for d in self.extra_destinations):
+            if self.source_type == 'local':
+                self.source_filepath = self.target
+            elif self.source_type in ['http', 'sftp']:
+                self.cache_download = True
+                self.source_filepath = self.local_cache_filepath
+            else:
+                raise ValueError(f"The source file of {self.job_code} can't be uploaded to the filestore while it's being extracted, since {self.source_type} sources are not cached locally.")
 
         if self.destination == 'file' and self.destination_file is None:
             # Situations where it would be a good idea to just copy the source_file value over to destination_file
@@ -624,6 +907,7 @@ class Job:
         self.package_id = get_package_id(self, test_mode) # This is the effective package ID,
         # taking into account whether test mode is active.
 
+        from icecream import ic
         ic(self.__dict__)
         ## END SET DESTINATION PROPERTIES ##
 
@@ -663,17 +947,152 @@ class Job:
 
             # [ ] Also, it really seems that always_clear_first should become always_wipe_data.
 
-    def run_pipeline(self, clear_first, wipe_data, migrate_schema, retry_without_last_line=False, ignore_empty_rows=False):
+    def estimate_row_count(self):
+        """Estimate the number of records in a local CSV source file from its
+        size and the average length of its first lines (without reading the
+        whole file).
+
+        Returns:
+            The estimated number of records, or None if it can't be estimated
+        """
+        if self.source_connector != pl.FileConnector or self.target is None:
+            return None
+        if not self.target.lower().endswith('.csv') or not os.path.isfile(self.target):
+            return None
+        size = os.path.getsize(self.target)
+        with open(self.target, 'rb') as f:
+            sample = f.read(64*1024)
+        line_count = sample.count(b'\n')
+        if line_count == 0:
+            return None
+        return max(0, int(size*line_count/len(sample)) - 1) # Don't count the header.
+
+    def should_bulk_load(self, clear_first, wipe_data):
+        """Decide whether to write the records to a local CSV file and upload it
+        once (letting CKAN load it into the datastore) rather than upserting them
+        in chunks.
+
+        Since a bulk load replaces the whole table (and the table it creates has no
+        primary key), it's only done automatically for jobs without primary keys
+        that replace all the records anyway and that have more than
+        BULK_LOAD_ROW_THRESHOLD (estimated) records. Setting bulk_load in the
+        job_dict to True or False overrides this. (Jobs with more than one
+        destination are never bulk-loaded.)
+        """
+        if self.destination != 'ckan' or self.extra_destinations:
+            return False
+        if self.bulk_load is not None:
+            return self.bulk_load
+        if self.primary_key_fields is not None or self.filters not in [None, []]:
+            return False
+        estimated_rows = self.estimate_row_count()
+        if estimated_rows is None or estimated_rows <= BULK_LOAD_ROW_THRESHOLD:
+            return False
+        if not (clear_first or wipe_data or not datastore_exists(self.package_id, self.resource_name)):
+            return False
+        print(f"Since the source file has about {estimated_rows} rows, the records will be bulk-loaded.")
+        return True
+
+    def bulk_load_file(self, csv_file_path, record_count):
+        """Upload the CSV file written by a bulk-loading pipeline, wait for CKAN to
+        load it into the datastore, restore the data dictionary, and delete the file.
+
+        Since the Express Loader loads every column as text unless the data
+        dictionary overrides its type, the schema's types are set as overrides
+        before the upload (or, if there was no datastore yet, after the first load,
+        which is then repeated).
+
+        Raises:
+            RuntimeError if the columns still don't have the schema's types
+
+        Returns:
+            The resource ID
+        """
+        from datetime import datetime as dt
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+        resource_id = find_resource_id(self.package_id, self.resource_name)
+        saved_data_dictionary = getattr(self, 'saved_data_dictionary', None)
+        if saved_data_dictionary is None and resource_id is not None:
+            saved_data_dictionary = get_data_dictionary(resource_id)
+        fields = self.schema().serialize_to_ckan_fields()
+        if resource_id is not None:
+            set_type_overrides(resource_id, fields)
+        started_at = dt.utcnow()
+        resource_id = express_load_file(csv_file_path, self.package_id, self.resource_name, resource_id)
+        wait_for_datastore_load(resource_id, record_count, started_at)
+        if mistyped_fields(resource_id, fields):
+            print("Reloading the datastore to give its columns the types in the schema.")
+            set_type_overrides(resource_id, fields)
+            started_at = dt.utcnow()
+            TracedRemoteCKAN(site, apikey=API_KEY).action.xloader_submit(resource_id=resource_id, ignore_hash=True)
+            wait_for_datastore_load(resource_id, record_count, started_at)
+            mistyped = mistyped_fields(resource_id, fields)
+            if mistyped:
+                raise RuntimeError(f"After the bulk load, these fields of resource ID {resource_id} don't have the types in the schema: {', '.join(mistyped)}")
+        if saved_data_dictionary:
+            set_data_dictionary(resource_id, saved_data_dictionary)
+        print(f"Removing temp file at {csv_file_path}")
+        os.remove(csv_file_path)
+        return resource_id
+
+    def extra_destination_loaders(self, clear_first, wipe_data):
+        """Configure a loader for each of the destinations besides the primary
+        one (self.destination), which are fed by the same extraction.
+
+        Returns:
+            A dict mapping each destination name to a two-tuple of a Loader class
+            and its keyword arguments (as expected by pl.MultiLoader)
+        """
+        loaders = {}
+        for d in self.extra_destinations:
+            name = d['destination']
+            if name == 'file':
+                destination_file = d.get('destination_file', self.destination_file)
+                if destination_file[0] != '/':
+                    destination_file = f'{DESTINATION_DIR}{self.job_directory}/{destination_file}'
+                os.makedirs(os.path.dirname(destination_file), exist_ok=True)
+                file_format = destination_file.split('.')[-1].lower()
+                if file_format == 'parquet':
+                    loader, method = pl.ParquetFileLoader, 'insert'
+                elif self.primary_key_fields and self.upload_method in ['upsert', None]:
+                    loader, method = pl.SQLiteFileLoader, 'upsert'
+                else:
+                    loader, method = pl.TabularFileLoader, 'insert'
+                loaders[name] = (loader, {'filepath': destination_file,
+                    'file_format': file_format,
+                    'fields': self.schema().serialize_to_ckan_fields(),
+                    'key_fields': self.primary_key_fields,
+                    'method': method,
+                    'clear_first': clear_first,
+                    'wipe_data': wipe_data})
+            elif name == 'ckan_filestore':
+                loaders[name] = (pl.CKANFilestoreLoader, {'filepath': self.source_filepath,
+                    'file_format': self.source_file.split('.')[-1].lower(),
+                    'package_id': self.package_id,
+                    'resource_name': d.get('resource_name', f'{self.resource_name} (source file)'),
+                    'verify_requests': self.verify_requests})
+            else:
+                raise ValueError(f"{name} can't be used as an additional destination.")
+        return loaders
+
+    def run_pipeline(self, clear_first, wipe_data, migrate_schema, retry_without_last_line=False, ignore_empty_rows=False, parallel_parse=False, replay=False):
         # target is a filepath which is actually the source filepath.
 
+        # The replay option loads the validated records spooled by the last
+        # run instead of fetching, extracting, and validating the source.
+
         # The retry_without_last_line option is a way of dealing with CSV files
         # that abruptly end mid-line.
+
+        # The parallel_parse option lets the pipeline split large local CSV files
+        # into byte ranges which are parsed and validated on all available cores.
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
         locators_by_destination = {}
 
         if self.destination == 'ckan_link': # Handle special case of just wanting to make a resource that is just a hyperlink
             # which really doesn't need a full pipeline at this point.
             from engine.credentials import site, API_key
-            ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+            ckan = TracedRemoteCKAN(site, apikey=API_key)
             resource_id = find_resource_id(self.package_id, self.resource_name)
             if resource_id is None:
                 resource_as_dict = ckan.action.resource_create(package_id=self.package_id, url=self.source_full_url, format='HTML', name=self.resource_name)
@@ -712,10 +1131,16 @@ class Job:
             # should determine which kind of file loader will be used.
             if self.destination_file_format is None:
                 raise ValueError("Destination == 'file' but self.destination_file_format is None!")
+            elif self.destination_file_format.lower() == 'csv' and self.compressed_file_to_extract is None and self.primary_key_fields and self.upload_method in ['upsert', None]:
+                self.loader = pl.SQLiteFileLoader # Upserts go to a local SQLite database (honoring the primary keys),
+                self.upload_method = 'upsert' # which is exported to the CSV file at the end of the run.
             elif self.destination_file_format.lower() in ['csv', 'json'] and self.compressed_file_to_extract is None:
                 self.loader = pl.TabularFileLoader # Isn't this actually very CSV-specific, given the write_or_append_to_csv_file function it uses?
                 self.upload_method = 'insert' # Note that this will always append records to an existing file
                 # unless 'always_clear_first' (or 'always_wipe_data') is set to True.
+            elif self.destination_file_format.lower() == 'parquet':
+                self.loader = pl.ParquetFileLoader # Parquet files can not be appended to,
+                self.upload_method = 'insert' # so any existing file is replaced.
             else:
                 self.loader = pl.NontabularFileLoader
         elif self.destination == 'ckan_filestore':
@@ -751,36 +1176,82 @@ class Job:
                     print("Since it makes no sense to try to wipe the records from a datastore that does not exist, wipe_data is being toggled to False.")
                     wipe_data = False
 
+        # C) Large jobs that replace all the records in a datastore are written to a local
+        # CSV file which is then uploaded and loaded by CKAN in one step.
+        loader_filepath, loader_file_format, upload_method = self.destination_file_path, self.destination_file_format, self.upload_method
+        bulk_load = not replay and self.should_bulk_load(clear_first, wipe_data)
+        if bulk_load:
+            self.loader = pl.TabularFileLoader
+            loader_filepath = f'{self.destination_directory}{self.job_code}_bulk_load.csv'
+            loader_file_format, upload_method = 'csv', 'insert'
+
+        delta_store_path = None
+        if self.delta_upserts and self.destination == 'ckan' and not bulk_load:
+            delta_store_path = f'{WAITING_ROOM_DIR}/delta_stores/{self.package_id}-{simplify_string(self.resource_name)}.sqlite'
+        dead_letter_path = None
+        if self.dead_letter_records and self.destination == 'ckan': # Records that the datastore rejects get written
+            # here (so that one bad record doesn't keep the rest of them from being loaded).
+            dead_letter_path = f'{WAITING_ROOM_DIR}/dead_letters/{self.job_code}.jsonl'
+
         print(f'Loading {"tabular data" if self.loader.has_tabular_output else "file"}...')
         # END Destination-specific configuration
 
-        try:
-            curr_pipeline = pl.Pipeline(self.job_code + ' pipeline', self.job_code + ' Pipeline', log_status=False, chunk_size=1000, settings_file=SETTINGS_FILE, retry_without_last_line = retry_without_last_line, ignore_empty_rows = ignore_empty_rows, filters = self.filters) \
-                .connect(self.source_connector, self.target, config_string=self.connector_config_string, encoding=self.encoding, local_cache_filepath=self.local_cache_filepath, verify_requests=self.verify_requests, fallback_host=self.source_site) \
-                .extract(self.extractor, firstline_headers=True, rows_to_skip=self.rows_to_skip, sheet_name=self.sheet_name, compressed_file_to_extract=self.compressed_file_to_extract) \
-                .schema(self.schema) \
-                .load(self.loader, self.loader_config_string,
-                      filepath = self.destination_file_path,
-                      file_format = self.destination_file_format,
+        loader = self.loader
+        loader_kwargs = dict(filepath = loader_filepath,
+                      file_format = loader_file_format,
                       fields = self.schema().serialize_to_ckan_fields(),
                       key_fields = self.primary_key_fields,
                       package_id = self.package_id,
                       resource_name = self.resource_name,
-                      clear_first = clear_first,
-                      wipe_data = wipe_data,
-                      method = self.upload_method,
-                      verify_requests = self.verify_requests).run()
+                      clear_first = clear_first or bulk_load,
+                      wipe_data = wipe_data and not bulk_load,
+                      swap_data = self.swap_on_wipe and wipe_data and self.destination == 'ckan' and not bulk_load,
+                      method = upload_method,
+                      compress_requests = self.compress_upserts,
+                      delta_store_path = delta_store_path,
+                      delete_vanished = self.delete_vanished_rows,
+                      dead_letter_path = dead_letter_path,
+                      resource_names_from_filenames = self.multiple_files,
+                      manifest_filepath = f'{self.local_directory}.{self.job_code}_loaded_files.json' if self.multiple_files else None,
+                      verify_requests = self.verify_requests)
+        extra_loaders = self.extra_destination_loaders(clear_first, wipe_data)
+
+        spool = None
+        if replay or (self.spool_chunks and self.destination == 'ckan' and not bulk_load and not self.multiple_files):
+            spool = pl.ChunkSpool(f'{WAITING_ROOM_DIR}/spools/{self.job_code}')
+        if extra_loaders: # Feed the records from one extraction to all the destinations.
+            loader = pl.MultiLoader
+            loader_kwargs = {'destinations': {self.destination: (self.loader, loader_kwargs), **extra_loaders},
+                    'source_filepath': self.source_filepath}
+
+        try:
+            curr_pipeline = pl.Pipeline(self.job_code + ' pipeline', self.job_code + ' Pipeline', log_status=False, chunk_size=1000, settings_file=SETTINGS_FILE, retry_without_last_line = retry_without_last_line, ignore_empty_rows = ignore_empty_rows, filters = self.filters, parse_workers = os.cpu_count() if parallel_parse else 0, columnar = self.columnar, spool = spool) \
+                .connect(self.source_connector, self.target, config_string=self.connector_config_string, encoding=self.encoding, local_cache_filepath=self.local_cache_filepath, cache_download=self.cache_download, verify_requests=self.verify_requests, fallback_host=self.source_site) \
+                .extract(self.extractor, firstline_headers=True, rows_to_skip=self.rows_to_skip, sheet_name=self.sheet_name, compressed_file_to_extract=self.compressed_file_to_extract) \
+                .schema(self.schema) \
+                .load(loader, self.loader_config_string, **loader_kwargs)
+            curr_pipeline = curr_pipeline.replay() if replay else curr_pipeline.run()
+            self.metrics = curr_pipeline.metrics
         except FileNotFoundError:
             if self.ignore_if_source_is_missing:
                 print("The source file for this job wasn't found, but that's not surprising.")
             else:
                 raise
 
-        if self.destination in ['ckan', 'ckan_filestore']:
+        if bulk_load and os.path.isfile(loader_filepath): # (The source file might have been missing.)
+            locators_by_destination[self.destination] = self.bulk_load_file(loader_filepath, curr_pipeline.metrics['records_loaded'])
+        elif self.multiple_files:
+            pass # Each file was loaded to its own resource, so there's no single locator for post-processing.
+        elif self.destination in ['ckan', 'ckan_filestore']:
             resource_id = find_resource_id(self.package_id, self.resource_name) # This IS determined in the pipeline, so it would be nice if the pipeline would return it.
             locators_by_destination[self.destination] = resource_id
         elif self.destination in ['file']:
             locators_by_destination[self.destination] = self.destination_file_path
+        for name, (_, kwargs) in extra_loaders.items():
+            if name == 'ckan_filestore':
+                locators_by_destination[name] = find_resource_id(self.package_id, kwargs['resource_name'])
+            elif name == 'file':
+                locators_by_destination[name] = kwargs['filepath']
         return locators_by_destination
 
     def process_job(self, **kwparameters):
@@ -790,11 +1261,14 @@ class Job:
         migrate_schema = kwparameters['migrate_schema']
         ignore_empty_rows = kwparameters['ignore_empty_rows']
         retry_without_last_line = kwparameters['retry_without_last_line']
+        parallel_parse = kwparameters.get('parallel_parse', False)
+        replay = kwparameters.get('replay', False)
         self.configure_pipeline_with_options(**kwparameters)
         self.handle_schema_migrations_and_data_dictionary_stashing(**kwparameters)
 
-        self.custom_processing(self, **kwparameters)
-        self.locators_by_destination = self.run_pipeline(clear_first, wipe_data, migrate_schema, retry_without_last_line=retry_without_last_line, ignore_empty_rows=ignore_empty_rows)
+        if not replay: # Custom processing usually fetches or prepares the source, which a replay doesn't need.
+            self.custom_processing(self, **kwparameters)
+        self.locators_by_destination = self.run_pipeline(clear_first, wipe_data, migrate_schema, retry_without_last_line=retry_without_last_line, ignore_empty_rows=ignore_empty_rows, parallel_parse=parallel_parse, replay=replay)
         self.custom_post_processing(self, **kwparameters)
         return self.locators_by_destination # Return a dict allowing look up of final destinations of data (filepaths for local files and resource IDs for data sent to a CKAN instance).
 
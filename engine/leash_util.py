@@ -1,4 +1,4 @@
-import ckanapi, time
+import time
 from datetime import datetime
 from pprint import pprint
 
@@ -19,8 +19,9 @@ def get_resource_parameter(site, resource_id, parameter=None, API_key=None):
     # 'revision_id', 'resource_type'
     # Note that 'size' does not seem to be defined for tabular
     # data on WPRDC.org. (It's not the number of rows in the resource.)
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     try:
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+        ckan = TracedRemoteCKAN(site, apikey=API_key)
         metadata = get_metadata(ckan, resource_id)
         if parameter is None:
             return metadata
@@ -45,8 +46,9 @@ def get_package_parameter(site, package_id, parameter=None, API_key=None):
     # 'name', 'isopen', 'url', 'notes', 'license_title',
     # 'temporal_coverage', 'related_documents', 'license_url',
     # 'organization', 'revision_id'
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
     try:
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+        ckan = TracedRemoteCKAN(site, apikey=API_key)
         metadata = ckan.action.package_show(id=package_id)
         if parameter is None:
             return metadata
@@ -68,7 +70,9 @@ def initially_leashed(resource_id):
     return leashed
 
 def make_datastore_public(site, resource_id, API_key):
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    import ckanapi
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     try:
         response = ckan.action.datastore_make_public(resource_id=resource_id) # This seems to be replaced by ckanext.datastore.logic.action.set_datastore_active_flag in CKAN 2.8 (maybe).
     except ckanapi.errors.CKANAPIError:
@@ -78,7 +82,8 @@ def make_datastore_public(site, resource_id, API_key):
     return response 
 
 def make_datastore_private(site, resource_id, API_key):
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     response = ckan.action.datastore_make_private(resource_id=resource_id)
     return response
 
@@ -7,7 +7,7 @@ from collections import OrderedDict, defaultdict
 from marshmallow import fields, pre_load, post_load
 from engine.wprdc_etl import pipeline as pl
 from engine.etl_util import fetch_city_file
-from engine.arcgis_util import get_arcgis_dataset, get_arcgis_data_url, standard_arcgis_job_dicts
+from engine.arcgis_util import lazy_arcgis_data_url
 from engine.notify import send_to_slack
 from engine.scraping_util import scrape_nth_link
 from engine.parameters.local_parameters import SOURCE_DIR, PRODUCTION
@@ -57,8 +57,6 @@ class GreenInfrastructureSchema(pl.BaseSchema):
 data_json_url = 'https://data-3rww.opendata.arcgis.com/data.json'
 package_id = '097c70b6-d5d3-434b-af90-23c8b1a99bfb'
 arcgis_dataset_title = '3RWW Green Infrastructure Inventory'
-gi_dataset, _ = get_arcgis_dataset(arcgis_dataset_title, data_json_url, None) # Cache data.json
-# to avoid looking it up for each job in this file.
 
 schema = GreenInfrastructureSchema
 
@@ -68,7 +66,7 @@ job_dicts = [
     {
         'job_code': f'{base_job_code}_csv',
         'source_type': 'http',
-        'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'CSV', gi_dataset)[0],
+        'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'CSV'),
         'encoding': 'utf-8',
         'schema': schema,
         'always_wipe_data': True,
@@ -81,7 +79,7 @@ job_dicts = [
     {
         'job_code': f'{base_job_code}_geojson',
         'source_type': 'http',
-        'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'GeoJSON', gi_dataset)[0],
+        'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'GeoJSON'),
         'encoding': 'utf-8',
         'destination': 'ckan_filestore',
         'package': package_id,
@@ -90,7 +88,7 @@ job_dicts = [
     {
         'job_code': f'{base_job_code}_shapefile',
         'source_type': 'http',
-        'source_full_url': get_arcgis_data_url(data_json_url, arcgis_dataset_title, 'Shapefile', gi_dataset)[0],
+        'source_full_url': lazy_arcgis_data_url(data_json_url, arcgis_dataset_title, 'Shapefile'),
         'encoding': 'binary',
         'destination': 'ckan_filestore',
         'package': package_id,
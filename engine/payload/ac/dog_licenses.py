@@ -43,6 +43,7 @@ class DogLicensesSchema(pl.BaseSchema):
     #    return
 
     @pre_load
+    @pl.reads_columns()
     def fix_nas_and_strip(self, data):
         for k, v in data.items():
             if k in ['breed', 'color']:
@@ -55,6 +56,7 @@ class DogLicensesSchema(pl.BaseSchema):
                 data[k] = data[k].strip()
 
     @pre_load
+    @pl.reads_columns()
     def fix_zip(self, data):
         f = 'ownerzip'
         if f in data and data[f] not in [None, '.', '', 'NA', 'N/A']:
@@ -54,6 +54,7 @@ class SalesSchema(pl.BaseSchema):
         ordered = True
 
     @pre_load()
+    @pl.reads_columns()
     def fix_dates(self, data):
         date_format = "%m-%d-%Y"
         if data['saledate']:
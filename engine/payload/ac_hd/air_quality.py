@@ -129,6 +129,7 @@ job_dicts = [
         'primary_key_fields': ['date', 'site', 'parameter'],
         'always_wipe_data': False,
         'upload_method': 'upsert',
+        'columnar': True,
         'package': air_quality_package_id,
         'resource_name': f'Daily AQI Data'
     },
@@ -160,6 +161,7 @@ job_dicts = [
         'primary_key_fields': ['datetime_est', 'site', 'parameter'],
         'always_wipe_data': False,
         'upload_method': 'upsert',
+        'columnar': True,
         'destination_file': f'air_hourly.csv',
         'package': air_quality_package_id,
         'resource_name': f'Hourly Air Quality Data'
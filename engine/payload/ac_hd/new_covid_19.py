@@ -1,11 +1,11 @@
 import os, csv, json, requests, sys, traceback
-import ckanapi
 from datetime import datetime
 from dateutil import parser
 from pprint import pprint
 
 from marshmallow import fields, pre_load, post_load
 from engine.wprdc_etl import pipeline as pl
+from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
 from engine.etl_util import find_resource_id, post_process
 from engine.credentials import site, API_key
 
@@ -147,7 +147,7 @@ def express_load_then_delete_file(job, **kwparameters):
         return
     if kwparameters['test_mode']:
         job.package_id = TEST_PACKAGE_ID
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     csv_file_path = job.destination_file_path
     resource_id = find_resource_id(job.package_id, job.resource_name)
     if resource_id is None:
@@ -1,5 +1,4 @@
 import os, csv, json, requests, sys, traceback
-import ckanapi
 import time
 import re
 from datetime import datetime
@@ -7,6 +6,7 @@ from dateutil import parser
 
 from marshmallow import fields, pre_load, post_load
 from engine.wprdc_etl import pipeline as pl
+from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
 from engine.etl_util import find_resource_id
 from engine.notify import send_to_slack
 from engine.credentials import site, API_key
@@ -109,7 +109,7 @@ def express_load_then_delete_file(job, **kwparameters):
     # possibly implemented as a loader (CKANExpressLoader).
     if kwparameters['test_mode']:
         job.package_id = TEST_PACKAGE_ID
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+    ckan = TracedRemoteCKAN(site, apikey=API_key)
     csv_file_path = job.destination_file_path
     resource_id = find_resource_id(job.package_id, job.resource_name)
     if resource_id is None:
@@ -1,4 +1,4 @@
-import csv, json, requests, sys, traceback, re, time, math, operator, dataset
+import csv, json, requests, sys, traceback, re, time, math, operator
 from datetime import datetime
 from dateutil import parser
 from pprint import pprint
@@ -34,10 +34,17 @@ unable_to_code = defaultdict(int)
 
 ### SETUP FOR USING THE geocode_strictly FUNCTION. ###
 features_by_address = defaultdict() # Geocoding cache
-geo_db = dataset.connect('sqlite:///geocodes.db')
-pelias_table = geo_db['pelias'] # An alternative to separate tables for separate geocoding sources would
-# be one single table with the geocoder (and configuration) as one field and the results (in their
-# myriad formats) as a nother.
+pelias_table = None # The local SQLite geocoding cache, opened by get_pelias_table the first time it's needed.
+
+def get_pelias_table():
+    global pelias_table
+    if pelias_table is None:
+        import dataset # (Imported here since it's slow to import.)
+        geo_db = dataset.connect('sqlite:///geocodes.db')
+        pelias_table = geo_db['pelias'] # An alternative to separate tables for separate geocoding sources would
+        # be one single table with the geocoder (and configuration) as one field and the results (in their
+        # myriad formats) as a nother.
+    return pelias_table
 ### END SETUP FOR USING THE geocode_strictly FUNCTION. ###
 
 # Network functions #
@@ -130,7 +137,7 @@ def geocode(full_address, strict=False, verbose=True):
     if full_address in features_by_address: # Try the cache.
         features = features_by_address[full_address]
     else:
-        rows = list(pelias_table.find(full_address=full_address))
+        rows = list(get_pelias_table().find(full_address=full_address))
         assert len(rows) < 2
         if len(rows) == 0: # If the local cache is empty, fetch results and store them.
             params = {'text': full_address}
@@ -140,7 +147,7 @@ def geocode(full_address, strict=False, verbose=True):
             features = result['features']
             features_by_address[full_address] = features
             data = dict(full_address=full_address, features=json.dumps(features))
-            pelias_table.upsert(data, ['full_address']) # The second parameter is the list of keys to use for the upsert.
+            get_pelias_table().upsert(data, ['full_address']) # The second parameter is the list of keys to use for the upsert.
             time.sleep(0.1)
         else: # Get the features from the local cache.
             features = json.loads(rows[0]['features']) # This is a brute force approach. Rather than paring the extremely long
@@ -6,8 +6,8 @@ from collections import OrderedDict, defaultdict
 
 from marshmallow import fields, pre_load, post_load
 from engine.wprdc_etl import pipeline as pl
-from engine.etl_util import fetch_city_file
-from engine.arcgis_util import get_arcgis_data_url
+from engine.etl_util import fetch_city_file, LazyField
+from engine.arcgis_util import lazy_arcgis_data_url
 from engine.notify import send_to_slack
 from engine.scraping_util import scrape_nth_link
 from engine.parameters.local_parameters import SOURCE_DIR, PRODUCTION
@@ -1047,7 +1047,7 @@ job_dicts = [
         'source_type': 'http',
         'source_file': 'FHA_BF90_RM_A_01042021.xlsx',
         #'source_full_url': 'https://www.hud.gov/sites/dfiles/Housing/images/FHA_BF90_RM_A_01042021.xlsx',
-        'source_full_url': scrape_nth_link('https://www.hud.gov/program_offices/housing/comp/rpts/mfh/mf_f47', 'xlsx', 1, 2, 'FHA'),
+        'source_full_url': LazyField(scrape_nth_link, 'https://www.hud.gov/program_offices/housing/comp/rpts/mfh/mf_f47', 'xlsx', 1, 2, 'FHA'),
         'updates': 'Monthly',
         'encoding': 'binary',
         'schema': MultifamilyInsuredMortgagesSchema,
@@ -1069,7 +1069,7 @@ job_dicts = [
         'source_file': 'FHA MF and OHP Firm Commitments and Endorsements Database FY01_FY21 Q4.xlsx', #'Initi_Endores_Firm%20Comm_DB_FY21_Q1.xlsx',
         # Everything seems to change when this file updates: filename, some field names, and the number of Excel files on the scraped page.
         #'source_full_url': 'https://www.hud.gov/sites/dfiles/Housing/documents/Initi_Endores_Firm%20Comm_DB_FY21_Q1.xlsx',
-        'source_full_url': scrape_nth_link('https://www.hud.gov/program_offices/housing/mfh/mfdata/mfproduction', 'xlsx', 0, 1, 'Q'),
+        'source_full_url': LazyField(scrape_nth_link, 'https://www.hud.gov/program_offices/housing/mfh/mfdata/mfproduction', 'xlsx', 0, 1, 'Q'),
         'updates': 'Quarterly',
         'encoding': 'binary',
         'rows_to_skip': 7,
@@ -1177,7 +1177,7 @@ job_dicts = [
         'source_type': 'http',
         'source_file': 'public_housing_physical_inspection_scores_0321.xlsx',
         #'source_full_url': 'https://www.huduser.gov/portal/sites/default/files/xls/public_housing_physical_inspection_scores_0620.xlsx',
-        'source_full_url': scrape_nth_link('https://www.huduser.gov/portal/datasets/pis.html', 'xlsx', 0, None, 'public'), # The number of links increases each year.
+        'source_full_url': LazyField(scrape_nth_link, 'https://www.huduser.gov/portal/datasets/pis.html', 'xlsx', 0, None, 'public'), # The number of links increases each year.
         'encoding': 'binary',
         'rows_to_skip': 0,
         'schema': HousingInspectionScoresSchema,
@@ -1196,7 +1196,7 @@ job_dicts = [
     {
         'job_code': HUDPublicHousingProjectsSchema().job_code, # 'hud_public_housing_projects'
         'source_type': 'http',
-        'source_full_url': get_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'Public Housing Developments', 'CSV')[0],
+        'source_full_url': lazy_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'Public Housing Developments', 'CSV'),
         'encoding': 'utf-8',
         'schema': HUDPublicHousingProjectsSchema,
         'filters': [['county_level', '==', '42003'], ['std_st', '==', 'PA']],
@@ -1214,7 +1214,7 @@ job_dicts = [
     {
         'job_code': HUDPublicHousingBuildingsSchema().job_code, # 'hud_public_housing_buildings'
         'source_type': 'http',
-        'source_full_url': get_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'Public Housing Buildings', 'CSV')[0],
+        'source_full_url': lazy_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'Public Housing Buildings', 'CSV'),
         'encoding': 'utf-8',
         'schema': HUDPublicHousingBuildingsSchema,
         'filters': [['county_level', '==', '42003'], ['std_st', '==', 'PA']],
@@ -1232,7 +1232,7 @@ job_dicts = [
     {
         'job_code': MultifamilyProjectsSubsidyLoansSchema().job_code, # 'mf_subsidy_loans'
         'source_type': 'http',
-        'source_full_url': get_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'HUD Insured Multifamily Properties', 'CSV')[0], # HUD_Insured_Multifamily_Properties.csv
+        'source_full_url': lazy_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'HUD Insured Multifamily Properties', 'CSV'), # HUD_Insured_Multifamily_Properties.csv
         # The downside to pulling the filename from the data.json file is that there is currently no support for offline caching
         # for testing purposes, but this could be remedied.
         'encoding': 'utf-8',
@@ -1252,7 +1252,7 @@ job_dicts = [
     {
         'job_code': SubsidiesLoansSchema().job_code, # 'subsidies_loans'
         'source_type': 'http',
-        'source_full_url': get_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'HUD Insured Multifamily Properties', 'CSV')[0], # HUD_Insured_Multifamily_Properties.csv
+        'source_full_url': lazy_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'HUD Insured Multifamily Properties', 'CSV'), # HUD_Insured_Multifamily_Properties.csv
         # The downside to pulling the filename from the data.json file is that there is currently no support for offline caching
         # for testing purposes, but this could be remedied.
         'encoding': 'utf-8',
@@ -1272,7 +1272,7 @@ job_dicts = [
         'job_code': MultifamilyProjectsSubsidySection8Schema().job_code, # 'mf_subsidy_8'
         'source_type': 'http',
         'source_file': 'MF_Properties_with_Assistance_\&_Sec8_Contracts.xlsx',
-        'source_full_url': scrape_nth_link('https://www.hud.gov/program_offices/housing/mfh/exp/mfhdiscl', 'xlsx', 0, 2, 'roperties'),
+        'source_full_url': LazyField(scrape_nth_link, 'https://www.hud.gov/program_offices/housing/mfh/exp/mfhdiscl', 'xlsx', 0, 2, 'roperties'),
         'encoding': 'binary',
         'rows_to_skip': 0,
         'schema': MultifamilyProjectsSubsidySection8Schema,
@@ -1295,7 +1295,7 @@ job_dicts = [
         'job_code': MultifamilyProjectsSection8ContractsSchema().job_code, # 'mf_contracts_8'
         'source_type': 'http',
         'source_file': 'MF_Assistance_&_Sec8_Contracts.xlsx',
-        'source_full_url': scrape_nth_link('https://www.hud.gov/program_offices/housing/mfh/exp/mfhdiscl', 'xlsx', 1, 2, 'ontracts'),
+        'source_full_url': LazyField(scrape_nth_link, 'https://www.hud.gov/program_offices/housing/mfh/exp/mfhdiscl', 'xlsx', 1, 2, 'ontracts'),
         'encoding': 'binary',
         'rows_to_skip': 0,
         'schema': MultifamilyProjectsSection8ContractsSchema,
@@ -1314,7 +1314,7 @@ job_dicts = [
     {
         'job_code': MultifamilyGuaranteedLoansSchema().job_code, # 'mf_loans'
         'source_type': 'http',
-        'source_full_url': get_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'HUD Insured Multifamily Properties', 'CSV')[0], # HUD_Insured_Multifamily_Properties.csv
+        'source_full_url': lazy_arcgis_data_url('https://hudgis-hud.opendata.arcgis.com/data.json', 'HUD Insured Multifamily Properties', 'CSV'), # HUD_Insured_Multifamily_Properties.csv
         # The downside to pulling the filename from the data.json file is that there is currently no support for offline caching
         # for testing purposes, but this could be remedied.
         'encoding': 'utf-8',
@@ -1339,7 +1339,7 @@ job_dicts = [
         'job_code': MultifamilyInspectionsSchema1().job_code, # 'mf_inspections_1'
         'source_type': 'http',
         'source_file': 'MF_Inspection_Report02252021.xls',
-        'source_full_url': scrape_nth_link('https://www.hud.gov/program_offices/housing/mfh/rems/remsinspecscores/remsphysinspscores', 'xls', 0, 1, 'nspection'),
+        'source_full_url': LazyField(scrape_nth_link, 'https://www.hud.gov/program_offices/housing/mfh/rems/remsinspecscores/remsphysinspscores', 'xls', 0, 1, 'nspection'),
         'encoding': 'binary',
         'rows_to_skip': 0,
         'schema': MultifamilyInspectionsSchema1,
@@ -1359,7 +1359,7 @@ job_dicts = [
         'job_code': MultifamilyInspectionsSchema2().job_code, # 'mf_inspections_2'
         'source_type': 'http',
         'source_file': 'MF_Inspection_Report02252021.xls',
-        'source_full_url': scrape_nth_link('https://www.hud.gov/program_offices/housing/mfh/rems/remsinspecscores/remsphysinspscores', 'xls', 0, 1, 'nspection'),
+        'source_full_url': LazyField(scrape_nth_link, 'https://www.hud.gov/program_offices/housing/mfh/rems/remsinspecscores/remsphysinspscores', 'xls', 0, 1, 'nspection'),
         'encoding': 'binary',
         'rows_to_skip': 0,
         'schema': MultifamilyInspectionsSchema2,
@@ -1377,7 +1377,7 @@ job_dicts = [
         'job_code': MultifamilyInspectionsSchema3().job_code, # 'mf_inspections_3'
         'source_type': 'http',
         'source_file': 'MF_Inspection_Report02252021.xls',
-        'source_full_url': scrape_nth_link('https://www.hud.gov/program_offices/housing/mfh/rems/remsinspecscores/remsphysinspscores', 'xls', 0, 1, 'nspection'),
+        'source_full_url': LazyField(scrape_nth_link, 'https://www.hud.gov/program_offices/housing/mfh/rems/remsinspecscores/remsphysinspscores', 'xls', 0, 1, 'nspection'),
         'encoding': 'binary',
         'rows_to_skip': 0,
         'schema': MultifamilyInspectionsSchema3,
@@ -7,7 +7,7 @@ from collections import OrderedDict, defaultdict
 from marshmallow import fields, pre_load, post_load
 from engine.wprdc_etl import pipeline as pl
 from engine.ckan_util import find_resource_id, get_resource_data
-from engine.etl_util import write_to_csv
+from engine.etl_util import write_to_csv, LazyField
 from engine.notify import send_to_slack
 from engine.scraping_util import scrape_nth_link
 from engine.parameters.local_parameters import SOURCE_DIR, PRODUCTION
@@ -282,6 +282,7 @@ job_dicts = [
 
     {
         'job_code': 'hunt_and_peck',
+        'depends_on': 'synthesize_new_local_index', # This job's source file is that job's output.
         #From the house_cat data architecture plan: CROWDSOURCED HOUSING PROJECTS
         #"User-contributed records can be dumped in a separate table with basically the same
         #schema as the Property Information table, and the id field from that table can serve
@@ -450,7 +451,7 @@ job_dict = \
         'job_code': SubsidiesSection8Schema.job_code, # 'subsidies_section_8'
         'source_type': 'http',
         'source_file': 'MF_Assistance_&_Sec8_Contracts.xlsx',
-        'source_full_url': scrape_nth_link('https://www.hud.gov/program_offices/housing/mfh/exp/mfhdiscl', 'xlsx', 1, 2, 'ontracts'),
+        'source_full_url': LazyField(scrape_nth_link, 'https://www.hud.gov/program_offices/housing/mfh/exp/mfhdiscl', 'xlsx', 1, 2, 'ontracts'),
         'encoding': 'binary',
         'rows_to_skip': 0,
         'schema': SubsidiesSection8Schema,
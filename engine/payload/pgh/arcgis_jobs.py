@@ -7,7 +7,7 @@ from collections import OrderedDict, defaultdict
 from marshmallow import fields, pre_load, post_load
 from engine.wprdc_etl import pipeline as pl
 from engine.etl_util import fetch_city_file
-from engine.arcgis_util import get_arcgis_dataset, get_arcgis_data_url, standard_arcgis_job_dicts
+from engine.arcgis_util import standard_arcgis_job_dicts
 from engine.notify import send_to_slack
 from engine.scraping_util import scrape_nth_link
 from engine.parameters.local_parameters import SOURCE_DIR, PRODUCTION
@@ -26,8 +26,7 @@ job_dicts = []
 data_json_url = 'https://pghgishub-pittsburghpa.opendata.arcgis.com/data.json'
 test_package_id = 'f618f456-0d69-46ff-abc2-1e80ef101c49' # Test package for arcgis_jobs.py
 
-_, data_json_content = get_arcgis_dataset('Pittsburgh Steps', data_json_url, None) # Cache data.json
-# to avoid looking it up for each job in this file.
+data_json_content = None # data.json is fetched (once per run) when the first selected job needs it.
 #############
 
 class StepsSchema(pl.BaseSchema):
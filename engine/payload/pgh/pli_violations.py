@@ -99,6 +99,7 @@ job_dicts = [
         'primary_key_fields': ['CASE_NUMBER'], # This is from pli_violations_no_shell.py
         #'primary_key_fields': ['CASE_NUMBER', 'VIOLATION', 'LOCATION', 'CORRECTIVE_ACTION'] # This is from an old job: tools:jobs/pli/pli_violations.py
         'upload_method': 'upsert',
+        'delta_upserts': True, # The export contains every case, but only a few change each day.
         'custom_processing': ftp_and_prime_geocoder,
         'destination': 'ckan',
         'destination_file': 'PLI-output.csv',
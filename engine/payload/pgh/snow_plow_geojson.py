@@ -5,9 +5,8 @@ from pprint import pprint
 
 from marshmallow import fields, pre_load, post_load
 from engine.wprdc_etl import pipeline as pl
-from engine.etl_util import local_file_and_dir, download_city_directory, resource_exists
+from engine.etl_util import local_file_and_dir, download_city_directory
 from engine.notify import send_to_slack
-from engine.parameters.remote_parameters import TEST_PACKAGE_ID
 from engine.parameters.local_parameters import SOURCE_DIR
 
 try:
@@ -16,13 +15,10 @@ except ImportError:  # Graceful fallback if IceCream isn't installed.
     ic = lambda *a: None if not a else (a[0] if len(a) == 1 else a)  # noqa
 
 
-def ftp_and_upload_maybe(job, **kwparameters):
-    """This script optionally obtains all files from an FTP directory,
-    scans for files that have not been uploaded to CKAN, and takes the
-    first such file and recodes the job to upload just it before
-    allowing the job to run.
-
-    A better ETL framework would make this script smaller or non-existent."""
+def download_snow_plow_files(job, **kwparameters):
+    """This script optionally obtains all files for the current year from
+    an FTP directory. The job then uploads each file that has not already
+    been uploaded to CKAN to its own resource (named after the file)."""
     _, local_target_directory = local_file_and_dir(job, SOURCE_DIR)
     local_target_directory += 'snow_plow_data'
     if not os.path.isdir(local_target_directory):
@@ -36,51 +32,20 @@ def ftp_and_upload_maybe(job, **kwparameters):
         # (possibly using lftp or some other program) and then
         # using that to decide which file to obtain from the FTP server.
 
-    # Get list of files in local_target_directory.
-    datafiles = sorted(os.listdir(local_target_directory))
-    # Require that the datafiles end in "json"
-    datafiles = [df for df in datafiles if df[-4:].lower() == 'json']
-
-    # Compare list of obtained files to list of resources for the package
-    effective_package_id = TEST_PACKAGE_ID if kwparameters['test_mode'] else job.production_package_id # It's
-    # necessary to work out the effective package ID here since this
-    # preprocessing is done before the package ID is switched to the
-    # package ID when in test mode.
-    ic(effective_package_id)
-    for datafile in datafiles:
-        resource_name, _ = datafile.split('.')
-        if not resource_exists(effective_package_id, resource_name):
-            # Modify the job to upload just this file.
-            # This is kind of a kludge until the ETL framework becomes
-            # generalized to support multiple simultaneous tables
-            # (though I suppose one could also add to the jobs list,
-            # assuming it can be extended), but then so is this
-            # particular ETL job.
-            job.source_file = datafile
-            job.resource_name = resource_name
-            job.local_directory = local_target_directory
-            job.target = f"{local_target_directory}/{datafile}"
-            print(f"OK, let's upload {datafile} with resource name {resource_name}.")
-            return
-        else:
-            print(f"Found resource with name {resource_name} in package {effective_package_id}.")
-
-    print("No new files to upload.")
-    job.destination = None #job.destinations.remove('ckan_filestore')
-
 snow_plow_geojson_package_id = "d0b56030-3391-49db-87bd-4f1c16490fbc" # Production version of Snow Plow Activity (2018-2020)
 
 job_dicts = [
         {
+        'job_code': 'snow_plow_geojson',
         'source_type': 'local',
         'source_dir': 'SnowPlows',
-        'source_file': '',
-        'encoding': 'utf-8-sig',
+        'source_file': 'snow_plow_data/*json', # Each matching file is uploaded to a resource named after it.
+        'encoding': 'binary',
         'schema': None,
-        'custom_processing': ftp_and_upload_maybe,
+        'custom_processing': download_snow_plow_files,
         'destination': 'ckan_filestore',
         'package': snow_plow_geojson_package_id,
-        'resource_name': 'test',
+        'resource_name': 'Snow Plow Activity files',
     },
 ]
 
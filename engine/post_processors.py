@@ -2,7 +2,7 @@ import os, ckanapi
 from datetime import datetime, timedelta
 from dateutil import parser
 from engine.parameters.remote_parameters import TEST_PACKAGE_ID
-from engine.etl_util import post_process
+from engine.etl_util import post_process, express_load_file
 from engine.credentials import site, API_key
 from engine.ckan_util import get_number_of_rows, get_resource_parameter, find_resource_id
 
@@ -21,38 +21,14 @@ def express_load_then_delete_file(job, **kwparameters):
     custom post-processing step, that file is Express-Loaded. This is
     faster (particularly for large files) and avoids 504 errors and unneeded
     API requests."""
-    # Eventually this function should be moved either to etl_util.py or
-    # more likely the pipeline framework. In either case, this approach
-    # can be formalized, either as a destination or upload method and
-    # possibly implemented as a loader (CKANExpressLoader).
     if kwparameters['use_local_output_file']:
         return
     if kwparameters['test_mode']:
         job.package_id = TEST_PACKAGE_ID
-    ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
     csv_file_path = job.destination_file_path
     #resource_id = job.locators_by_destination[job.destination] # This gives a file path here
     # like .../rocket-etl/output_files/ac/AlleghenyCounty_StreetCenterlines202106.csv
-    resource_id = find_resource_id(job.package_id, job.resource_name)
-
-    if resource_id is None:
-        # If the resource does not already exist, create it.
-        print(f"Unable to find a resource with name '{job.resource_name}' in package with ID {job.package_id}.")
-        print(f"Creating new resource, and uploading CSV file {csv_file_path} to resource with name '{job.resource_name}' in package with ID {job.package_id}.")
-        resource_as_dict = ckan.action.resource_create(package_id=job.package_id,
-            name = job.resource_name,
-            upload=open(csv_file_path, 'r'))
-    else:
-        print(f"Uploading CSV file {csv_file_path} to resource with name '{job.resource_name}' in package with ID {job.package_id}.")
-        resource_as_dict = ckan.action.resource_patch(id = resource_id,
-            upload=open(csv_file_path, 'r'))
-        # Running resource_update once sets the file to the correct file and triggers some datastore action and
-        # the Express Loader, but for some reason, it seems to be processing the old file.
-
-        # So instead, let's run resource_patch (which just sets the file) and then run resource_update.
-        #resource_as_dict = ckan.action.resource_update(id = resource_id)
-        resource_as_dict = ckan.action.resource_update(id = resource_id,
-            upload=open(csv_file_path, 'r'))
+    resource_id = express_load_file(csv_file_path, job.package_id, job.resource_name)
 
     print(f"Removing temp file at {csv_file_path}")
     os.remove(csv_file_path)
@@ -60,7 +36,8 @@ def express_load_then_delete_file(job, **kwparameters):
     # Since launchpad.py doesn't update the last_etl_update metadata value in this case
     # because this is a workaround, do it manually here:
     post_process(resource_id, job, **kwparameters)
-    # [ ] But really, an ExpressLoader is probably called for, or at least a standardized express_load_then_delete_file function.
+    # Jobs with large numbers of records that replace all the records in a datastore are
+    # now bulk-loaded this way automatically by Job.run_pipeline.
 
 def check_for_empty_table(job, **kwparameters):
     if kwparameters['use_local_output_file'] or job.destination == 'file':
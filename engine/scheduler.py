@@ -0,0 +1,235 @@
+"""A long-running scheduler that runs ETL jobs on cron schedules (in place of
+one cron invocation of launchpad.py per job), keeping the imported libraries,
+parsed settings, and cached catalogs warm between runs."""
+import os, json, random, signal, threading, time, traceback
+from collections import Counter
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+class CronExpression:
+    """A standard five-field cron expression (minute, hour, day of month,
+    month, and day of week, with 0 or 7 meaning Sunday).
+
+    Each field can be *, a number, a range (like 1-5), a list (like 1,15),
+    or any of those with a step (like */15 or 8-18/2). The aliases @hourly,
+    @daily, @weekly, @monthly, and @yearly are also supported. As in cron,
+    when both the day of the month and the day of the week are restricted,
+    a time matches if either one matches.
+    """
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+    ALIASES = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@midnight': '0 0 * * *',
+        '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *', '@yearly': '0 0 1 1 *', '@annually': '0 0 1 1 *'}
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = self.ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"The cron expression '{expression}' does not have five fields.")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self.parse_field(field, low, high) for field, (low, high) in zip(fields, self.FIELD_RANGES)]
+        self.weekdays = {d % 7 for d in self.weekdays} # Both 0 and 7 mean Sunday.
+        self.days_restricted = fields[2] != '*'
+        self.weekdays_restricted = fields[4] != '*'
+
+    def parse_field(self, field, low, high):
+        values = set()
+        for part in field.split(','):
+            value_range, _, step = part.partition('/')
+            if value_range == '*':
+                start, end = low, high
+            elif '-' in value_range:
+                start, end = [int(v) for v in value_range.split('-')]
+            else:
+                start = int(value_range)
+                end = high if step else start
+            step = int(step) if step else 1
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"The cron field '{field}' is out of the range {low}-{high}.")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def day_matches(self, dt):
+        day_match = dt.day in self.days
+        weekday_match = (dt.weekday() + 1) % 7 in self.weekdays # Python's weekdays start on Monday.
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def matches(self, dt):
+        return (dt.minute in self.minutes and dt.hour in self.hours
+            and dt.month in self.months and self.day_matches(dt))
+
+    def next_time(self, after):
+        """Return the first matching time (to the minute) after the given datetime."""
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366*5) # (Some expressions, like '0 0 30 2 *', never match.)
+        while dt < limit:
+            if dt.month not in self.months or not self.day_matches(dt):
+                dt = (dt + timedelta(days=1)).replace(hour=0, minute=0)
+            elif dt.hour not in self.hours:
+                dt = (dt + timedelta(hours=1)).replace(minute=0)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"The cron expression '{self.expression}' never matches.")
+
+class ScheduleEntry:
+    """One line of the schedule: a payload (with optional job codes and
+    command-line arguments) to run whenever the cron expression matches."""
+    def __init__(self, entry_dict, default_jitter=0):
+        self.payload = entry_dict['payload']
+        self.job_codes = entry_dict.get('jobs', [])
+        self.args = entry_dict.get('args', [])
+        self.cron = CronExpression(entry_dict['cron'])
+        self.jitter = entry_dict.get('jitter', default_jitter) # The maximum random delay (in seconds) added to each run
+        self.source = entry_dict.get('source', None) # Entries with the same source share its concurrency limit.
+        self.name = entry_dict.get('name', ' '.join([self.payload] + self.job_codes))
+        self.next_run = None
+
+    def schedule_next_run(self, after):
+        self.next_run = self.cron.next_time(after) + timedelta(seconds=random.uniform(0, self.jitter))
+        return self.next_run
+
+def load_schedule(schedule_filepath):
+    """Load a schedule file, which is JSON like this:
+
+        {
+            "workers": 4,
+            "jitter": 60,
+            "source_limits": {"county_sftp": 1},
+            "entries": [
+                {"payload": "pgh/smart_trash", "jobs": ["oscar"], "args": ["mute"],
+                    "cron": "15 3 * * *", "source": "county_sftp"},
+                ...
+            ]
+        }
+
+    Returns:
+        A two-tuple of the schedule settings (a dict) and the list of
+        ScheduleEntry instances
+    """
+    with open(schedule_filepath) as f:
+        schedule = json.load(f)
+    settings = {'workers': schedule.get('workers', 4),
+        'source_limits': schedule.get('source_limits', {})}
+    entries = [ScheduleEntry(d, schedule.get('jitter', 0)) for d in schedule['entries']]
+    names = [entry.name for entry in entries]
+    if len(names) != len(set(names)):
+        raise ValueError(f"The entries in {schedule_filepath} don't have unique names.")
+    return settings, entries
+
+class Scheduler:
+    """Run the entries of a schedule file as they come due, in a bounded pool
+    of worker threads, never running more than the configured number of
+    entries with the same source at once (or running an entry again while its
+    last run is still going). The schedule file is reloaded when it changes
+    (and the pool is replaced if the number of workers changes).
+
+    Arguments:
+        schedule_filepath: the path to the schedule file
+        run_entry: a function (called in a worker thread) that runs a ScheduleEntry
+    """
+    poll_interval = 30 # The maximum number of seconds between checks of the schedule
+
+    def __init__(self, schedule_filepath, run_entry):
+        self.schedule_filepath = schedule_filepath
+        self.run_entry = run_entry
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        self.running = set() # The names of the entries being run
+        self.running_by_source = Counter() # The number of entries being run for each source (which
+            # carries over when the schedule is reloaded, so runs started under the old schedule still count)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.workers = None
+        self.retired_executors = [] # Pools that were replaced when the number of workers changed
+        self.schedule_mtime = None
+        self.load()
+
+    def load(self):
+        self.schedule_mtime = os.path.getmtime(self.schedule_filepath)
+        self.settings, self.entries = load_schedule(self.schedule_filepath)
+        now = datetime.now()
+        for entry in self.entries:
+            entry.schedule_next_run(now)
+        print(f"Loaded {len(self.entries)} schedule entries from {self.schedule_filepath}.")
+
+    def reload_if_changed(self):
+        try:
+            if os.path.getmtime(self.schedule_filepath) != self.schedule_mtime:
+                self.load()
+        except Exception: # Keep running the old schedule if the new one can't be loaded.
+            print(f"Unable to reload {self.schedule_filepath}:")
+            traceback.print_exc()
+
+    def run_in_worker(self, entry):
+        start = time.time()
+        print(f"Starting {entry.name}.")
+        try:
+            self.run_entry(entry)
+            print(f"Finished {entry.name} in {round(time.time() - start, 1)} seconds.")
+        except BaseException:
+            print(f"{entry.name} failed after {round(time.time() - start, 1)} seconds:")
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                self.running.discard(entry.name)
+                self.running_by_source[entry.source] -= 1
+            self.wakeup.set() # An entry that was waiting for this source might be able to run now.
+
+    def stop(self, *args):
+        self.stopping.set()
+        self.wakeup.set()
+
+    def start_due_entries(self, executor):
+        """Start the entries that are due (unless their sources are busy, in
+        which case they stay due until a running entry finishes)."""
+        now = datetime.now()
+        for entry in self.entries:
+            if entry.next_run > now:
+                continue
+            with self.lock:
+                if entry.name in self.running:
+                    print(f"Skipping this run of {entry.name}, since its last run hasn't finished.")
+                    entry.schedule_next_run(now)
+                    continue
+                limit = self.settings['source_limits'].get(entry.source)
+                if limit is not None and self.running_by_source[entry.source] >= limit:
+                    continue
+                self.running.add(entry.name)
+                self.running_by_source[entry.source] += 1
+            executor.submit(self.run_in_worker, entry)
+            entry.schedule_next_run(now)
+
+    def update_pool(self):
+        """Start the pool of worker threads, or replace it if the number of
+        workers in the schedule has changed. (Entries that are running
+        finish in the old pool.)"""
+        if self.executor is not None:
+            if self.workers == self.settings['workers']:
+                return
+            print(f"Changing the number of workers from {self.workers} to {self.settings['workers']}.")
+            self.executor.shutdown(wait=False)
+            self.retired_executors.append(self.executor)
+        self.workers = self.settings['workers']
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def run_forever(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        try:
+            while not self.stopping.is_set():
+                self.reload_if_changed()
+                self.update_pool()
+                self.wakeup.clear()
+                self.start_due_entries(self.executor)
+                next_run = min((entry.next_run for entry in self.entries if entry.next_run > datetime.now()), default=None)
+                wait = self.poll_interval if next_run is None else (next_run - datetime.now()).total_seconds()
+                self.wakeup.wait(min(max(wait, 0), self.poll_interval)) # (A finished entry or a stop request
+                # interrupts the wait, which matters when entries are waiting for their sources.)
+        except KeyboardInterrupt:
+            pass
+        print("Stopping the scheduler (after the jobs that are running finish).")
+        for executor in self.retired_executors + [self.executor]:
+            if executor is not None:
+                executor.shutdown(wait=True)
@@ -1,20 +1,41 @@
-from engine.wprdc_etl.pipeline.extractors import (
-        FileExtractor, CSVExtractor, ExcelExtractor,
-        OldExcelExtractor, CompressedFileExtractor,
-        JSONExtractor
-)
-from engine.wprdc_etl.pipeline.connectors import (
-    FileConnector, RemoteFileConnector, HTTPConnector,
-    SFTPConnector, FTPConnector,
-    GoogleCloudStorageFileConnector
-)
-from engine.wprdc_etl.pipeline.loaders import (CKANFilestoreLoader,
-        CKANDatastoreLoader, TabularFileLoader,
-        NontabularFileLoader
-)
-from engine.wprdc_etl.pipeline.pipeline import Pipeline
-from engine.wprdc_etl.pipeline.schema import BaseSchema, NullSchema
-from engine.wprdc_etl.pipeline.exceptions import (
-    InvalidConfigException, IsHeaderException, HTTPConnectorError,
-    DuplicateFileException, MissingStatusDatabaseError
-)
+import importlib
+
+# The classes of the pipeline package are imported from their modules only
+# when they're first used (see __getattr__ below), so that a job only pays
+# for importing the libraries needed by the connector, extractor, schema,
+# and loader that it actually uses.
+_MODULES_BY_NAME = {
+    'extractors': ['FileExtractor', 'CSVExtractor', 'ExcelExtractor',
+        'OldExcelExtractor', 'CompressedFileExtractor',
+        'JSONExtractor', 'ParquetExtractor', 'MultiFileExtractor'],
+    'connectors': ['FileConnector', 'RemoteFileConnector', 'HTTPConnector',
+        'SFTPConnector', 'FTPConnector', 'DirectoryConnector',
+        'GoogleCloudStorageFileConnector'],
+    'loaders': ['CKANFilestoreLoader',
+        'CKANDatastoreLoader', 'TabularFileLoader',
+        'NontabularFileLoader', 'ParquetFileLoader',
+        'SQLiteFileLoader', 'MultiLoader'],
+    'pipeline': ['Pipeline'],
+    'chunks': ['ColumnarChunk'],
+    'spool': ['ChunkSpool'],
+    'ledger': ['RunLedger'],
+    'schema': ['BaseSchema', 'NullSchema', 'reads_columns'],
+    'exceptions': ['InvalidConfigException', 'IsHeaderException', 'HTTPConnectorError',
+        'DuplicateFileException', 'MissingStatusDatabaseError'],
+}
+_MODULE_BY_NAME = {name: module for module, names in _MODULES_BY_NAME.items() for name in names}
+
+__all__ = sorted(_MODULE_BY_NAME)
+
+def __getattr__(name):
+    if name not in _MODULE_BY_NAME:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # (By the engine path, since the modules import each other that way, even
+    # when this package is imported as wprdc_etl.pipeline.)
+    module = importlib.import_module('engine.wprdc_etl.pipeline.' + _MODULE_BY_NAME[name])
+    value = getattr(module, name)
+    globals()[name] = value # Later lookups skip __getattr__.
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+
+class ColumnarChunk(object):
+    '''A chunk of records stored column-wise
+
+    By default, a pipeline queues each chunk of records as a list of
+    dicts, which means allocating (and holding on to) a dict for
+    every row. A ColumnarChunk instead appends each value to a list
+    for its column, so the only per-row objects that survive schema
+    validation are the values themselves.
+
+    Loaders that need records (for instance, to serialize them to
+    JSON for CKAN) should call :py:func:`records_of` at the point of
+    serialization. Loaders that can work with columns can use
+    :py:meth:`rows` (for CSV writing) or :py:meth:`to_arrow`.
+
+    A ColumnarChunk supports the list operations that the pipeline
+    uses (``append``, ``len``, indexing, and slicing).
+    '''
+    def __init__(self, columns=None):
+        self.columns = OrderedDict() if columns is None else columns
+        self.length = len(next(iter(self.columns.values()))) if self.columns else 0
+
+    @classmethod
+    def from_records(cls, records):
+        '''Build a ColumnarChunk from a list of records (dicts)'''
+        chunk = cls()
+        for record in records:
+            chunk.append(record)
+        return chunk
+
+    def append(self, record):
+        '''Append a record (a dict) to the chunk, adding columns for
+        any keys that have not been seen before.
+        '''
+        columns = self.columns
+        for key in record:
+            if key not in columns:
+                columns[key] = [None]*self.length
+        for key, column in columns.items():
+            column.append(record.get(key))
+        self.length += 1
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __iter__(self):
+        names = list(self.columns.keys())
+        for row in zip(*self.columns.values()):
+            yield dict(zip(names, row))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ColumnarChunk(OrderedDict(
+                (name, column[index]) for name, column in self.columns.items()
+            ))
+        return dict((name, column[index]) for name, column in self.columns.items())
+
+    def rows(self, names):
+        '''Iterate over the rows as tuples of values for the given
+        column names (with ``None`` for unknown columns).
+        '''
+        missing = [None]*self.length
+        return zip(*[self.columns.get(name, missing) for name in names])
+
+    def to_records(self):
+        '''Convert the chunk to a list of dicts'''
+        return list(self)
+
+    def to_numpy(self, name):
+        '''Return one column as a NumPy array'''
+        import numpy
+        return numpy.array(self.columns[name])
+
+    def to_arrow(self, schema=None):
+        '''Convert the chunk to a :py:class:`pyarrow.Table`
+
+        Keyword Arguments:
+            schema: an optional :py:class:`pyarrow.Schema`, which is
+                used to type (and order) the columns
+        '''
+        import pyarrow
+        if schema is None:
+            return pyarrow.table(self.columns)
+        missing = [None]*self.length
+        arrays = [pyarrow.array(self.columns.get(field.name, missing), type=field.type) for field in schema]
+        return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+def records_of(data):
+    '''Return the given chunk of data as a list of records (dicts),
+    whether it was queued as a list or as a :py:class:`ColumnarChunk`.
+    '''
+    if isinstance(data, ColumnarChunk):
+        return data.to_records()
+    return data
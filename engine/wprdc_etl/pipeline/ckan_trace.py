@@ -0,0 +1,270 @@
+'''A thin layer that CKAN API calls go through (TracedRemoteCKAN for ckanapi
+calls and traced_post for direct POSTs to the action API), recording the
+action, latency, request and response sizes, and status of each call in
+the trace of the job that the current thread is running. Each trace also
+has a cache of package and resource metadata, so that a job that looks up
+the same package many times only fetches it once.
+'''
+import copy
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+_local = threading.local()
+
+READ_ACTION_SUFFIXES = ('_show', '_list', '_search', '_search_sql', '_info')
+
+def is_write(action):
+    return not action.endswith(READ_ACTION_SUFFIXES)
+
+class MetadataCache(object):
+    '''A read-through cache of the results of package_show and resource_show
+    calls, which is cleared by every call that might change something (so it
+    never returns metadata older than the last write made through it).
+
+    Since CKAN's resource_show just picks the resource out of the package,
+    resource_show calls are also answered from cached packages. Results are
+    returned as copies, so callers can modify them.
+    '''
+    CACHED_ACTIONS = ['package_show', 'resource_show']
+
+    def __init__(self):
+        self.packages = {} # By ID and name
+        self.resources = {} # By ID
+        self.hits = Counter()
+        self.lock = threading.Lock()
+
+    def key(self, action, data_dict):
+        # Calls with other parameters (like include_tracking) aren't cached.
+        if action in self.CACHED_ACTIONS and data_dict and list(data_dict) == ['id']:
+            return data_dict['id']
+        return None
+
+    def get(self, action, data_dict):
+        '''Return a copy of the cached result of the call (or None)'''
+        key = self.key(action, data_dict)
+        if key is None:
+            return None
+        with self.lock:
+            result = (self.packages if action == 'package_show' else self.resources).get(key)
+            if result is None:
+                return None
+            self.hits[action] += 1
+            return copy.deepcopy(result)
+
+    def add(self, action, data_dict, result):
+        key = self.key(action, data_dict)
+        if key is None or not isinstance(result, dict):
+            return
+        result = copy.deepcopy(result)
+        with self.lock:
+            if action == 'package_show':
+                for k in [key, result.get('id'), result.get('name')]:
+                    if k is not None:
+                        self.packages[k] = result
+                for resource in result.get('resources', []):
+                    self.resources[resource['id']] = resource
+            else:
+                self.resources[key] = result
+
+    def clear(self):
+        with self.lock:
+            self.packages, self.resources = {}, {}
+
+class APICallTrace(object):
+    '''The CKAN API calls made while running one job
+
+    Attributes:
+        name: the name of the traced run (usually the job code)
+        calls: a list of (action, seconds, request bytes, response bytes,
+            status) tuples, where the status is the HTTP status code (or
+            the name of the exception, if no response was received)
+        cache: the run's :py:class:`MetadataCache`
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.calls = []
+        self.cache = MetadataCache()
+        self.lock = threading.Lock() # (Upload workers can share a trace.)
+
+    def record(self, action, seconds, request_bytes, response_bytes, status):
+        with self.lock:
+            self.calls.append((action, seconds, request_bytes, response_bytes, status))
+
+    def summary(self):
+        '''Summarize the calls by action
+
+        Returns:
+            A dict mapping each action to its number of calls, errors, and
+            cache hits, total and maximum latency, and total request and
+            response bytes
+        '''
+        summary = {}
+        def summary_of(action):
+            return summary.setdefault(action, {'calls': 0, 'errors': 0, 'cache_hits': 0,
+                'seconds': 0.0, 'max_seconds': 0.0, 'request_bytes': 0, 'response_bytes': 0})
+        for action, hits in self.cache.hits.items():
+            summary_of(action)['cache_hits'] = hits
+        for action, seconds, request_bytes, response_bytes, status in self.calls:
+            s = summary_of(action)
+            s['calls'] += 1
+            s['errors'] += is_error(status)
+            s['seconds'] += seconds
+            s['max_seconds'] = max(s['max_seconds'], seconds)
+            s['request_bytes'] += request_bytes or 0
+            s['response_bytes'] += response_bytes or 0
+        return summary
+
+    def metrics(self):
+        '''Return the totals (to add to the job's metrics)'''
+        return {'api_calls': len(self.calls),
+            'api_errors': sum(is_error(call[-1]) for call in self.calls),
+            'api_seconds': round(sum(call[1] for call in self.calls), 3),
+            'api_cache_hits': sum(self.cache.hits.values())}
+
+    def report(self):
+        '''Print the summary, slowest actions first'''
+        metrics = self.metrics()
+        if not self.calls and not metrics['api_cache_hits']:
+            return
+        print(f"{metrics['api_calls']} CKAN API calls ({metrics['api_errors']} failed) took {metrics['api_seconds']:.2f} seconds"
+            f" ({metrics['api_cache_hits']} more were answered from the cache):")
+        for action, s in sorted(self.summary().items(), key=lambda item: -item[1]['seconds']):
+            errors = f"  {s['errors']} failed" if s['errors'] else ''
+            hits = f"  {s['cache_hits']} cached" if s['cache_hits'] else ''
+            print(f"    {action:<28} {s['calls']:>4} calls  {s['seconds']:7.2f} s (max {s['max_seconds']:.2f} s)  "
+                f"sent {s['request_bytes']} bytes  received {s['response_bytes']} bytes{errors}{hits}")
+
+def is_error(status):
+    return not isinstance(status, int) or status >= 400
+
+def start_trace(name):
+    '''Start tracing the CKAN API calls made by this thread'''
+    _local.trace = APICallTrace(name)
+    return _local.trace
+
+def stop_trace():
+    '''Stop tracing the CKAN API calls made by this thread
+
+    Returns:
+        The finished trace (or None if no trace was started)
+    '''
+    trace = current_trace()
+    _local.trace = None
+    return trace
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+def in_current_trace(function):
+    '''Wrap a function (to be run in a worker thread) so that its calls are
+    recorded in the trace of the thread that wrapped it'''
+    trace = current_trace()
+    def traced_function(*args, **kwargs):
+        _local.trace = trace
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.trace = None
+    return traced_function
+
+def record_call(action, seconds, request_bytes, response_bytes, status):
+    trace = current_trace()
+    if trace is not None:
+        trace.record(action, seconds, request_bytes, response_bytes, status)
+
+def payload_size(data):
+    '''Estimate the number of bytes that a request body will take'''
+    if data is None:
+        return 0
+    if isinstance(data, (bytes, str)):
+        return len(data)
+    if hasattr(data, 'len'): # A requests_toolbelt MultipartEncoder
+        return data.len
+    return len(json.dumps(data, default=str))
+
+def files_size(files):
+    size = 0
+    files = files or {}
+    for f in (files.values() if isinstance(files, dict) else [f for _, f in files]):
+        f = f[1] if isinstance(f, tuple) else f
+        try:
+            size += os.fstat(f.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            pass
+    return size
+
+def response_size(response):
+    try:
+        return len(response.content)
+    except (TypeError, AttributeError):
+        return None
+
+def __getattr__(name):
+    # TracedRemoteCKAN is defined when it's first used, so that tracing
+    # doesn't make jobs that never call CKAN import ckanapi.
+    if name != 'TracedRemoteCKAN':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import ckanapi
+
+    class TracedRemoteCKAN(ckanapi.RemoteCKAN):
+        '''A RemoteCKAN that records each action it calls in the current trace
+        (answering package_show and resource_show calls from the trace's
+        cache when it can)'''
+        def call_action(self, action, data_dict=None, **kwargs):
+            trace = current_trace()
+            if trace is not None:
+                result = trace.cache.get(action, data_dict)
+                if result is not None:
+                    return result
+                if is_write(action):
+                    trace.cache.clear()
+            self._response = (None, None)
+            status = None
+            start = time.perf_counter()
+            try:
+                result = super().call_action(action, data_dict, **kwargs)
+                if trace is not None and not is_write(action):
+                    trace.cache.add(action, data_dict, result)
+                return result
+            except Exception as e:
+                status = type(e).__name__
+                raise
+            finally:
+                if trace is not None and is_write(action):
+                    trace.cache.clear() # (In case another thread cached the old metadata during the call.)
+                http_status, response_bytes = self._response
+                record_call(action, time.perf_counter() - start,
+                    payload_size(data_dict) + files_size(kwargs.get('files')), response_bytes,
+                    http_status or status or 200)
+
+        def _request_fn(self, url, data, headers, files, requests_kwargs):
+            status, response = super()._request_fn(url, data, headers, files, requests_kwargs)
+            self._response = (status, len(response))
+            return status, response
+
+    globals()['TracedRemoteCKAN'] = TracedRemoteCKAN
+    return TracedRemoteCKAN
+
+def traced_post(url, **kwargs):
+    '''Make a requests.post call to a CKAN action URL, recording it in the
+    current trace'''
+    import requests
+    action = url.rstrip('/').split('/')[-1]
+    request_bytes = payload_size(kwargs.get('json', kwargs.get('data'))) + files_size(kwargs.get('files'))
+    trace = current_trace()
+    if trace is not None and is_write(action):
+        trace.cache.clear()
+    start = time.perf_counter()
+    try:
+        response = requests.post(url, **kwargs)
+    except Exception as e:
+        record_call(action, time.perf_counter() - start, request_bytes, None, type(e).__name__)
+        raise
+    finally:
+        if trace is not None and is_write(action):
+            trace.cache.clear()
+    record_call(action, time.perf_counter() - start, request_bytes, response_size(response), response.status_code)
+    return response
@@ -1,9 +1,8 @@
 import io
 import os
+import glob
 import hashlib
-import requests
-import urllib
-import paramiko
+import urllib.request
 import ftplib
 
 from io import TextIOWrapper
@@ -28,6 +27,8 @@ class Connector(object):
         self.encoding = kwargs.get('encoding', 'utf-8')
         self.local_cache_filepath = kwargs.get('local_cache_filepath', None) # This
         # tells non-local connectors where to cache retrieved files.
+        self.cache_download = kwargs.get('cache_download', False) # True when retrieved files
+        # should always be cached (so that the source file can be loaded again after extraction).
         self.verify_requests = kwargs.get('verify_requests', True)
         self.checksum = None
 
@@ -99,6 +100,44 @@ class FileConnector(Connector):
             self._file.close()
         return
 
+class DirectoryConnector(Connector):
+    '''Connector for a directory of local files
+
+    Rather than opening a single file, this connector returns the
+    (sorted) list of paths of the files matching the target, so that
+    one pipeline run can process many files. The files themselves
+    are opened by the loader, so that only as many files are open
+    at once as there are workers uploading them.
+    '''
+    def connect(self, target):
+        '''Find the files to process
+
+        Arguments:
+            target: a directory (all files in which are selected)
+                or a glob pattern like ``/path/to/files/*.geojson``
+
+        Returns:
+            A list of filepaths
+        '''
+        pattern = os.path.join(target, '*') if os.path.isdir(target) else target
+        self.filepaths = sorted(p for p in glob.glob(pattern) if os.path.isfile(p))
+        return self.filepaths
+
+    def checksum_contents(self, target, blocksize=8192):
+        '''Get an md5 hash of the names and contents of all the
+        matching files
+        '''
+        m = hashlib.md5()
+        for filepath in self.connect(target):
+            m.update(os.path.basename(filepath).encode('utf-8'))
+            with open(filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(blocksize), b''):
+                    m.update(chunk)
+        return m.hexdigest()
+
+    def close(self):
+        return
+
 class GoogleCloudStorageFileConnector(FileConnector):
     '''Connector for a file located in a Google Cloud Storage bucket.
     '''
@@ -145,20 +184,43 @@ class RemoteFileConnector(FileConnector):
         Returns:
             :py:class:`io.TextIOWrapper` around the opened URL unless
             the encoding is 'binary', in which case it returns
-            a `io.BufferedReader` instance.
+            a `io.BufferedReader` instance. (Binary files, and any files
+            when ``cache_download`` is True, are streamed to
+            ``local_cache_filepath``, when it's given, and then opened
+            from there, so that large files are never held in memory.)
         '''
-        if self.encoding == 'binary':
+        if self.local_cache_filepath is not None and (self.encoding == 'binary' or self.cache_download):
+            self.download(target, self.local_cache_filepath)
+            return super(RemoteFileConnector, self).connect(self.local_cache_filepath)
+        elif self.encoding == 'binary':
+            import requests
             self._file = io.BytesIO(requests.get(target, verify=self.verify_requests).content)
         else:
             self._file = TextIOWrapper(urllib.request.urlopen(target), encoding=self.encoding)
         return self._file
 
+    def download(self, target, filepath, chunk_size=1024*1024):
+        '''Stream a remote file to a local file (through a temporary file,
+        so that an interrupted download never leaves a partial file).'''
+        import requests
+        directory = os.path.dirname(filepath)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with requests.get(target, stream=True, verify=self.verify_requests) as response:
+            response.raise_for_status()
+            with open(filepath + '.part', 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        os.replace(filepath + '.part', filepath)
+        return filepath
+
 class HTTPConnector(Connector):
     ''' Connect to remote file via HTTP
     '''
     # It looks like RemoteFileConnector is designed to handle a file served by a web server,
     # while HTTPConnector is designed to pull text or JSON from a web server.
     def connect(self, target):
+        import requests
         response = requests.get(target)
         if response.status_code > 299:
             raise HTTPConnectorError(
@@ -187,6 +249,7 @@ class SFTPConnector(FileConnector):
         self.conn, self.transport, self._file = None, None, None
 
     def connect(self, target):
+        import paramiko # (Imported here since it's slow to import.)
         try:
             self.transport = paramiko.Transport((self.host, self.port))
             #self.transport.timeout = 180 # This is where and how to increase the timeouts to deal with a slow FTP server.
@@ -197,7 +260,7 @@ class SFTPConnector(FileConnector):
             )
             self.conn = paramiko.SFTPClient.from_transport(self.transport)
             size = self.conn.stat(self.root_dir + target).st_size
-            if self.conn.stat(self.root_dir + target).st_size > SFTP_MAX_FILE_SIZE:
+            if self.conn.stat(self.root_dir + target).st_size > SFTP_MAX_FILE_SIZE or self.cache_download:
                 # For large files, copy to local folder first
                 # prevents re-downloading data for checksum and extraction
                 if self.local_cache_filepath is not None:
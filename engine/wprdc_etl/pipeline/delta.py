@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+import sqlite3
+import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _json_default(obj):
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    return str(obj)
+
+def _canonical_value(value, ckan_type):
+    '''Convert a value to the form it takes in a datastore column of
+    the given type, so that records read back from the datastore (with
+    numeric values as strings, for instance) match the serialized records
+    that were loaded. Values that can't be converted are left as they are.
+    '''
+    if value is None:
+        return None
+    try:
+        if ckan_type in ['int', 'bigint']:
+            return int(value)
+        if ckan_type in ['float', 'numeric']:
+            return float(value)
+        if ckan_type == 'bool':
+            return value if isinstance(value, bool) else str(value).lower() in ['true', 't', 'yes', 'y', '1']
+        if ckan_type == 'timestamp': # PostgreSQL ignores the time zone of a timestamp without one.
+            if isinstance(value, str):
+                value = datetime.datetime.fromisoformat(value)
+            return value.replace(tzinfo=None).isoformat()
+        if ckan_type == 'date':
+            return datetime.date.fromisoformat(str(value)[:10]).isoformat()
+        if ckan_type == 'time':
+            if isinstance(value, str):
+                value = datetime.time.fromisoformat(value)
+            return value.replace(tzinfo=None).isoformat()
+        if ckan_type == 'text':
+            return str(value)
+    except (TypeError, ValueError, AttributeError):
+        pass
+    return value
+
+class RowHashStore(object):
+    '''A local SQLite store mapping the primary-key values of each
+    record in a datastore to a hash of the record
+
+    Each run, the loader asks the store which records in a chunk are
+    new or have changed (so that only those need to be upserted), and
+    after a successful upsert it records the hashes of all the records
+    in the chunk, marking them as seen in the current run. Keys that
+    were not seen in a run belong to records that have vanished from
+    the source.
+
+    When the datastore's fields (with their types) are given, keys and
+    hashes are computed from just those fields, with the values converted
+    by type, so that a store rebuilt from the records in the datastore
+    matches the records loaded by later runs.
+    '''
+    def __init__(self, filepath, key_fields, fields=None):
+        self.filepath = filepath
+        self.key_fields = key_fields
+        self.types_by_field = None if fields is None else {f['id']: f['type'] for f in fields}
+        self.is_new = not os.path.exists(filepath)
+        directory = os.path.dirname(filepath)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(filepath)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS row_hashes (key TEXT PRIMARY KEY, row_hash TEXT NOT NULL, last_seen INTEGER NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY)')
+        self.conn.commit()
+        self.run = None
+
+    def canonical(self, record):
+        if self.types_by_field is None:
+            return record
+        return {f: _canonical_value(record.get(f), t) for f, t in self.types_by_field.items()}
+
+    def key_of(self, record):
+        return self._key(self.canonical(record))
+
+    def hash_of(self, record):
+        return self._hash(self.canonical(record))
+
+    def key_and_hash_of(self, record):
+        record = self.canonical(record)
+        return self._key(record), self._hash(record)
+
+    def _key(self, record):
+        return json.dumps([record.get(f) for f in self.key_fields], default=_json_default)
+
+    def _hash(self, record):
+        if orjson is not None:
+            encoded = orjson.dumps(record, default=_json_default, option=orjson.OPT_SORT_KEYS)
+        else:
+            encoded = json.dumps(record, default=_json_default, sort_keys=True).encode('utf-8')
+        return hashlib.md5(encoded).hexdigest()
+
+    def start_run(self):
+        '''Start a new run (against which vanished keys are checked)'''
+        cursor = self.conn.execute('INSERT INTO runs (run) SELECT COALESCE(MAX(run), 0) + 1 FROM runs')
+        self.run = cursor.lastrowid
+        self.conn.commit()
+        return self.run
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM row_hashes').fetchone()[0]
+
+    def changed(self, records):
+        '''Find the records that are new or have changed
+
+        Arguments:
+            records: an iterable of records (dicts)
+
+        Returns:
+            A two-tuple of the list of changed records and a list of
+            (key, row_hash) pairs for all the records (to be passed to
+            :py:meth:`update` once the changes have been loaded)
+        '''
+        entries = [self.key_and_hash_of(record) + (record,) for record in records]
+        stored = {}
+        keys = [key for key, _, _ in entries]
+        for i in range(0, len(keys), 500): # Stay under SQLite's limit on query parameters.
+            batch = keys[i:i+500]
+            query = 'SELECT key, row_hash FROM row_hashes WHERE key IN ({})'.format(','.join('?'*len(batch)))
+            stored.update(self.conn.execute(query, batch).fetchall())
+        changed_records = [record for key, row_hash, record in entries if stored.get(key) != row_hash]
+        return changed_records, [(key, row_hash) for key, row_hash, _ in entries]
+
+    def update(self, key_hashes, run=None):
+        '''Record the hashes of loaded records (in one transaction), marking
+        their keys as seen in the current run (or the given run)'''
+        run = self.run if run is None else run
+        with self.conn:
+            self.conn.executemany('INSERT INTO row_hashes (key, row_hash, last_seen) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET row_hash = excluded.row_hash, last_seen = excluded.last_seen',
+                [(key, row_hash, run) for key, row_hash in key_hashes])
+
+    def vanished(self):
+        '''Return the primary-key values (as dicts) of the records that
+        were not seen in the current run'''
+        rows = self.conn.execute('SELECT key FROM row_hashes WHERE last_seen < ?', (self.run,)).fetchall()
+        return [dict(zip(self.key_fields, json.loads(key))) for key, in rows]
+
+    def remove(self, key_values):
+        with self.conn:
+            self.conn.executemany('DELETE FROM row_hashes WHERE key = ?',
+                [(self.key_of(k),) for k in key_values])
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM row_hashes')
+
+    def rebuild(self, records):
+        '''Replace the contents of the store with the hashes of the given
+        records (for instance, all the records in the datastore)
+
+        The keys are not marked as seen in any run.
+        '''
+        self.clear()
+        batch = []
+        for record in records:
+            batch.append(self.key_and_hash_of(record))
+            if len(batch) == 10000:
+                self.update(batch, run=0)
+                batch = []
+        self.update(batch, run=0)
+
+    def close(self):
+        self.conn.close()
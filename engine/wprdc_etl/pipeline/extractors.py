@@ -1,16 +1,16 @@
 import datetime
 import io
+import os
 import json
 from collections import OrderedDict
 from engine.wprdc_etl.pipeline.exceptions import IsHeaderException
-from xlrd import open_workbook, xldate_as_tuple, XL_CELL_DATE
-from openpyxl import load_workbook
 
 import csv, sys
 csv.field_size_limit(sys.maxsize) # This is designed to overcome this error:
 #_csv.Error: field larger than field limit (131072)
 # https://stackoverflow.com/questions/15063936/csv-error-field-larger-than-field-limit-131072
-from icecream import ic
+
+PARTITION_RANGE_SIZE = 8*1024*1024 # bytes
 
 class Extractor(object):
     def __init__(self, connection):
@@ -50,12 +50,19 @@ class FileExtractor(Extractor):
         function and puts it in an iterator.
         '''
         reader = iter([self.connection])
-        # Eventually update the Connector to support a list of files.
-        # resource_names_list might have to be specified in the job_dict
-        # and an AllOrSelectedFilesInADirectoryHTTPExtractor would be
-        # needed to complete this kind of vectorized pipeline.
+        # For a directory of local files, see the DirectoryConnector and
+        # the MultiFileExtractor.
         return reader
 
+class MultiFileExtractor(FileExtractor):
+    '''Extractor subclass for the list of filepaths returned by
+    :py:class:`~pipeline.connectors.DirectoryConnector`, yielding
+    one filepath per "line".
+    '''
+
+    def process_connection(self):
+        return iter(self.connection)
+
 class CompressedFileExtractor(FileExtractor):
     '''Extractor subclass for extracting files from a compressed file.
     '''
@@ -104,6 +111,24 @@ class TableExtractor(Extractor):
         self.headers = kwargs.get('headers', None)
         self.delimiter = kwargs.get('delimiter', ',')
         self.firstline_headers = kwargs.get('firstline_headers', True)
+        self.projection = None
+
+    def set_projection(self, columns):
+        '''Only extract the given columns from each line
+
+        Wide source files often have many columns that the schema
+        never loads. Rather than zipping every column into each
+        row and letting marshmallow ignore most of them, just
+        keep the indices of the columns that are needed.
+
+        Arguments:
+            columns: a set of schema headers to keep, or ``None``
+                to extract all columns
+        '''
+        if columns is None:
+            self.projection = None
+        else:
+            self.projection = [i for i, header in enumerate(self.schema_headers) if header in columns]
 
     def set_headers(self, headers=None):
         '''Sets headers from file or passed headers
@@ -159,7 +184,11 @@ class TableExtractor(Extractor):
         '''
         if line == self.headers:
             raise IsHeaderException
-        return OrderedDict(zip(self.schema_headers, [i if i != '' else None for i in line]))
+        if self.projection is None:
+            return OrderedDict(zip(self.schema_headers, [i if i != '' else None for i in line]))
+        n = len(line)
+        return OrderedDict((self.schema_headers[k], line[k] if line[k] != '' else None)
+                for k in self.projection if k < n)
 
 class JSONExtractor(TableExtractor):
     """This extractor assumes that the JSON file is just a reformatted
@@ -231,6 +260,83 @@ class CSVExtractor(TableExtractor):
         reader = csv.reader(self.connection, delimiter=self.delimiter)
         return reader
 
+    def local_filepath(self):
+        '''Returns the path of the connected file if it is a local
+        file (as opposed to a stream) that can be read in byte ranges.
+        '''
+        filepath = getattr(self.connection, 'name', None)
+        if isinstance(filepath, str) and os.path.isfile(filepath):
+            return filepath
+        return None
+
+    def has_quoted_newlines(self, filepath):
+        '''Checks whether any quoted field in the file spans more than
+        one line. (Any line with an odd number of quote characters
+        must either open or close such a field.)
+        '''
+        with open(filepath, 'rb') as f:
+            for line in f:
+                if line.count(b'"') % 2:
+                    return True
+        return False
+
+    def partition(self, range_size=PARTITION_RANGE_SIZE):
+        '''Splits the connected file into newline-aligned byte ranges
+        that can be parsed independently (possibly in other processes).
+
+        Keyword Arguments:
+            range_size: the approximate size in bytes of each range
+
+        Returns:
+            A list of (start, end) byte offsets covering everything
+            after the header line, or ``None`` if the file can not
+            be safely split on newlines (because it is not a local
+            file, its encoding is not ASCII-compatible, or it has
+            quoted fields which contain newlines).
+        '''
+        filepath = self.local_filepath()
+        encoding = getattr(self.connection, 'encoding', None)
+        if filepath is None or encoding is None:
+            return None
+        if '\n'.encode(encoding) != b'\n':
+            return None
+        if self.has_quoted_newlines(filepath):
+            print("Found quoted newlines in {}, so it will not be split into byte ranges.".format(filepath))
+            return None
+
+        byte_ranges = []
+        with open(filepath, 'rb') as f:
+            if self.firstline_headers:
+                f.readline()
+            start = f.tell()
+            size = os.fstat(f.fileno()).st_size
+            while start < size:
+                f.seek(min(start + range_size, size))
+                f.readline() # Advance to the end of the current line.
+                end = f.tell()
+                byte_ranges.append((start, end))
+                start = end
+        return byte_ranges
+
+    def read_byte_range(self, byte_range):
+        '''Parses the lines in a byte range of the connected file
+
+        Arguments:
+            byte_range: a (start, end) tuple of byte offsets, as
+                returned by :py:meth:`partition`
+
+        Returns:
+            A csv reader over the lines in the byte range
+        '''
+        start, end = byte_range
+        encoding = self.connection.encoding
+        if encoding.lower().replace('_', '-') == 'utf-8-sig' and start > 0:
+            encoding = 'utf-8' # The byte-order mark can only be at the start of the file.
+        with open(self.local_filepath(), 'rb') as f:
+            f.seek(start)
+            text = f.read(end - start).decode(encoding)
+        return csv.reader(io.StringIO(text, newline=''), delimiter=self.delimiter)
+
 class ExcelExtractor(TableExtractor):
     '''TableExtractor subclass for newer Microsoft Excel spreadsheet files (XLSX)
     '''
@@ -245,6 +351,7 @@ class ExcelExtractor(TableExtractor):
         self.set_headers()
 
     def select_sheet(self):
+        from openpyxl import load_workbook # (Imported here since it's slow to import.)
         self.connection.seek(0) # This line doesn't seem to do anything for an Excel file.
         workbook = load_workbook(self.connection, read_only=True, data_only=True)
         # openpyxl's load_workbook function prefers to be sent a filename
@@ -323,6 +430,7 @@ class OldExcelExtractor(TableExtractor):
         data = []
         self.connection.seek(0)
         contents = self.connection.read()
+        from xlrd import open_workbook # (Imported here since it's slow to import.)
         workbook = open_workbook(file_contents=contents)
         sheet = workbook.sheet_by_index(self.sheet_index)
         self.datemode = workbook.datemode
@@ -335,6 +443,7 @@ class OldExcelExtractor(TableExtractor):
         '''Helper function to read line from Excel files and handle representations of
             different data types
         '''
+        from xlrd import xldate_as_tuple, XL_CELL_DATE
         line = []
         for col in range(sheet.ncols):
             cell = sheet.cell(row, col)
@@ -350,3 +459,67 @@ class OldExcelExtractor(TableExtractor):
             else:
                 line.append(cell.value)
         return line
+
+class ParquetExtractor(TableExtractor):
+    '''TableExtractor subclass for Parquet files
+
+    Row groups are streamed in batches (rather than reading the whole
+    file into memory), and only the projected columns (see
+    :py:meth:`TableExtractor.set_projection`) are read. Values are
+    converted to strings (or ``None``) so that the same schemas can
+    be used for Parquet and CSV versions of a source file.
+    '''
+    def __init__(self, connection, *args, **kwargs):
+        super(ParquetExtractor, self).__init__(connection, *args, **kwargs)
+        self.batch_size = kwargs.get('batch_size', 10000)
+        self.parquet_file = None
+        self.set_headers()
+
+    def open_parquet_file(self):
+        import pyarrow
+        import pyarrow.parquet as pq
+        if self.parquet_file is None:
+            source = getattr(self.connection, 'buffer', self.connection) # Parquet files are binary.
+            if not source.seekable():
+                source = pyarrow.BufferReader(source.read())
+            self.parquet_file = pq.ParquetFile(source)
+        return self.parquet_file
+
+    def set_projection(self, columns):
+        super(ParquetExtractor, self).set_projection(columns)
+        if self.projection is None:
+            self.line_headers = self.schema_headers
+        else:
+            self.line_headers = [self.schema_headers[k] for k in self.projection]
+
+    def set_headers(self, headers=None):
+        if headers:
+            self.headers = headers
+            self.schema_headers = self.headers
+        else:
+            self.headers = self.open_parquet_file().schema_arrow.names
+            self.schema_headers = self.create_schema_headers(self.headers)
+        self.line_headers = self.schema_headers
+
+    def _to_text(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    def process_connection(self):
+        parquet_file = self.open_parquet_file()
+        if self.projection is None:
+            columns = None
+        else:
+            columns = [parquet_file.schema_arrow.names[k] for k in self.projection]
+        for batch in parquet_file.iter_batches(batch_size=self.batch_size, columns=columns):
+            values_by_column = [[self._to_text(v) for v in column.to_pylist()] for column in batch.columns]
+            for line in zip(*values_by_column):
+                yield list(line)
+
+    def handle_line(self, line):
+        '''Replace empty strings with None types.
+        '''
+        return OrderedDict(zip(self.line_headers, [i if i != '' else None for i in line]))
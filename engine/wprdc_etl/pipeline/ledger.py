@@ -0,0 +1,193 @@
+import json
+import sqlite3
+from contextlib import closing
+import statistics
+import time
+
+ROW_METRICS = ['records_loaded']
+BYTE_METRICS = ['bytes_uploaded', 'request_bytes_sent']
+API_CALL_METRICS = ['api_calls']
+
+def sum_metrics(metrics, names, combine=sum):
+    '''Combine the values of the named metrics (including the ones prefixed
+    with a destination, like "ckan.records_loaded"), returning None if none
+    of them were reported.
+    '''
+    values = [v for k, v in metrics.items() if k.split('.')[-1] in names]
+    return combine(values) if values else None
+
+class RunLedger(object):
+    '''A table of the history of job runs (how long each one took and how many
+    rows, bytes, and API calls it moved), which can be used to find jobs
+    whose latest runs deviate from their usual performance.
+
+    Attributes:
+        path: the location of the sqlite3 database (usually the status DB)
+        timeout: the number of seconds to wait for another process (or
+            thread) that is writing to the database
+    '''
+    FIELDS = ['job_code', 'job_directory', 'start_time', 'duration',
+        'status', 'rows', 'bytes', 'api_calls', 'test_mode', 'metrics']
+    COMPARED_FIELDS = ['duration', 'rows', 'bytes']
+    MIN_DURATION_CHANGE = 10 # Changes of fewer seconds than this are just noise.
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        with closing(self.connect()) as conn, conn: # (Commit, then close.)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS run_ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_code TEXT NOT NULL,
+                    job_directory TEXT,
+                    start_time REAL NOT NULL,
+                    duration REAL,
+                    status TEXT,
+                    rows INTEGER,
+                    bytes INTEGER,
+                    api_calls INTEGER,
+                    test_mode INTEGER,
+                    metrics TEXT
+                )
+            ''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS run_ledger_job_code
+                ON run_ledger (job_code, start_time)''')
+
+    def connect(self):
+        # Each operation uses its own connection, since jobs run in parallel
+        # threads (and cron jobs and the scheduler daemon can overlap).
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, job_code, start_time, duration, status, metrics,
+            job_directory=None, test_mode=False):
+        '''Add a row for a job run to the ledger
+
+        Arguments:
+            job_code: the code of the job
+            start_time: UNIX timestamp of the start of the run
+            duration: the number of seconds the run took
+            status: 'success', 'failed', or 'file_not_found'
+            metrics: the dict of counts reported by the pipeline
+            job_directory: the payload directory of the job
+            test_mode: whether the job ran in test mode
+
+        Returns:
+            The recorded run (a dict)
+        '''
+        run = {
+            'job_code': job_code,
+            'job_directory': job_directory,
+            'start_time': start_time,
+            'duration': round(duration, 3),
+            'status': status,
+            'rows': sum_metrics(metrics, ROW_METRICS, max), # (Each destination reports the same rows.)
+            'bytes': sum_metrics(metrics, BYTE_METRICS),
+            'api_calls': sum_metrics(metrics, API_CALL_METRICS),
+            'test_mode': int(bool(test_mode)),
+            'metrics': json.dumps(dict(metrics), sort_keys=True),
+        }
+        with closing(self.connect()) as conn, conn: # (Commit, then close.)
+            cursor = conn.execute(
+                'INSERT INTO run_ledger ({}) VALUES ({})'.format(
+                    ', '.join(self.FIELDS), ', '.join('?' * len(self.FIELDS))),
+                [run[f] for f in self.FIELDS])
+            run['id'] = cursor.lastrowid
+        return run
+
+    def runs(self, job_code=None, limit=None, before_id=None,
+            status=None, test_mode=None):
+        '''Return the recorded runs (as dicts), newest first
+        '''
+        conditions, parameters = [], []
+        for field, operator, value in [('job_code', '=', job_code), ('id', '<', before_id),
+                ('status', '=', status), ('test_mode', '=', test_mode)]:
+            if value is not None:
+                conditions.append(f'{field} {operator} ?')
+                parameters.append(int(value) if isinstance(value, bool) else value)
+        query = 'SELECT * FROM run_ledger'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY id DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+        with closing(self.connect()) as conn:
+            return [dict(row) for row in conn.execute(query, parameters)]
+
+    def job_codes(self):
+        with closing(self.connect()) as conn:
+            return [row[0] for row in conn.execute(
+                'SELECT DISTINCT job_code FROM run_ledger ORDER BY job_code')]
+
+    def baseline(self, run, window=10):
+        '''Find the rolling baseline of a run: the median duration, rows, and
+        bytes of the (at most window) successful runs of the same job (in the
+        same mode) that came before it
+
+        Returns:
+            A dict of the medians (with None for any value that wasn't
+            recorded) and the number of runs they were computed from
+        '''
+        previous = self.runs(run['job_code'], limit=window, before_id=run['id'],
+            status='success', test_mode=run['test_mode'])
+        baseline = {'runs': len(previous)}
+        for field in self.COMPARED_FIELDS:
+            values = [r[field] for r in previous if r[field] is not None]
+            baseline[field] = statistics.median(values) if values else None
+        return baseline
+
+    def deviations(self, run, threshold=0.5, window=10, min_runs=3):
+        '''Compare a successful run to its baseline
+
+        Arguments:
+            run: a run (as returned by record or runs)
+            threshold: the largest acceptable relative deviation from the
+                baseline (0.5 means 50%)
+            window: the number of previous runs in the baseline
+            min_runs: the fewest previous runs needed to flag anything
+
+        Returns:
+            A list of (field, value, baseline value, relative deviation)
+            tuples for the fields that deviate by more than the threshold
+        '''
+        if run['status'] != 'success':
+            return []
+        baseline = self.baseline(run, window)
+        if baseline['runs'] < min_runs:
+            return []
+        flagged = []
+        for field in self.COMPARED_FIELDS:
+            value, expected = run[field], baseline[field]
+            if value is None or expected is None or value == expected:
+                continue
+            if field == 'duration' and abs(value - expected) < self.MIN_DURATION_CHANGE:
+                continue
+            deviation = abs(value - expected)/expected if expected else float('inf')
+            if deviation > threshold:
+                flagged.append((field, value, expected, deviation))
+        return flagged
+
+    def regressions(self, threshold=0.5, window=10, min_runs=3, job_codes=None):
+        '''Check the latest run of each job against its baseline
+
+        Returns:
+            A list of (run, deviations) tuples for the jobs whose latest runs
+            were flagged
+        '''
+        flagged = []
+        for job_code in job_codes or self.job_codes():
+            latest = self.runs(job_code, limit=1)
+            if latest:
+                deviations = self.deviations(latest[0], threshold, window, min_runs)
+                if deviations:
+                    flagged.append((latest[0], deviations))
+        return flagged
+
+def format_deviations(deviations):
+    return ', '.join(f'{field} {value:g} vs. {expected:g} ({"+" if value > expected else "-"}{deviation:.0%})'
+        for field, value, expected, deviation in deviations)
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
@@ -1,11 +1,23 @@
-import requests, os, csv, ckanapi
+import os, csv
 import json
 import datetime
 import time
+import gzip
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from engine.wprdc_etl.pipeline.exceptions import CKANException
+from engine.wprdc_etl.pipeline.chunks import ColumnarChunk, records_of
+from engine.wprdc_etl.pipeline.delta import RowHashStore
 from engine.credentials import site, API_key
-import ckanapi
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from pprint import pprint
 
@@ -22,9 +34,72 @@ def check_keys_in_extant_file(keys, filename):
             raise ValueError(f'The fields {outliers} do not appear in the CSV file {filename}.')
         return extant_fields
 
+def _json_default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return str(obj) # Keep the precision (CKAN's numeric type will parse the string).
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def encode_json(obj):
+    '''Serialize an object (like a request body) to UTF-8-encoded JSON
+
+    orjson is used if it's installed (as it's several times faster than
+    the json module for large lists of records); otherwise the standard
+    library is used. Either way, dates, datetimes, times, and Decimals
+    are serialized without needing to be converted first.
+
+    Returns:
+        bytes
+    '''
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default)
+    return json.dumps(obj, default=_json_default, ensure_ascii=False).encode('utf-8')
+
+class FileManifest(object):
+    """A JSON file recording which source files have been loaded to which
+    packages (along with the size and modification time of each file when
+    it was loaded), so that a directory of files can be loaded incrementally.
+    """
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        if filepath is not None and os.path.exists(filepath):
+            with open(filepath, 'r') as f:
+                self.loaded = json.load(f)
+        else:
+            self.loaded = {}
+
+    def signature(self, filepath):
+        stat = os.stat(filepath)
+        return f'{stat.st_size}:{stat.st_mtime}'
+
+    def contains(self, package_id, filepath):
+        """Return True if the file has been loaded to the package (and not
+        modified since)."""
+        filename = os.path.basename(filepath)
+        return self.loaded_to(package_id).get(filename) == self.signature(filepath)
+
+    def loaded_to(self, package_id):
+        """Return a dict mapping the names of the files loaded to the package to their signatures."""
+        return self.loaded.get(str(package_id), {}) # JSON object keys are strings.
+
+    def add(self, package_id, filepath):
+        with self.lock:
+            self.loaded.setdefault(str(package_id), {})[os.path.basename(filepath)] = self.signature(filepath)
+            self.save()
+
+    def save(self):
+        if self.filepath is None:
+            return
+        temp_filepath = self.filepath + '.tmp'
+        with open(temp_filepath, 'w') as f:
+            json.dump(self.loaded, f, indent=4, sort_keys=True)
+        os.replace(temp_filepath, self.filepath) # Never leave a partially written manifest.
+
 class Loader(object):
     def __init__(self, *args, **kwargs):
-        pass
+        self.metrics = Counter() # Counts that the pipeline reports at the end of a run.
 
     def load(self, data):
         '''Main load method for Loaders to implement
@@ -34,6 +109,13 @@ class Loader(object):
         '''
         raise NotImplementedError
 
+    def finalize(self):
+        '''Called once by the pipeline after the last chunk has been
+        loaded, for Loaders that need to close files or make one-time
+        calls at the end of a run.
+        '''
+        pass
+
 class CKANLoader(Loader):
     """Connection to CKAN datastore"""
     # Currently CKANLoader may contain some functions that really
@@ -83,7 +165,8 @@ class CKANLoader(Loader):
             The resource ID if the resource is found within the package;
             ``None`` otherwise
         """
-        response = requests.post(
+        from engine.wprdc_etl.pipeline.ckan_trace import traced_post
+        response = traced_post(
             self.ckan_url + 'action/package_show',
             headers={
                 'content-type': 'application/json',
@@ -128,7 +211,8 @@ class CKANLoader(Loader):
         '''
 
         # Make api call
-        response = requests.post(
+        from engine.wprdc_etl.pipeline.ckan_trace import traced_post
+        response = traced_post(
             self.ckan_url + 'action/resource_create',
             headers={
                 'content-type': 'application/json',
@@ -166,6 +250,7 @@ class CKANLoader(Loader):
         Returns:
             request status
         """
+        from engine.wprdc_etl.pipeline.ckan_trace import traced_post
         kwparameters = {
                 'id': resource_id,
                 'last_modified': datetime.datetime.now().isoformat(),
@@ -174,7 +259,7 @@ class CKANLoader(Loader):
             kwparameters['url'] = self.dump_url + str(resource_id)
             kwparameters['url_type'] = 'datapusher'
 
-        update = requests.post(
+        update = traced_post(
             self.ckan_url + 'action/resource_patch',
             headers={
                 'content-type': 'application/json',
@@ -183,12 +268,45 @@ class CKANLoader(Loader):
             data=json.dumps(kwparameters),
             verify=self.verify_requests
         )
+        self.metrics['metadata_updates'] += 1
         return update.status_code
 
+    def update_metadata_with_retries(self, resource_id, just_last_modified=False):
+        """Update a resource's metadata, trying up to three times
+
+        Raises:
+            RuntimeError if all three attempts fail
+
+        Returns:
+            request status
+        """
+        update_status = self.update_metadata(resource_id, just_last_modified)
+        for delay in [5, 10]:
+            if str(update_status)[0] not in ['4', '5']:
+                return update_status
+            time.sleep(delay)
+            update_status = self.update_metadata(resource_id, just_last_modified) # Try metadata update again.
+        if str(update_status)[0] in ['4', '5']:
+            raise RuntimeError('Metadata update failed (three times) with final status code {}'.format(str(update_status)))
+        return update_status
+
+def upload_progress_printer(filename, total_bytes, step=10):
+    '''Return a callback for a MultipartEncoderMonitor that prints the
+    progress of an upload every ``step`` percent.'''
+    last_reported = [0]
+    def report(monitor):
+        percent = int(100*monitor.bytes_read/max(total_bytes, 1))
+        if percent >= last_reported[0] + step:
+            last_reported[0] = percent - percent % step
+            print(f'  Uploaded {min(percent, 100)}% of {filename} ({monitor.bytes_read:,} bytes)')
+    return report
+
 class CKANFilestoreLoader(CKANLoader):
     '''Store files in CKAN's filestore.
     '''
     has_tabular_output = False
+    max_retries = 3 # for failed uploads
+    retry_delay = 5 # seconds (doubled after each retry)
 
     def __init__(self, *args, **kwargs):
         '''Constructor for new CKANFilestoreLoader
@@ -208,6 +326,145 @@ class CKANFilestoreLoader(CKANLoader):
         # for saving files in FileLoader. Here it is being used
         # by CKANFilestoreLoader, just to pass the filename
         # (where any other parts of the path will be ignored).
+        self.resource_names_from_filenames = kwargs.get('resource_names_from_filenames', False) # When
+        # loading a directory of files, each file goes to the resource named after it.
+        self.upload_workers = kwargs.get('upload_workers', 4)
+        self.manifest = FileManifest(kwargs.get('manifest_filepath', None))
+
+    def get_resource_ids_by_name(self, package_id):
+        """Get the IDs of all the (named) resources in a package with one
+        package_show call."""
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+        ckan = TracedRemoteCKAN(site, apikey=API_key)
+        package = ckan.action.package_show(id=package_id)
+        return {r['name']: r['id'] for r in package['resources'] if 'name' in r}
+
+    def post_file(self, action, filepath, upload_kwargs):
+        """Upload a local file to a CKAN action (``resource_create`` or
+        ``resource_update``) as multipart/form-data, streaming it from disk
+        (when requests_toolbelt is installed). Failed uploads are retried
+        from the beginning of the file (so the source never has to be
+        fetched again).
+
+        Returns:
+            The resource (as a dict)
+
+        Raises:
+            CKANException if CKAN rejects the upload
+            RuntimeError if every attempt fails
+        """
+        import requests
+        from engine.wprdc_etl.pipeline.ckan_trace import traced_post
+        try: # requests_toolbelt lets files be uploaded without reading them into memory.
+            from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
+        except ImportError:
+            MultipartEncoder = None
+        filename = os.path.basename(filepath)
+        total_bytes = os.path.getsize(filepath)
+        fields = {k: str(v) for k, v in upload_kwargs.items() if v is not None}
+        delay, response, error = self.retry_delay, None, None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                print(f'Upload of {filename} failed ({error}). Retrying in {delay} seconds...')
+                self.metrics['upload_retries'] += 1
+                time.sleep(delay)
+                delay *= 2
+            try:
+                with open(filepath, 'rb') as f:
+                    if MultipartEncoder is not None:
+                        encoder = MultipartEncoderMonitor(
+                            MultipartEncoder(fields=dict(fields, upload=(filename, f, 'application/octet-stream'))),
+                            upload_progress_printer(filename, total_bytes))
+                        response = traced_post(self.ckan_url + 'action/' + action, data=encoder,
+                            headers={'content-type': encoder.content_type, 'authorization': self.key},
+                            verify=self.verify_requests)
+                    else: # requests reads the whole file into memory to encode it.
+                        response = traced_post(self.ckan_url + 'action/' + action, data=fields,
+                            files={'upload': (filename, f)}, headers={'authorization': self.key},
+                            verify=self.verify_requests)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                response, error = None, e
+                continue
+            if response.status_code < 500: # Client errors won't be fixed by retrying.
+                break
+            error = f'status code {response.status_code}'
+        if response is None or response.status_code >= 500:
+            raise RuntimeError(f'Uploading {filename} failed after {self.max_retries + 1} attempts ({error}).')
+
+        result = response.json()
+        if not result.get('success', False):
+            raise CKANException(f"Uploading {filename} failed: {result.get('error')}")
+        self.metrics['bytes_uploaded'] += total_bytes
+        return result['result']
+
+    def upload_file(self, filepath, resource_name, resource_id=None):
+        """Upload a local file to the resource with the given name,
+        creating the resource if it doesn't exist."""
+        filename = os.path.basename(filepath)
+        upload_kwargs = {
+            'package_id': self.package_id,
+            'format': filename.split('.')[-1].lower(),
+            'url': 'dummy-value',  # ignored but required by CKAN<2.6
+            'url_type': 'upload',
+            }
+        if resource_id is None:
+            upload_kwargs['name'] = resource_name
+            print(f'Creating new resource {resource_name} and uploading {filename} to filestore...')
+            result = self.post_file('resource_create', filepath, upload_kwargs)
+        else:
+            upload_kwargs['id'] = resource_id
+            print(f'Uploading {filename} to filestore (resource {resource_name})...')
+            result = self.post_file('resource_update', filepath, upload_kwargs)
+        return result['id']
+
+    def upload_files(self, filepaths):
+        """Upload each file to its own resource (named after the file, without
+        the extension), skipping files that have already been loaded.
+
+        Uploads run in a bounded pool of threads. Each successful upload is
+        recorded in the manifest right away, so that a failed run can be
+        resumed without uploading any file twice.
+
+        Returns:
+            A list of the IDs of the resources that were uploaded to
+
+        Raises:
+            RuntimeError if any of the uploads failed
+        """
+        resource_ids = self.get_resource_ids_by_name(self.package_id)
+        pending = []
+        for filepath in filepaths:
+            resource_name = os.path.basename(filepath).split('.')[0]
+            if self.manifest.contains(self.package_id, filepath):
+                continue
+            if resource_name in resource_ids and os.path.basename(filepath) not in self.manifest.loaded_to(self.package_id):
+                # Files that were uploaded before they were tracked in the manifest are
+                # assumed to be loaded. (Tracked files are uploaded again if they change.)
+                print(f"Found resource with name {resource_name} in package {self.package_id}.")
+                self.manifest.add(self.package_id, filepath)
+                continue
+            pending.append((filepath, resource_name))
+
+        if len(pending) == 0:
+            print("No new files to upload.")
+            return []
+
+        from engine.wprdc_etl.pipeline.ckan_trace import in_current_trace
+        upload_file = in_current_trace(self.upload_file) # (The uploads are part of the job's trace.)
+        uploaded_resource_ids, failures = [], []
+        with ThreadPoolExecutor(max_workers=self.upload_workers) as executor:
+            futures = {executor.submit(upload_file, filepath, resource_name, resource_ids.get(resource_name)): filepath
+                    for filepath, resource_name in pending}
+            for future in as_completed(futures):
+                filepath = futures[future]
+                try:
+                    uploaded_resource_ids.append(future.result())
+                    self.manifest.add(self.package_id, filepath)
+                except Exception as e:
+                    failures.append(f'{os.path.basename(filepath)}: {e}')
+        if failures:
+            raise RuntimeError('{} of {} file uploads failed:\n{}'.format(len(failures), len(pending), '\n'.join(failures)))
+        return uploaded_resource_ids
 
     def upload(self, data):
         """Upload file to filestore
@@ -218,6 +475,7 @@ class CKANFilestoreLoader(CKANLoader):
         Returns:
             request status
         """
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
         upload_kwargs = {
             'package_id': self.package_id,
             'format': self.file_format,
@@ -241,23 +499,34 @@ class CKANFilestoreLoader(CKANLoader):
         # upload=('myfilename.csv', urlopen(url))
         # This is borrowed from requests
         # https://2.python-requests.org/en/latest/user/quickstart/#post-a-multipart-encoded-file"
-        if hasattr(data, 'name'):
+        source_filepath = getattr(data, 'name', None)
+        if isinstance(source_filepath, str) and os.path.isfile(source_filepath):
+            # data is a file on disk (a local source file or a cached download), so
+            # stream it from there rather than passing the file object around.
+            upload_kwargs['upload'] = None
+        elif hasattr(data, 'name'):
             upload_kwargs['upload'] = data # data is the named source file (which has already been opened).
         else:
             filename = self.filepath.split('/')[-1]
             upload_kwargs['upload'] = (filename, data) # data is the source file (which has already been opened).
 
-        ckan = ckanapi.RemoteCKAN(site, apikey=API_key)
+        ckan = TracedRemoteCKAN(site, apikey=API_key)
         created_new_resource = False
         if not self.resource_exists(self.package_id, self.resource_name):
             upload_kwargs['name'] = self.resource_name
-            result = ckan.action.resource_create(**upload_kwargs)
             print('Creating new resource and uploading file to filestore...')
+            if upload_kwargs['upload'] is None:
+                result = self.post_file('resource_create', source_filepath, upload_kwargs)
+            else:
+                result = ckan.action.resource_create(**upload_kwargs)
             created_new_resource = True
         else:
             upload_kwargs['id'] = self.get_resource_id(self.package_id, self.resource_name)
-            result = ckan.action.resource_update(**upload_kwargs)
             print('Uploading file to filestore...')
+            if upload_kwargs['upload'] is None:
+                result = self.post_file('resource_update', source_filepath, upload_kwargs)
+            else:
+                result = ckan.action.resource_update(**upload_kwargs)
             # Uploading a 'local' file vs one held in memory and obtained by SFTP,
             # the two differences are:
                 # 1) the resource's "mimetype" field is set to 'application/json' rather than None
@@ -283,6 +552,8 @@ class CKANFilestoreLoader(CKANLoader):
             A two-tuple of the status codes for the upsert
             and metadata update calls
         '''
+        if self.resource_names_from_filenames:
+            return self.upload_files(data)
         upload_status, created_new_resource = self.upload(data[0]) # There is a bit of an impedance mismatch
         # with using the hack of making each line of data a file:
         # It's not clear how to handle multiple files. Eventually, it would be
@@ -293,15 +564,9 @@ class CKANFilestoreLoader(CKANLoader):
         # Maybe either have resource_name or resource_names_list and
         # vectorize other things too, as needed, verifying that lengths
         # match.
-        if created_new_resource:
-            return upload_status, None
-            # This is behind an if because the metadata can not be updated
-            # immediately after the creation of a filestore file because
-            # of some new kind of lag.
-        update_status = self.update_metadata(self.resource_id, just_last_modified=True)
-        # It's necessary to set just_last_modified to True because otherwise
-        # update_metadata tries to set the URL type and the URL to
-        # values that only work for datastores.
+        self.metrics['files_uploaded'] += 1
+        self.metadata_needs_update = not created_new_resource # The metadata can not be updated
+        # immediately after the creation of a filestore file because of some new kind of lag.
 
         if upload_status == 409:
             print(f"dir(self) = {dir(self)}")
@@ -316,23 +581,35 @@ class CKANFilestoreLoader(CKANLoader):
             upload_status = self.upload(self.resource_id, data, self.method) # Try data update again.
             if str(upload_status)[0] in ['4', '5']:
                 raise RuntimeError(f'Upload failed with status code {upload_status}.')
+        return upload_status
 
-        elif str(update_status)[0] in ['4', '5']:
-            time.sleep(5)
-            update_status = self.update_metadata(self.resource_id) # Try metadata update again.
-            if str(update_status)[0] in ['4', '5']:
-                time.sleep(10)
-                update_status = self.update_metadata(self.resource_id) # Try one more time.
-                if str(update_status)[0] in ['4', '5']:
-                    raise RuntimeError('Metadata update failed (three times) with final status code {}'.format(str(update_status)))
-        else:
-            return upload_status, update_status # It's unclear why these statuses are being returned here.
-                # I can't find a place where they are being used.
+    def finalize(self):
+        '''Update the last_modified metadata of the resource (once, after
+        all the uploads are done)
+        '''
+        if getattr(self, 'metadata_needs_update', False):
+            self.update_metadata_with_retries(self.resource_id, just_last_modified=True)
+            # It's necessary to set just_last_modified to True because otherwise
+            # update_metadata tries to set the URL type and the URL to
+            # values that only work for datastores.
+
+# Resource fields that are managed by CKAN (or that depend on the resource ID)
+# and so should not be copied from a live resource to the staging resource that
+# replaces it.
+RESOURCE_FIELDS_SET_BY_CKAN = ['id', 'package_id', 'url', 'url_type', 'position',
+    'created', 'last_modified', 'metadata_modified', 'datastore_active',
+    'datastore_contains_all_records_of_source_file', 'state', 'size', 'hash',
+    'mimetype', 'mimetype_inner', 'cache_url', 'cache_last_updated',
+    'revision_id', 'tracking_summary']
 
 class CKANDatastoreLoader(CKANLoader):
     '''Store data in CKAN using an upsert strategy
     '''
     has_tabular_output = True
+    max_retries = 3 # for server errors
+    retry_delay = 2 # seconds (doubled after each retry)
+    max_rejected_fraction = 0.05 # of each chunk (with a dead-letter file), before the load fails
+    staging_suffix = ' (staging)'
 
     def __init__(self, *args, **kwargs):
         '''Constructor for new CKANDatastoreLoader
@@ -358,6 +635,32 @@ class CKANDatastoreLoader(CKANLoader):
                 the integrated data dictionary) should be kept.
                 (Implicitly wipe_data == True implies
                 clear_first == False.)
+            swap_data: True when (with wipe_data) the records should be
+                loaded into a staging resource, which replaces the live
+                resource only after its row count has been verified
+                (so the live datastore is never empty). Note that the
+                resource ID changes with each swap.
+            json_encoder: function that serializes upsert request
+                bodies to bytes (defaults to :py:func:`encode_json`)
+            compress_requests: True when upsert request bodies
+                should be gzipped. If the server rejects a gzipped
+                request, it is resent uncompressed and compression
+                is turned off for the rest of the run.
+            delta_store_path: path of a
+                :py:class:`~pipeline.delta.RowHashStore` for the
+                resource. When given (with the ``upsert`` method),
+                only new or changed records are upserted.
+            delete_vanished: True when records whose keys were not
+                seen in this run should be deleted from the datastore
+                (requires ``delta_store_path``). Nothing is deleted in
+                a run that had to rebuild the store of row hashes.
+            dead_letter_path: path of a file to write rejected records
+                to. When given, a chunk that the server rejects because
+                of its records (a conflict or a validation error) is
+                split recursively (see :py:meth:`load_or_bisect`), so
+                that the good records still get loaded, unless more than
+                max_rejected_fraction of the chunk gets rejected.
+                Otherwise, a rejected chunk raises a RuntimeError.
 
         Raises:
             RuntimeError if fields is not specified or method is
@@ -371,6 +674,16 @@ class CKANDatastoreLoader(CKANLoader):
         self.header_fix = kwargs.get('header_fix', None)
         self.clear_first = kwargs.get('clear_first', False)
         self.wipe_data = kwargs.get('wipe_data', False)
+        self.swap_data = kwargs.get('swap_data', False)
+        self.live_resource_id = None
+        self.json_encoder = kwargs.get('json_encoder', None) or encode_json
+        self.compress_requests = kwargs.get('compress_requests', False)
+        self.delta_store_path = kwargs.get('delta_store_path', None)
+        self.delete_vanished = kwargs.get('delete_vanished', False)
+        self.delta_store = None
+        self.delta_store_rebuilt = False
+        self.dead_letter_path = kwargs.get('dead_letter_path', None)
+        self.last_error = None
         self.first_pass = True
 
         if self.fields is None:
@@ -383,6 +696,10 @@ class CKANDatastoreLoader(CKANLoader):
             raise RuntimeError('Resource must already exist in order to wipe its records.')
         if self.wipe_data and self.clear_first:
             raise RuntimeError('wipe_data and clear_first can not both be True at once.')
+        if self.swap_data and not self.wipe_data:
+            raise RuntimeError('swap_data requires wipe_data.')
+        if self.delta_store_path is not None and self.method != 'upsert':
+            raise RuntimeError('Delta loading requires the upsert method.')
 
     def create_datastore(self, resource_id, fields):
         """Create new datastore for specified resource
@@ -399,7 +716,8 @@ class CKANDatastoreLoader(CKANLoader):
         """
 
         # Make API call
-        create_datastore = requests.post(
+        from engine.wprdc_etl.pipeline.ckan_trace import traced_post
+        create_datastore = traced_post(
             self.ckan_url + 'action/datastore_create',
             headers={
                 'content-type': 'application/json',
@@ -438,9 +756,13 @@ class CKANDatastoreLoader(CKANLoader):
         return create_datastore['result']['resource_id']
 
     def generate_datastore(self, fields, clear, first, wipe_data):
-        if wipe_data and first:
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+        if wipe_data and first and self.swap_data:
+            self.create_staging_datastore(fields)
+
+        elif wipe_data and first:
             # Delete all the records in the datastore, preserving the schema.
-            ckan = ckanapi.RemoteCKAN(site, apikey=self.key)
+            ckan = TracedRemoteCKAN(site, apikey=self.key)
             response = ckan.action.datastore_delete(id=self.resource_id, filters={}, force=True)
             # Deleting the records in the datastore also has the side effect of deactivating the
             # datastore, so we need to reactivate it.
@@ -481,6 +803,68 @@ class CKANDatastoreLoader(CKANLoader):
 
         return self.resource_id
 
+    def create_staging_datastore(self, fields):
+        '''Create a staging resource (next to the live one) with an empty
+        datastore that has the same fields and integrated data dictionary,
+        and direct the loading of records to it. (It replaces the live
+        resource in :py:meth:`swap_in_staging_resource`.)
+
+        Returns:
+            The ID of the staging resource
+        '''
+        import ckanapi
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+        ckan = TracedRemoteCKAN(site, apikey=self.key)
+        live_resource = ckan.action.resource_show(id=self.resource_id)
+        staging_name = live_resource['name'] + self.staging_suffix
+        package = ckan.action.package_show(id=live_resource['package_id'])
+        for resource in package['resources']:
+            if resource['name'] == staging_name: # This was left behind by a run that failed.
+                ckan.action.resource_delete(id=resource['id'])
+
+        try:
+            live_fields = ckan.action.datastore_search(id=self.resource_id, limit=0)['fields']
+        except ckanapi.errors.NotFound: # The live datastore is missing or inactive.
+            live_fields = []
+        info_by_field = {f['id']: f['info'] for f in live_fields if 'info' in f}
+        staging_fields = [dict(f, info=info_by_field[f['id']]) if f['id'] in info_by_field else f for f in fields]
+
+        self.live_resource_id = self.resource_id
+        self.resource_id = self.create_resource(live_resource['package_id'], staging_name)
+        self.create_datastore(self.resource_id, staging_fields)
+        print(f"Loading records into the staging resource {self.resource_id} (which will replace {self.live_resource_id}).")
+        return self.resource_id
+
+    def swap_in_staging_resource(self):
+        '''Replace the live resource with the staging resource, after
+        checking that the staging datastore has the loaded records: The
+        staging resource takes the live resource's name, metadata, and
+        position in the package, and then the live resource is deleted.
+
+        Raises:
+            RuntimeError if the staging datastore does not contain the
+            expected number of records (in which case the live resource
+            is left alone)
+        '''
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+        expected_count = self.metrics['records_loaded']
+        staging_count = self.count_datastore_rows()
+        if staging_count == 0 or staging_count > expected_count or (self.method == 'insert' and staging_count != expected_count):
+            raise RuntimeError(f'The staging resource ({self.resource_id}) has {staging_count} records, but {expected_count} were loaded, so it was not swapped in for {self.live_resource_id}.')
+
+        ckan = TracedRemoteCKAN(site, apikey=self.key)
+        live_resource = ckan.action.resource_show(id=self.live_resource_id)
+        metadata = {k: v for k, v in live_resource.items() if k not in RESOURCE_FIELDS_SET_BY_CKAN}
+        ckan.action.resource_patch(id=self.resource_id, **metadata)
+
+        package = ckan.action.package_show(id=live_resource['package_id'])
+        order = [r['id'] for r in package['resources'] if r['id'] != self.resource_id]
+        order[order.index(self.live_resource_id)] = self.resource_id
+        ckan.action.package_resource_reorder(id=live_resource['package_id'], order=order)
+        ckan.action.resource_delete(id=self.live_resource_id)
+        print(f"Swapped in {self.resource_id} (with {staging_count} records) for {self.live_resource_id}.")
+        self.metrics['resources_swapped'] += 1
+
     def delete_datastore(self, resource_id):
         """Deletes datastore table for resource
 
@@ -490,7 +874,8 @@ class CKANDatastoreLoader(CKANLoader):
         Returns:
             Status code from the request
         """
-        delete = requests.post(
+        from engine.wprdc_etl.pipeline.ckan_trace import traced_post
+        delete = traced_post(
             self.ckan_url + 'action/datastore_delete',
             headers={
                 'content-type': 'application/json',
@@ -504,6 +889,57 @@ class CKANDatastoreLoader(CKANLoader):
         )
         return delete.status_code
 
+    def encode_request_body(self, body):
+        """Serialize (and maybe compress) a request body, recording the
+        sizes and times in the metrics.
+
+        Returns:
+            A two-tuple of the JSON body (bytes) and the (possibly
+            gzipped) body to send
+        """
+        start = time.perf_counter()
+        encoded = self.json_encoder(body)
+        self.metrics['serialization_seconds'] += time.perf_counter() - start
+        self.metrics['json_bytes'] += len(encoded)
+        if not self.compress_requests:
+            return encoded, encoded
+        start = time.perf_counter()
+        compressed = gzip.compress(encoded, compresslevel=5)
+        self.metrics['compression_seconds'] += time.perf_counter() - start
+        return encoded, compressed
+
+    def post_json(self, action, body):
+        """POST a JSON request body to a CKAN API action, gzipping it if
+        compress_requests is True (and falling back to an uncompressed
+        request if the server rejects the gzipped one)
+
+        Returns:
+            The response
+        """
+        import requests
+        from engine.wprdc_etl.pipeline.ckan_trace import traced_post
+        encoded, payload = self.encode_request_body(body)
+        headers = {
+            'content-type': 'application/json',
+            'authorization': self.key
+        }
+        if payload is not encoded:
+            response = traced_post(self.ckan_url + 'action/' + action,
+                headers=dict(headers, **{'content-encoding': 'gzip'}),
+                data=payload, verify=self.verify_requests)
+            if response.status_code not in [400, 411, 415]:
+                self.metrics['request_bytes_sent'] += len(payload)
+                self.metrics['request_bytes_saved'] += len(encoded) - len(payload)
+                return response
+            print(f"The server rejected a gzipped request (status code {response.status_code}), so it is being resent uncompressed.")
+        response = traced_post(self.ckan_url + 'action/' + action,
+            headers=headers, data=encoded, verify=self.verify_requests)
+        self.metrics['request_bytes_sent'] += len(encoded)
+        if payload is not encoded and response.status_code == 200:
+            self.compress_requests = False # The server doesn't accept gzipped requests.
+            self.metrics['gzip_fallbacks'] += 1
+        return response
+
     def upsert(self, resource_id, data, method='upsert'):
         """Upsert data into datastore
 
@@ -514,24 +950,147 @@ class CKANDatastoreLoader(CKANLoader):
         Returns:
             request status
         """
-        upsert = requests.post(
-            self.ckan_url + 'action/datastore_upsert',
-            headers={
-                'content-type': 'application/json',
-                'authorization': self.key
-            },
-            data=json.dumps({
+        upsert = self.post_json('datastore_upsert', {
                 'resource_id': resource_id,
                 'method': method,
                 'force': True,
-                'records': data
-            }),
-            verify=self.verify_requests
-        )
+                'records': records_of(data)
+            })
         if upsert.status_code != 200:
             print(f"Attempted upsert returned with status code {upsert.status_code}, reason '{upsert.reason}', and also this explanation:\n{upsert.text}\n")
+            self.last_error = upsert.text
         return upsert.status_code
 
+    def upsert_with_retries(self, data):
+        '''Upsert a chunk of records, retrying server errors (5xx status
+        codes) with exponential backoff
+
+        Returns:
+            The status code of the last attempt
+        '''
+        delay = self.retry_delay
+        upsert_status = self.upsert(self.resource_id, data, self.method)
+        for attempt in range(self.max_retries):
+            if str(upsert_status)[0] != '5':
+                break
+            self.metrics['upsert_retries'] += 1
+            time.sleep(delay)
+            delay *= 2
+            upsert_status = self.upsert(self.resource_id, data, self.method) # Try data update again.
+        return upsert_status
+
+    def rejects_records(self, upsert_status):
+        '''Whether a failed upsert was rejected because of the records in it
+        (a 409 conflict or a 400 validation error), rather than for a reason
+        (like permissions or a missing resource) that splitting the chunk
+        won't get around'''
+        if upsert_status == 409:
+            return True
+        if upsert_status == 400:
+            try:
+                return json.loads(self.last_error)['error']['__type'] == 'Validation Error'
+            except (ValueError, KeyError, TypeError):
+                return False
+        return False
+
+    def raise_upsert_failure(self, upsert_status, reason=''):
+        if upsert_status == 409:
+            print("dir(self) = {}".format(dir(self)))
+            pprint(self.fields)
+            print("key_fields = {}".format(self.key_fields))
+            if hasattr(self, 'indexes') and self.indexes is not None:
+                print("indexes = {}".format(self.indexes))
+            raise RuntimeError('Upsert failed with status code {}.{} This may be because of a conflict between datastore fields/keys and specified primary keys. Or maybe you are trying to insert a row into a resource with an existing row with the same primary key or keys. But check the more informative explanation above.'.format(str(upsert_status), reason))
+        raise RuntimeError('Upsert failed with status code {}.{}'.format(str(upsert_status), reason))
+
+    def load_or_bisect(self, data, rejected, max_rejected):
+        '''Upsert a chunk of records. If the server rejects the chunk because
+        of its records, split it in half and load each half separately, so
+        that each bad record is isolated in about log2(len(data)) requests
+        while the good records still get loaded.
+
+        Arguments:
+            data: the records to load
+            rejected: a list that (record, status code, error text)
+                tuples are appended to for the rejected records
+            max_rejected: the most records that may be rejected
+
+        Raises:
+            RuntimeError if the server keeps returning server errors,
+            rejects the chunk for some other reason than its records,
+            or rejects more than max_rejected records (which stops the
+            splitting early when a whole chunk is bad)
+        '''
+        upsert_status = self.upsert_with_retries(data)
+        if str(upsert_status)[0] not in ['4', '5']:
+            return
+        if not self.rejects_records(upsert_status):
+            self.raise_upsert_failure(upsert_status)
+        if len(data) == 1:
+            rejected.append((data[0], upsert_status, self.last_error))
+            if len(rejected) > max_rejected:
+                self.raise_upsert_failure(upsert_status,
+                    ' Too many records were rejected to keep loading the chunk one part at a time.')
+            return
+        self.metrics['chunk_bisections'] += 1
+        middle = len(data)//2
+        self.load_or_bisect(data[:middle], rejected, max_rejected)
+        self.load_or_bisect(data[middle:], rejected, max_rejected)
+
+    def write_dead_letters(self, rejected):
+        '''Append rejected records (and the server's explanations) to the
+        dead-letter file (as JSON lines)'''
+        directory = os.path.dirname(self.dead_letter_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        mode = 'a' if self.metrics['dead_letter_records'] > 0 else 'w' # Start a new file each run.
+        with open(self.dead_letter_path, mode) as f:
+            for record, status, error in rejected:
+                f.write(json.dumps({'resource_id': self.resource_id, 'record': record,
+                    'status_code': status, 'error': error}, default=_json_default) + '\n')
+        self.metrics['dead_letter_records'] += len(rejected)
+
+    def count_datastore_rows(self):
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+        ckan = TracedRemoteCKAN(site, apikey=self.key)
+        return ckan.action.datastore_search(id=self.resource_id, limit=0)['total']
+
+    def iterate_datastore_records(self, page_size=10000):
+        '''Page through all the records in the datastore (without the _id field)'''
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+        ckan = TracedRemoteCKAN(site, apikey=self.key)
+        field_ids = [f['id'] for f in self.fields]
+        offset = 0
+        while True:
+            records = ckan.action.datastore_search(id=self.resource_id, limit=page_size,
+                    offset=offset, fields=field_ids, sort='_id')['records']
+            for record in records:
+                yield record
+            if len(records) < page_size:
+                break
+            offset += page_size
+
+    def open_delta_store(self, emptied):
+        '''Open the store of row hashes, rebuilding it from the datastore if it
+        is missing or stale (that is, if it doesn't have one entry for every
+        record in the datastore)
+
+        Arguments:
+            emptied: True when the datastore has just been cleared or wiped
+        '''
+        store = RowHashStore(self.delta_store_path, self.key_fields, self.fields)
+        if emptied:
+            store.clear()
+        else:
+            datastore_rows = self.count_datastore_rows()
+            if store.is_new or len(store) != datastore_rows:
+                print(f"Rebuilding the store of row hashes from the {datastore_rows} records in the datastore.")
+                store.rebuild(self.iterate_datastore_records())
+                self.delta_store_rebuilt = True
+                self.metrics['delta_store_rebuilds'] += 1
+        store.start_run()
+        return store
+
     def load(self, data):
         '''Load data to CKAN using an upsert strategy
 
@@ -540,42 +1099,100 @@ class CKANDatastoreLoader(CKANLoader):
                 to the configured CKAN instance
 
         Raises:
-            RuntimeError if the upsert or update metadata
-                calls are unsuccessful
+            RuntimeError if the upsert call is unsuccessful (or, when
+            rejected records go to a dead-letter file, if too many of
+            the chunk's records are rejected, or the chunk is rejected
+            for some other reason, as described in
+            :py:meth:`load_or_bisect`)
 
         Returns:
-            A two-tuple of the status codes for the upsert
-            and metadata update calls
+            The status code for the upsert call (or 207 if some records
+            were rejected and written to the dead-letter file)
         '''
         self.generate_datastore(self.fields, self.clear_first, self.first_pass, self.wipe_data)
+        if self.delta_store_path is not None:
+            if self.first_pass:
+                self.delta_store = self.open_delta_store(emptied=self.clear_first or self.wipe_data)
+            data, key_hashes = self.delta_store.changed(records_of(data))
+            self.metrics['records_unchanged'] += len(key_hashes) - len(data)
         self.first_pass = False
-        upsert_status = self.upsert(self.resource_id, data, self.method)
-        update_status = self.update_metadata(self.resource_id)
-
-        if upsert_status == 409:
-            print("dir(self) = {}".format(dir(self)))
-            pprint(self.fields)
-            print("key_fields = {}".format(self.key_fields))
-            if hasattr(self, 'indexes') and self.indexes is not None:
-                print("indexes = {}".format(self.indexes))
-            raise RuntimeError('Upsert failed with status code {}. This may be because of a conflict between datastore fields/keys and specified primary keys. Or maybe you are trying to insert a row into a resource with an existing row with the same primary key or keys. But check the more informative explanation above.'.format(str(upsert_status)))
+        self.metrics['chunks_loaded'] += 1
+        if self.delta_store is not None and len(data) == 0:
+            self.delta_store.update(key_hashes) # There's nothing to upsert, but the keys were seen.
+            return 200
+        if self.dead_letter_path is not None:
+            rejected = []
+            try:
+                self.load_or_bisect(data, rejected,
+                    max_rejected=min(len(data) - 1, self.max_rejected_fraction*len(data)))
+            finally:
+                if rejected:
+                    self.write_dead_letters(rejected)
+            self.metrics['records_loaded'] += len(data) - len(rejected)
+            if self.delta_store is not None:
+                rejected_keys = set(self.delta_store.key_of(record) for record, _, _ in rejected)
+                self.delta_store.update([kh for kh in key_hashes if kh[0] not in rejected_keys])
+            return 200 if not rejected else 207
+
+        upsert_status = self.upsert_with_retries(data)
+        self.metrics['records_loaded'] += len(data)
 
         if str(upsert_status)[0] in ['4', '5']:
-            time.sleep(10)
-            upsert_status = self.upsert(self.resource_id, data, self.method) # Try data update again.
-            if str(upsert_status)[0] in ['4', '5']:
-                raise RuntimeError('Upsert failed with status code {}.'.format(str(upsert_status)))
+            self.raise_upsert_failure(upsert_status)
+        if self.delta_store is not None:
+            self.delta_store.update(key_hashes)
+        return upsert_status
+
+    def delete_vanished_records(self, batch_size=1000):
+        '''Delete the records whose keys were not seen in this run from the
+        datastore (and the store of row hashes)
+
+        The records are deleted in batches, with one datastore_delete call
+        for up to ``batch_size`` values of the last key field (and the same
+        values of any other key fields).
+        '''
+        from engine.wprdc_etl.pipeline.ckan_trace import TracedRemoteCKAN
+        ckan = TracedRemoteCKAN(site, apikey=self.key)
+        vanished = self.delta_store.vanished()
+        last_key = self.key_fields[-1]
+        values_by_other_keys = defaultdict(list)
+        for key_values in vanished:
+            other_keys = tuple((k, key_values[k]) for k in self.key_fields[:-1])
+            values_by_other_keys[other_keys].append(key_values[last_key])
+        for other_keys, values in values_by_other_keys.items():
+            for i in range(0, len(values), batch_size):
+                filters = dict(other_keys, **{last_key: values[i:i+batch_size]})
+                ckan.action.datastore_delete(id=self.resource_id, filters=filters, force=True)
+        self.delta_store.remove(vanished)
+        self.metrics['vanished_records_deleted'] += len(vanished)
+
+    def finalize(self):
+        '''Update the resource's metadata (including last_modified) once,
+        after the last chunk has been loaded, rather than after every chunk.
+
+        With swap_data, this is also when the staging resource replaces
+        the live one.
 
-        elif str(update_status)[0] in ['4', '5']:
-            time.sleep(5)
-            update_status = self.update_metadata(self.resource_id) # Try metadata update again.
-            if str(update_status)[0] in ['4', '5']:
-                time.sleep(10)
-                update_status = self.update_metadata(self.resource_id) # Try one more time.
-                if str(update_status)[0] in ['4', '5']:
-                    raise RuntimeError('Metadata update failed (three times) with final status code {}'.format(str(update_status)))
-        else:
-            return upsert_status, update_status
+        Raises:
+            RuntimeError if the metadata update fails three times (or if
+            the staging resource can't be verified)
+        '''
+        if self.first_pass: # Nothing was loaded.
+            return
+        if self.delta_store is not None:
+            if self.delete_vanished and self.delta_store_rebuilt:
+                # The keys of the rebuilt store might not match the keys of the
+                # loaded records, so nothing is deleted until the next run.
+                print("Not deleting vanished records in the run that rebuilt the store of row hashes.")
+            elif self.delete_vanished:
+                self.delete_vanished_records()
+            self.delta_store.close()
+        if self.live_resource_id is not None:
+            self.swap_in_staging_resource()
+        self.update_metadata_with_retries(self.resource_id)
+        self.metrics['metadata_updates_saved'] += self.metrics['chunks_loaded'] - 1
+        if self.metrics['dead_letter_records'] > 0:
+            print(f"{self.metrics['dead_letter_records']} records were rejected by the datastore. They (and the reasons) are in {self.dead_letter_path}.")
 
 class FileLoader(Loader):
     """Write data to a local file, for testing or as an intermediate step
@@ -605,8 +1222,12 @@ class FileLoader(Loader):
 class TabularFileLoader(FileLoader):
     """At present, this just handles CSV files. It could be modified to handle
     TSV files with small changes.
+
+    The file is opened once per run (with a large buffer) and closed by
+    :py:meth:`finalize`.
     """
     has_tabular_output = True
+    buffer_size = 1024*1024
 
     def __init__(self, *args, **kwargs):
         super(TabularFileLoader, self).__init__(*args, **kwargs)
@@ -618,6 +1239,8 @@ class TabularFileLoader(FileLoader):
         self.clear_first = kwargs.get('clear_first', False)
         self.wipe_data = kwargs.get('wipe_data', False)
         self.first_pass = True
+        self.output_file = None
+        self.columns = None # The column order of the output file
 
         if self.fields is None:
             raise RuntimeError('Fields must be specified.')
@@ -646,17 +1269,26 @@ class TabularFileLoader(FileLoader):
 
         return filepath
 
+    def open_output_file(self, filename, keys):
+        """Open the CSV file for the rest of the run, writing the header if
+        the file is new. When appending to an existing file, verify that all
+        keys are in it and cache its column order (so that the new values go
+        into the correct columns)."""
+        is_new = not os.path.isfile(filename)
+        self.columns = keys if is_new else check_keys_in_extant_file(keys, filename)
+        self.output_file = open(filename, 'w' if is_new else 'a', buffering=self.buffer_size)
+        self.csv_writer = csv.writer(self.output_file, lineterminator='\n')
+        self.dict_writer = csv.DictWriter(self.output_file, self.columns, extrasaction='ignore', lineterminator='\n')
+        if is_new:
+            self.dict_writer.writeheader()
+
     def write_or_append_to_csv(self, filename, list_of_dicts, keys):
-        if not os.path.isfile(filename):
-            with open(filename, 'w') as output_file:
-                dict_writer = csv.DictWriter(output_file, keys, extrasaction='ignore', lineterminator='\n')
-                dict_writer.writeheader()
-        with open(filename, 'a') as output_file:
-            # When appending, verify that all keys are in the existing file.
-            extant_keys = check_keys_in_extant_file(keys, filename)
-            # Use extant_keys so that the new values go into the correct columns of the existing file.
-            dict_writer = csv.DictWriter(output_file, extant_keys, extrasaction='ignore', lineterminator='\n')
-            dict_writer.writerows(list_of_dicts)
+        if self.output_file is None:
+            self.open_output_file(filename, keys)
+        if isinstance(list_of_dicts, ColumnarChunk): # Write the rows straight from the columns.
+            self.csv_writer.writerows(list_of_dicts.rows(self.columns))
+        else:
+            self.dict_writer.writerows(list_of_dicts)
 
     def insert(self, filepath, data, method='insert'):
         """Insert data into the file
@@ -668,8 +1300,7 @@ class TabularFileLoader(FileLoader):
         Returns:
             request status
         """
-        assert method == 'insert' # Upserts will have to be handled if FileLoader
-        # is ever modified to support SQLite output.
+        assert method == 'insert' # Upserts are handled by SQLiteFileLoader.
         ordered_list_of_fields = [f['id'] for f in self.fields] # Convert
         # CKAN-formatted field list (really a schema) to list of field names.
         self.write_or_append_to_csv(filepath, data, ordered_list_of_fields)
@@ -685,12 +1316,145 @@ class TabularFileLoader(FileLoader):
             The filepath
         '''
 
-        self.clear_file(self.clear_first, self.first_pass, self.wipe_data)
-        self.check_format(self.filepath, self.file_format)
+        if self.first_pass:
+            self.clear_file(self.clear_first, self.first_pass, self.wipe_data)
+            self.check_format(self.filepath, self.file_format)
+        self.insert(self.filepath, data, self.method)
+        self.metrics['records_loaded'] += len(data)
+        self.first_pass = False
+        return self.filepath
+
+    def finalize(self):
+        """Flush and close the output file."""
+        if self.output_file is not None:
+            self.output_file.close()
+            self.output_file = None
+
+SQLITE_TYPES_BY_CKAN_TYPE = {
+    'int': 'INTEGER',
+    'numeric': 'NUMERIC',
+    'float': 'REAL',
+} # Everything else is stored as text.
+
+class SQLiteFileLoader(TabularFileLoader):
+    """Load records into a local SQLite database (which honors the primary
+    keys, so records can be upserted just as they would be to a CKAN
+    datastore) and export them to a CSV file at the end of the run.
+
+    The database is kept next to the CSV file (with a ``.sqlite``
+    extension), so later runs upsert to the records of earlier runs,
+    unless ``clear_first`` or ``wipe_data`` is set. (A new database
+    starts with the records in the CSV file, if it exists.)
+    """
+    has_tabular_output = True
+
+    def __init__(self, *args, **kwargs):
+        super(SQLiteFileLoader, self).__init__(*args, **kwargs)
+        self.database_filepath = kwargs.get('database_filepath', None) or os.path.splitext(self.filepath)[0] + '.sqlite'
+        self.columns = [f['id'] for f in self.fields]
+        self.conn = None
+
+    @staticmethod
+    def quote(name):
+        return '"{}"'.format(name.replace('"', '""'))
+
+    @staticmethod
+    def sqlite_value(value):
+        """Store values as the text that would be written to a CSV file
+        (except for numbers, which SQLite stores as they are)."""
+        if value is None or type(value) in [str, int, float]:
+            return value
+        return str(value)
+
+    def open_database(self):
+        """Connect to the database (with write-ahead logging) and create the
+        table of records if it doesn't exist yet."""
+        if (self.clear_first or self.wipe_data) and os.path.exists(self.database_filepath):
+            os.remove(self.database_filepath)
+        is_new = not os.path.exists(self.database_filepath)
+        self.conn = sqlite3.connect(self.database_filepath)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        # Declaring the column types makes SQLite convert numbers read from an
+        # existing CSV file, so that they match the keys of upserted records.
+        column_definitions = ['{} {}'.format(self.quote(f['id']), SQLITE_TYPES_BY_CKAN_TYPE.get(f['type'], 'TEXT'))
+            for f in self.fields]
+        if self.key_fields:
+            column_definitions.append('PRIMARY KEY ({})'.format(', '.join(self.quote(k) for k in self.key_fields)))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS records ({})'.format(', '.join(column_definitions)))
+        extant_columns = [row[1] for row in self.conn.execute('PRAGMA table_info(records)')]
+        if extant_columns != self.columns:
+            raise ValueError(f'The fields {self.columns} do not match the fields {extant_columns} in the database {self.database_filepath}. (Use clear_first to start over.)')
+        self.conn.commit()
+
+        statement = 'INSERT INTO records ({}) VALUES ({})'.format(
+            ', '.join(self.quote(c) for c in self.columns), ', '.join('?'*len(self.columns)))
+        if self.method == 'upsert':
+            other_columns = [c for c in self.columns if c not in self.key_fields]
+            if other_columns:
+                statement += ' ON CONFLICT ({}) DO UPDATE SET {}'.format(
+                    ', '.join(self.quote(k) for k in self.key_fields),
+                    ', '.join('{0} = excluded.{0}'.format(self.quote(c)) for c in other_columns))
+            else:
+                statement += ' ON CONFLICT DO NOTHING'
+        self.statement = statement
+
+        if is_new and os.path.isfile(self.filepath) and not (self.clear_first or self.wipe_data):
+            # Start from the records in an existing CSV file (written without the database).
+            with open(self.filepath, 'r') as f:
+                self.insert(self.filepath, csv.DictReader(f), self.method)
+
+    def insert(self, filepath, data, method='upsert'):
+        """Insert or upsert the records (in one transaction)
+
+        Raises:
+            RuntimeError if inserting a record would duplicate a primary key
+        """
+        if isinstance(data, ColumnarChunk):
+            rows = data.rows(self.columns)
+        else:
+            rows = ([record.get(c) for c in self.columns] for record in data)
+        try:
+            with self.conn:
+                self.conn.executemany(self.statement, ([self.sqlite_value(v) for v in row] for row in rows))
+        except sqlite3.IntegrityError as e:
+            raise RuntimeError(f'Insert failed because of a conflict with the primary key ({self.key_fields}): {e}')
+
+    def load(self, data):
+        '''Load data into the local database
+
+        Arguments:
+            data: a list of records to be inserted into or upserted
+                to the database
+
+        Returns:
+            The filepath (of the CSV file to be written by finalize)
+        '''
+        if self.first_pass:
+            self.check_format(self.filepath, self.file_format)
+            self.open_database()
         self.insert(self.filepath, data, self.method)
+        self.metrics['records_loaded'] += len(data)
         self.first_pass = False
         return self.filepath
 
+    def finalize(self):
+        """Export the records in the database (in the order in which they
+        were first loaded) to the CSV file."""
+        if self.conn is None:
+            return
+        temporary_filepath = self.filepath + '.tmp'
+        with open(temporary_filepath, 'w', buffering=self.buffer_size) as output_file:
+            writer = csv.writer(output_file, lineterminator='\n')
+            writer.writerow(self.columns)
+            cursor = self.conn.execute('SELECT {} FROM records ORDER BY rowid'.format(', '.join(self.quote(c) for c in self.columns)))
+            for rows in iter(lambda: cursor.fetchmany(10000), []):
+                writer.writerows(rows)
+        os.replace(temporary_filepath, self.filepath)
+        self.metrics['records_exported'] = self.conn.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        self.conn.close()
+        self.conn = None
+
 class NontabularFileLoader(FileLoader):
     has_tabular_output = False
 
@@ -704,10 +1468,18 @@ class NontabularFileLoader(FileLoader):
         Returns:
             request status
         """
-        import io
-        mode = 'wb' if type(data) == io.BytesIO else 'w' # io.TextIOWrapper
+        import io, shutil
+        if isinstance(data, str): # data is the path of a file found by the DirectoryConnector.
+            shutil.copyfile(data, os.path.join(os.path.dirname(filepath), os.path.basename(data)))
+            return
+        source_filepath = getattr(data, 'name', None)
+        if isinstance(source_filepath, str) and os.path.isfile(source_filepath) and 'b' in getattr(data, 'mode', ''):
+            if os.path.abspath(source_filepath) != os.path.abspath(filepath):
+                shutil.copyfile(source_filepath, filepath) # Copy the file without reading it into memory.
+            return
+        mode = 'w' if isinstance(data, io.TextIOBase) else 'wb' # io.TextIOWrapper or io.BytesIO
         with open(filepath, mode) as f:
-            f.write(data.read())
+            shutil.copyfileobj(data, f)
 
     def load(self, data):
         '''Load data into a local file
@@ -725,3 +1497,151 @@ class NontabularFileLoader(FileLoader):
             self.insert(self.filepath, file_object)
         self.first_pass = False
         return self.filepath
+
+# Map CKAN datastore types to the names of pyarrow type constructors.
+PARQUET_TYPES_BY_CKAN_TYPE = {
+    'text': 'string',
+    'int': 'int64',
+    'numeric': 'float64',
+    'float': 'float64',
+    'bool': 'bool_',
+    'timestamp': 'timestamp',
+    'date': 'date32',
+    'time': 'time64',
+    'json': 'string',
+}
+
+class ParquetFileLoader(FileLoader):
+    """Write records to a local Parquet file, with column types derived
+    from the CKAN fields (as generated by the schema) and compressed
+    column chunks.
+
+    Each chunk of records is written as a row group through a single
+    ParquetWriter, which is closed by :py:meth:`finalize`. Since Parquet
+    files can not be appended to, an existing file is always replaced.
+    """
+    has_tabular_output = True
+
+    def __init__(self, *args, **kwargs):
+        super(ParquetFileLoader, self).__init__(*args, **kwargs)
+        self.fields = kwargs.get('fields', None)
+        self.compression = kwargs.get('compression', 'snappy')
+        self.writer = None
+
+        if self.fields is None:
+            raise RuntimeError('Fields must be specified.')
+
+    def arrow_type(self, ckan_type):
+        import pyarrow
+        type_name = PARQUET_TYPES_BY_CKAN_TYPE.get(ckan_type, 'string')
+        if type_name == 'timestamp':
+            return pyarrow.timestamp('us')
+        if type_name == 'time64':
+            return pyarrow.time64('us')
+        return getattr(pyarrow, type_name)()
+
+    def arrow_schema(self):
+        import pyarrow
+        return pyarrow.schema([(f['id'], self.arrow_type(f['type'])) for f in self.fields])
+
+    def coerce(self, values, ckan_type):
+        """Convert the serialized values of one column (for instance, ISO
+        datetime strings) to Python types that pyarrow can store."""
+        parsers = {'timestamp': datetime.datetime.fromisoformat,
+                'date': datetime.date.fromisoformat,
+                'time': datetime.time.fromisoformat}
+        if ckan_type in parsers:
+            parse = parsers[ckan_type]
+            return [parse(v) if isinstance(v, str) else v for v in values]
+        if ckan_type == 'json':
+            return [v if v is None or isinstance(v, str) else json.dumps(v) for v in values]
+        return values
+
+    def to_table(self, data):
+        import pyarrow
+        schema = self.arrow_schema()
+        chunk = data if isinstance(data, ColumnarChunk) else ColumnarChunk.from_records(data)
+        missing = [None]*len(chunk)
+        arrays = []
+        for f, arrow_field in zip(self.fields, schema):
+            values = self.coerce(chunk.columns.get(f['id'], missing), f['type'])
+            try:
+                arrays.append(pyarrow.array(values, type=arrow_field.type))
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError) as e:
+                raise ValueError(f"The values of the field {f['id']} could not be stored as {arrow_field.type}: {e}")
+        return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+    def load(self, data):
+        '''Write a chunk of records to the Parquet file
+
+        Arguments:
+            data: a list of records (or a ColumnarChunk) to be written
+
+        Returns:
+            The filepath
+        '''
+        import pyarrow.parquet as pq
+        table = self.to_table(data)
+        if self.writer is None:
+            self.delete_file(self.filepath)
+            self.writer = pq.ParquetWriter(self.filepath, table.schema, compression=self.compression)
+        self.writer.write_table(table)
+        self.first_pass = False
+        return self.filepath
+
+    def finalize(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+class MultiLoader(Loader):
+    """Fan the records from one extraction out to several loaders (one per
+    destination), each of which is finalized at the end of the run.
+
+    Loaders without tabular output (like CKANFilestoreLoader) can't be
+    handed records, so they are instead handed the source file itself
+    (which must be on disk, at ``source_filepath``) when the run ends.
+    """
+    has_tabular_output = True
+
+    def __init__(self, *args, **kwargs):
+        '''Constructor for new MultiLoader
+
+        Keyword Arguments:
+            destinations: a dict mapping the name of each destination
+                to a two-tuple of its Loader class and the keyword
+                arguments to instantiate it with
+            source_filepath: path of the (local copy of the) source file,
+                for loaders that upload or copy whole files
+
+        Any other keyword arguments (like the CKAN settings from the
+        pipeline's configuration) are passed to every loader.
+        '''
+        super(MultiLoader, self).__init__(*args, **kwargs)
+        destinations = kwargs.pop('destinations')
+        self.source_filepath = kwargs.pop('source_filepath', None)
+        self.loaders = {}
+        for name, (loader_class, loader_kwargs) in destinations.items():
+            if not loader_class.has_tabular_output and self.source_filepath is None:
+                raise RuntimeError(f'Loading to {name} requires the source file to be saved locally.')
+            self.loaders[name] = loader_class(*args, **{**loader_kwargs, **kwargs})
+
+    def load(self, data):
+        '''Load a chunk of records with each tabular loader
+
+        Returns:
+            A dict of the results of the loaders (by destination)
+        '''
+        return {name: loader.load(data) for name, loader in self.loaders.items()
+                if loader.has_tabular_output}
+
+    def finalize(self):
+        '''Hand the source file to the non-tabular loaders and finalize all
+        the loaders, gathering their metrics (prefixed by destination)'''
+        for name, loader in self.loaders.items():
+            if not loader.has_tabular_output:
+                with open(self.source_filepath, 'rb') as f:
+                    loader.load([f])
+            loader.finalize()
+            for metric, value in loader.metrics.items():
+                self.metrics[f'{name}.{metric}'] += value
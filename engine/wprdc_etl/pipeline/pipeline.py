@@ -1,19 +1,46 @@
 import os
+import copy
 import json
 import sqlite3
 import time
-from icecream import ic
+import multiprocessing
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor
 
 from engine.wprdc_etl.pipeline.exceptions import (
     IsHeaderException, InvalidConfigException, DuplicateFileException, MissingStatusDatabaseError
 )
 from engine.wprdc_etl.pipeline.status import Status
 from engine.wprdc_etl.pipeline.exceptions import InvalidConfigException
-from engine.wprdc_etl.pipeline.extractors import JSONExtractor
+from engine.wprdc_etl.pipeline.extractors import JSONExtractor, PARTITION_RANGE_SIZE
+from engine.wprdc_etl.pipeline.chunks import ColumnarChunk
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 PARENT = os.path.join(HERE, '..')
 
+PARALLEL_PARSE_THRESHOLD = 50*1024*1024 # bytes
+
+_configs_by_file = {} # Parsed settings files (with their modification times), so that
+# long-running processes (like the scheduler daemon) don't reread them for every pipeline.
+
+_parallel_state = None # Set in each worker process by _set_parallel_state.
+
+def _set_parallel_state(pipeline, extractor):
+    '''Worker-process initializer for parallel parsing
+
+    Each process pool hands its own pipeline and extractor to its
+    workers (which are forked, so nothing is pickled), so pipelines
+    running concurrently in different threads can't see each other's
+    schemas.
+    '''
+    global _parallel_state
+    _parallel_state = (pipeline, extractor)
+
+def _validate_byte_range(byte_range):
+    '''Worker-process entry point for parallel parsing'''
+    pipeline, extractor = _parallel_state
+    return pipeline.validate_byte_range(extractor, byte_range)
+
 
 class Pipeline(object):
     '''Main pipeline class
@@ -32,7 +59,12 @@ class Pipeline(object):
             strict_load=True,
             retry_without_last_line=False,
             ignore_empty_rows=False,
-            filters = []
+            filters = [],
+            project_columns=True,
+            parse_workers=0,
+            parallel_threshold=PARALLEL_PARSE_THRESHOLD,
+            columnar=False,
+            spool=None
     ):
         '''
         Arguments:
@@ -54,8 +86,26 @@ class Pipeline(object):
                 to be upserted (defaults to 0) [This is useful when
                 a large ETL job fails at some point and you wish to
                 fix something and then resume uploading in the middle.]
+            project_columns: when True (the default), only the source
+                columns that the schema (and the filters) actually use
+                are extracted from each line. This is skipped for
+                schemas with hooks that have not declared the columns
+                they read (see :py:func:`~pipeline.schema.reads_columns`).
+            parse_workers: number of worker processes to use to parse
+                and validate local CSV files that are larger than
+                ``parallel_threshold`` bytes. Values less than 2
+                (the default is 0) mean that all parsing is done
+                serially.
+            columnar: when True, queue each chunk of validated
+                tabular records as a
+                :py:class:`~pipeline.chunks.ColumnarChunk` rather
+                than as a list of dicts
+            spool: a :py:class:`~pipeline.spool.ChunkSpool` to write
+                each validated chunk of tabular records to (so that the
+                run can be replayed with :py:meth:`replay`)
         '''
         self.data = []
+        self.metrics = Counter()
         self._connector, self._extractor, self._schema, self._loader = \
             None, None, None, None
         self.name = name
@@ -74,6 +124,12 @@ class Pipeline(object):
         self.strict_load = strict_load
         self.ignore_empty_rows = ignore_empty_rows
         self.filters = filters
+        self.project_columns = project_columns
+        self.parse_workers = parse_workers
+        self.parallel_threshold = parallel_threshold
+        self.columnar = columnar
+        self.spool = spool
+        self.load_error = None
 
         if conn:
             self.conn = conn
@@ -95,8 +151,11 @@ class Pipeline(object):
             the found configuration is not valid JSON
         '''
         try:
-            with open(file) as f:
-                self.config = json.loads(f.read())
+            mtime = os.path.getmtime(file)
+            if file not in _configs_by_file or _configs_by_file[file][0] != mtime:
+                with open(file) as f:
+                    _configs_by_file[file] = (mtime, json.loads(f.read()))
+            self.config = copy.deepcopy(_configs_by_file[file][1])
 
         except (KeyError, IOError, FileNotFoundError):
             raise InvalidConfigException(
@@ -182,6 +241,35 @@ class Pipeline(object):
         self.loader_kwargs = {**kwargs, **loader_config}
         return self
 
+    def validate_line(self, data):
+        '''Load a parsed line through the schema and dump it again.
+
+        Arguments:
+            data: A parsed line from an extractor's handle_line
+                method
+
+        Returns:
+            The serialized record, or ``None`` if the line could not
+            be loaded and should be skipped
+
+        Raises:
+            RuntimeError: if the line has errors and strict_load is set
+        '''
+        loaded = self.__schema.load(data)
+        if loaded.errors:
+            error_message = 'There were errors in the input data: {} (passed data: {})'.format(
+                loaded.errors.__str__(), data
+            )
+            if self.strict_load:
+                if self.ignore_empty_rows and all([v==None for v in data.values()]):
+                    print("Ignoring empty row.")
+                else:
+                    raise RuntimeError(error_message)
+            else:
+                print(error_message)
+            return None
+        return self.__schema.dump(loaded.data).data
+
     def load_line(self, data):
         '''For tabular data, load a line into the pipeline's data or throw an error.
         For non-tabular data, the contents of "data" are a file, which is added
@@ -194,20 +282,138 @@ class Pipeline(object):
         if not self._loader.has_tabular_output or self._extractor == JSONExtractor:
             self.data.append(data)
         else:
-            loaded = self.__schema.load(data)
-            if loaded.errors:
-                error_message = 'There were errors in the input data: {} (passed data: {})'.format(
-                    loaded.errors.__str__(), data
-                )
-                if self.strict_load:
-                    if self.ignore_empty_rows and all([v==None for v in data.values()]):
-                        print("Ignoring empty row.")
-                    else:
-                        raise RuntimeError(error_message)
-                else:
-                    print(error_message)
+            record = self.validate_line(data)
+            if record is not None:
+                self.data.append(record)
+
+    def new_chunk(self):
+        '''Returns an empty container for queueing a chunk of data'''
+        if self.columnar and self._loader.has_tabular_output:
+            return ColumnarChunk()
+        return []
+
+    def load_chunk(self, loader, data, last=False):
+        '''Load a chunk of data, first writing it to the spool (if there is
+        one and the data is tabular)
+
+        Once a chunk fails to load, the rest of the chunks are only
+        spooled (so that the whole run can be replayed without fetching
+        and validating the source again), and the error is raised when
+        the extraction is done.
+
+        Arguments:
+            loader: the instantiated loader
+            data: a chunk of data
+            last: True for the last chunk (after which the spool is
+                marked as complete)
+        '''
+        if self.spool is None or not loader.has_tabular_output:
+            return loader.load(data)
+        self.spool.write(data)
+        if last:
+            self.spool.finish()
+        if self.load_error is not None:
+            return
+        try:
+            result = loader.load(data)
+        except Exception as e:
+            if last:
+                raise
+            self.load_error = e
+            print("Loading failed ({}), so the remaining chunks are just being spooled (for a replay).".format(e))
+            return
+        self.spool.mark_loaded()
+        return result
+
+    def validate_byte_range(self, extractor, byte_range):
+        '''Parse, filter, and validate all the lines in one byte range
+        of a partitioned file. This is run in a worker process.
+
+        Returns:
+            A list of serialized records
+        '''
+        records = []
+        for line in extractor.read_byte_range(byte_range):
+            try:
+                data = extractor.handle_line(line)
+            except IsHeaderException:
+                continue
+            if self.filters not in [None, []]:
+                data = self.apply_filters(data)
+                if data == []:
+                    continue
+            record = self.validate_line(data)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def partition_for_parallel_parsing(self, extractor):
+        '''Decide whether to parse the source in parallel
+
+        Returns:
+            A list of byte ranges to hand to worker processes, or
+            ``None`` if the source should be parsed serially
+        '''
+        if self.parse_workers < 2 or self.start_from_chunk != 0:
+            return None
+        if not self._loader.has_tabular_output or not hasattr(extractor, 'partition'):
+            return None
+        filepath = extractor.local_filepath()
+        if filepath is None:
+            return None
+        size = os.path.getsize(filepath)
+        if size < self.parallel_threshold:
+            return None
+        # Make enough byte ranges to keep all the workers busy.
+        range_size = min(PARTITION_RANGE_SIZE, max(1, size // (4*self.parse_workers)))
+        return extractor.partition(range_size)
+
+    def run_parallel(self, extractor, loader, byte_ranges):
+        '''Parse and validate byte ranges in worker processes, and
+        load the resulting records (in their original order) in
+        chunks of ``chunk_size``.
+
+        To bound memory use, only a few byte ranges per worker are
+        in flight at any time.
+        '''
+        print("Parsing {} byte ranges with {} worker processes".format(len(byte_ranges), self.parse_workers))
+        chunk_count = 0
+        remaining_ranges = iter(byte_ranges)
+        context = multiprocessing.get_context('fork') # Schema classes from payload
+        # modules can not be pickled, but forked workers inherit them.
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=context,
+                initializer=_set_parallel_state, initargs=(self, extractor)) as executor:
+            in_flight = deque()
+            for byte_range in remaining_ranges:
+                in_flight.append(executor.submit(_validate_byte_range, byte_range))
+                if len(in_flight) >= 2*self.parse_workers:
+                    break
+            while in_flight:
+                records = in_flight.popleft().result()
+                byte_range = next(remaining_ranges, None)
+                if byte_range is not None:
+                    in_flight.append(executor.submit(_validate_byte_range, byte_range))
+                for record in records:
+                    self.data.append(record)
+                    if len(self.data) == self.chunk_size:
+                        print("Working on chunk {} (lines {}-{})".format(chunk_count, 1 + self.chunk_size*chunk_count, self.chunk_size*(chunk_count + 1)))
+                        self.load_chunk(loader, self.data)
+                        self.data = self.new_chunk()
+                        chunk_count += 1
+            self.load_last_chunk(loader)
+
+    def load_last_chunk(self, loader):
+        '''Load the last chunk of data, retrying without its last line
+        if loading fails and ``retry_without_last_line`` is set
+        '''
+        try:
+            self.load_chunk(loader, self.data, last=True)
+        except RuntimeError: # Specifically, we are interested in catching 409 errors here to deal with
+            if self.retry_without_last_line: # poorly formed source files (where the last line is partially missing).
+                print(" ** Trying to load this chunk of data again, but without the last line, which looks like this: {} **".format(self.data[-1]))
+                loader.load(self.data[:-1]) # Load all the queued data except the last item.
             else:
-                self.data.append(self.__schema.dump(loaded.data).data)
+                raise
 
     def _apply_operator(self, value_1, value_2, operator):
         if operator == "==":
@@ -244,6 +450,19 @@ class Pipeline(object):
                 return []
         return data # This assumes that data is just a single row.
 
+    def set_extractor_projection(self, extractor):
+        '''Tell the extractor to only extract the columns the schema needs
+
+        Arguments:
+            extractor: an instantiated extractor with a
+                ``set_projection`` method
+        '''
+        columns = self.__schema.source_columns()
+        if columns is None:
+            return
+        columns |= set([data_filter[0] for data_filter in self.filters or []])
+        extractor.set_projection(columns)
+
     def enforce_full_pipeline(self):
         '''Ensure that a pipeline has an extractor, schema, and loader
 
@@ -317,7 +536,9 @@ class Pipeline(object):
            connect method, handling each element with the extractor's
            ``handle_line`` method before passing it to the
            ``load_line`` method to attach each row to the pipeline's
-           data.
+           data. (Large local CSV files may instead be split into
+           byte ranges which are parsed and validated by
+           ``parse_workers`` worker processes.)
         6. After iteration, clean up the connector.
         7. Instantiate the loader and load the data.
         8. Finally, update the status to successful run and close
@@ -357,6 +578,9 @@ class Pipeline(object):
             # instantiate our schema
             self.__schema = self._schema()
 
+            if self.project_columns and self._loader.has_tabular_output and hasattr(_extractor, 'set_projection'):
+                self.set_extractor_projection(_extractor)
+
             # build the data
             raw = _extractor.process_connection()
 
@@ -364,49 +588,56 @@ class Pipeline(object):
             _loader = self._loader(
                 *(self.loader_args), **(self.loader_kwargs)
             )
+            self.data = self.new_chunk()
 
-            chunk_count = 0
-            while True:
+            byte_ranges = self.partition_for_parallel_parsing(_extractor)
+            if byte_ranges is not None:
                 try:
-                    # Get `chunk_size` number of records
-                    if chunk_count >= self.start_from_chunk:
-                        print("Working on chunk {} (lines {}-{})".format(chunk_count, 1 + self.chunk_size*chunk_count, self.chunk_size*(chunk_count + 1)))
-                    for i in range(self.chunk_size):
-                        try:
-                            line = next(raw)
-                            if chunk_count >= self.start_from_chunk:
-                                data = _extractor.handle_line(line) # line can be a record or a file.
-                                if self.filters in [None, []]:
-                                    self.load_line(data) # Queue whatever is in data for eventual loading.
-                                else:
-                                    filtered_data = self.apply_filters(data)
-                                    if filtered_data != []:
-                                        self.load_line(filtered_data) # Queue whatever is in data for eventual loading.
-                        except IsHeaderException:
-                            continue
-                        except:
-                            raise
-                    if chunk_count >= self.start_from_chunk:
-                        _loader.load(self.data) # Load all the queued data.
-                        self.data = []
-
-
-                except StopIteration:
-                    try:
-                        _loader.load(self.data) # Load all the queued data.
-                    except RuntimeError: # Specifically, we are interested in catching 409 errors here to deal with
-                        if self.retry_without_last_line: # poorly formed source files (where the last line is partially missing).
-                            print(" ** Trying to load this chunk of data again, but without the last line, which looks like this: {} **".format(self.data[-1]))
-                            _loader.load(self.data[:-1]) # Load all the queued data except the last item.
-                        else:
-                            raise
-                    _connector.close()
-                    break
-                except Exception as e:
+                    self.run_parallel(_extractor, _loader, byte_ranges)
+                finally:
                     _connector.close()
-                    raise(e)
-                    break
-                chunk_count += 1
+            else:
+                chunk_count = 0
+                while True:
+                    try:
+                        # Get `chunk_size` number of records
+                        if chunk_count >= self.start_from_chunk:
+                            print("Working on chunk {} (lines {}-{})".format(chunk_count, 1 + self.chunk_size*chunk_count, self.chunk_size*(chunk_count + 1)))
+                        for i in range(self.chunk_size):
+                            try:
+                                line = next(raw)
+                                if chunk_count >= self.start_from_chunk:
+                                    data = _extractor.handle_line(line) # line can be a record or a file.
+                                    if self.filters in [None, []]:
+                                        self.load_line(data) # Queue whatever is in data for eventual loading.
+                                    else:
+                                        filtered_data = self.apply_filters(data)
+                                        if filtered_data != []:
+                                            self.load_line(filtered_data) # Queue whatever is in data for eventual loading.
+                            except IsHeaderException:
+                                continue
+                            except:
+                                raise
+                        if chunk_count >= self.start_from_chunk:
+                            self.load_chunk(_loader, self.data) # Load all the queued data.
+                            self.data = self.new_chunk()
+
+
+                    except StopIteration:
+                        self.load_last_chunk(_loader) # Load all the queued data.
+                        _connector.close()
+                        break
+                    except Exception as e:
+                        _connector.close()
+                        raise(e)
+                        break
+                    chunk_count += 1
+
+            if self.load_error is not None:
+                raise self.load_error
+            _loader.finalize()
+            self.metrics.update(_loader.metrics)
+            self.report_metrics()
 
             if self.log_status:
                 self.status.update(status='success', input_checksum=input_checksum)
@@ -422,10 +653,52 @@ class Pipeline(object):
                     num_lines=len(self.data),
                     last_ran=time.time()
                 )
+            if self.spool is not None:
+                self.spool.close()
             self.close()
 
         return self
 
+    def replay(self, run_id=None):
+        '''Load the validated chunks of a spooled run (by default, the
+        latest completely spooled one), skipping the connector, extractor,
+        and schema stages
+
+        If some of the chunks of that run were already loaded (and the
+        loader isn't clearing or wiping the destination), loading resumes
+        with the first chunk that wasn't.
+
+        Returns:
+            modified Pipeline object
+        '''
+        if self._loader is None:
+            raise RuntimeError('You must specify a load step!')
+        info = self.spool.open_run(run_id)
+        start = info['chunks_loaded']
+        if start >= info['chunks'] or self.loader_kwargs.get('clear_first') or self.loader_kwargs.get('wipe_data'):
+            start = 0
+        print("Replaying {} records (in {} chunks) from the spooled run {}{}".format(info['records'], info['chunks'],
+            info['run_id'], ", starting with chunk {}".format(start) if start else ""))
+        self.spool.info['chunks_loaded'] = start
+        _loader = self._loader(*(self.loader_args), **(self.loader_kwargs))
+        for chunk_count, records in enumerate(self.spool.read()):
+            if chunk_count < start:
+                continue
+            _loader.load(ColumnarChunk.from_records(records) if self.columnar else records)
+            self.spool.mark_loaded()
+        _loader.finalize()
+        self.metrics.update(_loader.metrics)
+        self.report_metrics()
+        return self
+
+    def report_metrics(self):
+        '''Print the counts (of records, chunks, API calls, etc.)
+        gathered while running the pipeline.
+        '''
+        if self.metrics:
+            print("Run metrics: " + ", ".join("{}: {}".format(k, round(v, 3) if isinstance(v, float) else v)
+                for k, v in sorted(self.metrics.items())))
+
     def close(self):
         '''Close any open database connections.
         '''
@@ -1,4 +1,5 @@
 from marshmallow import Schema, fields
+from marshmallow.decorators import PRE_LOAD
 
 FIELD_TO_CKAN_TYPE_MAPPING = {
     fields.String: 'text',
@@ -8,6 +9,29 @@ FIELD_TO_CKAN_TYPE_MAPPING = {
     fields.Time: 'time', #fields.JSON: 'json' # This is not supported by Marshmallow 2.15.1.
 }
 
+def reads_columns(*columns):
+    '''Declare the source columns that a schema hook reads
+
+    Column projection (see :py:meth:`BaseSchema.source_columns`) can
+    only be used when every ``pre_load`` hook (and every hook that
+    is passed the original data) declares which source columns it
+    needs beyond the schema's own fields. Use it like this:
+
+    .. code-block:: python
+
+        @pre_load
+        @reads_columns('parcel_id')
+        def fix_zip(self, data):
+            ...
+
+    Calling it with no arguments declares that the hook only reads
+    columns that the schema already loads.
+    '''
+    def decorator(fn):
+        fn.__reads_columns__ = set(columns)
+        return fn
+    return decorator
+
 class NullSchema(Schema):
     '''A null schema which nominally is a marshmallow schema, but which
     doesn't actually do anything. It's designed to support file-based
@@ -20,6 +44,9 @@ class NullSchema(Schema):
     def serialize_to_ckan_fields(self, capitalize=False):
         return []
 
+    def source_columns(self):
+        return None
+
 class BaseSchema(Schema):
     '''Base schema for the pipeline. Extends :py:class:`marshmallow.Schema`
     '''
@@ -53,3 +80,35 @@ class BaseSchema(Schema):
                 'type': FIELD_TO_CKAN_TYPE_MAPPING[marsh_field.__class__]
             })
         return ckan_fields
+
+    def source_columns(self):
+        '''Determine which source columns are needed to load the schema
+
+        These are the names (and ``load_from`` names) of all fields
+        that are not ``dump_only``, plus any columns that hooks have
+        declared with :py:func:`reads_columns`.
+
+        Returns:
+            A set of column names, or ``None`` if some hook that
+            can see the source data has not declared the columns
+            it reads (in which case no projection should be done).
+        '''
+        columns = set()
+        for name, marsh_field in self.fields.items():
+            if marsh_field.dump_only:
+                continue
+            columns.add(name)
+            if marsh_field.load_from is not None:
+                columns.add(marsh_field.load_from)
+
+        for (tag, pass_many), attr_names in self.__processors__.items():
+            for attr_name in attr_names:
+                processor = getattr(self, attr_name)
+                processor_kwargs = processor.__marshmallow_kwargs__[(tag, pass_many)]
+                if tag != PRE_LOAD and not processor_kwargs.get('pass_original', False):
+                    continue # This hook only sees loaded (or dumped) data.
+                declared_columns = getattr(processor, '__reads_columns__', None)
+                if declared_columns is None:
+                    return None
+                columns |= declared_columns
+        return columns
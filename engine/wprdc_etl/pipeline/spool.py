@@ -0,0 +1,113 @@
+import os
+import json
+import gzip
+import datetime
+
+from engine.wprdc_etl.pipeline.chunks import records_of
+
+def _json_default(obj):
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    return str(obj)
+
+class ChunkSpool(object):
+    '''An on-disk spool of the validated chunks of a pipeline's runs, so
+    that a run whose loading failed can be replayed without fetching,
+    extracting, and validating the source again
+
+    Each run is stored in the spool directory (one per job) as a gzipped
+    file with one line per chunk (a JSON list of records), along with a
+    small JSON file of information about the run (like whether all the
+    chunks were spooled and how many of them were loaded).
+    '''
+    def __init__(self, directory, keep=2):
+        self.directory = directory
+        self.keep = keep # The number of runs to keep
+        self.run_id = None
+        self._file = None
+        self.info = None
+
+    def path(self, run_id, extension):
+        return os.path.join(self.directory, f'{run_id}.{extension}')
+
+    def runs(self):
+        '''Return the IDs of the spooled runs (oldest first)'''
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(f[:-len('.json')] for f in os.listdir(self.directory) if f.endswith('.json'))
+
+    def read_info(self, run_id):
+        with open(self.path(run_id, 'json')) as f:
+            return json.load(f)
+
+    def save_info(self):
+        temporary_path = self.path(self.run_id, 'json.tmp')
+        with open(temporary_path, 'w') as f:
+            json.dump(self.info, f)
+        os.replace(temporary_path, self.path(self.run_id, 'json'))
+
+    def start(self):
+        '''Start spooling a new run (deleting the oldest runs)'''
+        os.makedirs(self.directory, exist_ok=True)
+        runs = self.runs()
+        for run_id in runs[:max(0, len(runs) - self.keep + 1)]:
+            for extension in ['json', 'ndjson.gz']:
+                if os.path.exists(self.path(run_id, extension)):
+                    os.remove(self.path(run_id, extension))
+        self.run_id = datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        self.info = {'run_id': self.run_id, 'complete': False, 'chunks': 0,
+                'records': 0, 'chunks_loaded': 0}
+        self._file = gzip.open(self.path(self.run_id, 'ndjson.gz'), 'wt', compresslevel=3)
+        self.save_info()
+        return self.run_id
+
+    def write(self, chunk):
+        '''Append a chunk of validated records to the spool'''
+        if self._file is None:
+            self.start()
+        records = records_of(chunk)
+        self._file.write(json.dumps(records, default=_json_default) + '\n')
+        self.info['chunks'] += 1
+        self.info['records'] += len(records)
+
+    def finish(self):
+        '''Mark the run as completely spooled'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.info['complete'] = True
+            self.save_info()
+
+    def close(self):
+        '''Close the spool file (leaving an unfinished run incomplete)'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.save_info()
+
+    def mark_loaded(self):
+        '''Record that one more chunk of the run was loaded'''
+        self.info['chunks_loaded'] += 1
+        self.save_info()
+
+    def open_run(self, run_id=None):
+        '''Select a run to replay (the latest completely spooled one by
+        default)
+
+        Raises:
+            FileNotFoundError if there's no completely spooled run
+        '''
+        complete_runs = [r for r in self.runs() if self.read_info(r)['complete']]
+        if run_id is None and complete_runs:
+            run_id = complete_runs[-1]
+        if run_id not in complete_runs:
+            raise FileNotFoundError(f'No completely spooled run was found in {self.directory}.')
+        self.run_id = run_id
+        self.info = self.read_info(run_id)
+        return self.info
+
+    def read(self):
+        '''Iterate over the chunks of the selected run (as lists of dicts)'''
+        with gzip.open(self.path(self.run_id, 'ndjson.gz'), 'rt') as f:
+            for line in f:
+                yield json.loads(line)
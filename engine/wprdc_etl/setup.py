@@ -7,7 +7,8 @@ setup(
     include_package_data=True,
     install_requires=[
         'Click>6,<7', 'marshmallow>=2.6,<3', 'requests>2.9,<3',
-        'paramiko>=1.16'
+        'paramiko>=1.16', 'pyarrow>=3.0.0', 'orjson>=3.0.0',
+        'requests-toolbelt>=0.9.1'
     ],
     entry_points='''
     [console_scripts]
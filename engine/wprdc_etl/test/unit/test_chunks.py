@@ -0,0 +1,42 @@
+import unittest
+
+import wprdc_etl.pipeline as pl
+from engine.wprdc_etl.pipeline.chunks import records_of
+
+class TestColumnarChunk(unittest.TestCase):
+    def setUp(self):
+        self.chunk = pl.ColumnarChunk()
+        self.chunk.append({'words': 'one', 'numbers': 1})
+        self.chunk.append({'words': 'two', 'numbers': 2, 'extra': True})
+
+    def test_length(self):
+        self.assertEquals(len(self.chunk), 2)
+        self.assertEquals(len(pl.ColumnarChunk()), 0)
+
+    def test_columns(self):
+        self.assertListEqual(self.chunk.columns['numbers'], [1, 2])
+        self.assertListEqual(self.chunk.columns['extra'], [None, True])
+
+    def test_to_records(self):
+        self.assertListEqual(
+            records_of(self.chunk),
+            [
+                {'words': 'one', 'numbers': 1, 'extra': None},
+                {'words': 'two', 'numbers': 2, 'extra': True}
+            ]
+        )
+
+    def test_records_of_list(self):
+        records = [{'words': 'one'}]
+        self.assertIs(records_of(records), records)
+
+    def test_indexing_and_slicing(self):
+        self.assertEquals(self.chunk[-1], {'words': 'two', 'numbers': 2, 'extra': True})
+        self.assertEquals(len(self.chunk[:-1]), 1)
+        self.assertListEqual(self.chunk[:-1].columns['words'], ['one'])
+
+    def test_rows(self):
+        self.assertListEqual(
+            list(self.chunk.rows(['numbers', 'missing'])),
+            [(1, None), (2, None)]
+        )
@@ -0,0 +1,103 @@
+import json
+import threading
+import unittest
+from unittest.mock import patch, Mock
+
+import ckanapi
+from wprdc_etl.pipeline import ckan_trace
+
+class TestCKANTrace(unittest.TestCase):
+    def setUp(self):
+        self.trace = ckan_trace.start_trace('restaurants')
+
+    def tearDown(self):
+        ckan_trace.stop_trace()
+
+    @patch.object(ckanapi.RemoteCKAN, '_request_fn',
+        return_value=(200, json.dumps({'success': True, 'result': {'id': 'pkg'}})))
+    def test_remote_ckan_calls_are_traced(self, request_fn):
+        ckan = ckan_trace.TracedRemoteCKAN('http://ckan.example.org', apikey='key')
+        self.assertEquals(ckan.action.package_show(id='pkg'), {'id': 'pkg'})
+        action, seconds, request_bytes, response_bytes, status = self.trace.calls[0]
+        self.assertEquals((action, request_bytes, status), ('package_show', len('{"id": "pkg"}'), 200))
+        self.assertEquals(response_bytes, len(request_fn.return_value[1]))
+
+    @patch.object(ckanapi.RemoteCKAN, '_request_fn',
+        return_value=(404, json.dumps({'success': False, 'error': {'__type': 'Not Found Error', 'message': 'Not found'}})))
+    def test_failed_calls_are_traced(self, request_fn):
+        ckan = ckan_trace.TracedRemoteCKAN('http://ckan.example.org')
+        with self.assertRaises(ckanapi.NotFound):
+            ckan.action.resource_show(id='missing')
+        self.assertEquals(self.trace.calls[0][-1], 404)
+        self.assertEquals(self.trace.metrics()['api_errors'], 1)
+
+    @patch('requests.post')
+    def test_traced_post(self, post):
+        post.return_value = Mock(status_code=200, content=b'{"success": true}')
+        ckan_trace.traced_post('http://ckan.example.org/api/3/action/datastore_upsert', data=b'12345')
+        ckan_trace.traced_post('http://ckan.example.org/api/3/action/datastore_upsert', json={'a': 1})
+        summary = self.trace.summary()['datastore_upsert']
+        self.assertEquals(summary['calls'], 2)
+        self.assertEquals(summary['request_bytes'], 5 + len('{"a": 1}'))
+        self.assertEquals(summary['response_bytes'], 2*len(b'{"success": true}'))
+        self.assertEquals(self.trace.metrics()['api_calls'], 2)
+
+    @patch('requests.post', return_value=Mock(status_code=200, content=b''))
+    def test_worker_threads(self, post):
+        untraced = threading.Thread(target=ckan_trace.traced_post, args=('http://x/api/action/resource_patch',))
+        traced = threading.Thread(target=ckan_trace.in_current_trace(ckan_trace.traced_post), args=('http://x/api/action/resource_patch',))
+        for thread in [untraced, traced]:
+            thread.start()
+            thread.join()
+        self.assertEquals(len(self.trace.calls), 1)
+
+PACKAGE = {'id': 'pkg-id', 'name': 'restaurants', 'tags': [],
+    'resources': [{'id': 'res-id', 'name': 'Inspections', 'description': ''}]}
+
+def fake_ckan(self, url, data, headers, files, requests_kwargs):
+    action = url.split('/')[-1]
+    result = {'package_show': PACKAGE, 'resource_show': PACKAGE['resources'][0]}.get(action, {})
+    return 200, json.dumps({'success': True, 'result': result})
+
+@patch.object(ckanapi.RemoteCKAN, '_request_fn', side_effect=fake_ckan, autospec=True)
+class TestMetadataCache(unittest.TestCase):
+    def setUp(self):
+        self.trace = ckan_trace.start_trace('restaurants')
+        self.ckan = ckan_trace.TracedRemoteCKAN('http://ckan.example.org')
+
+    def tearDown(self):
+        ckan_trace.stop_trace()
+
+    def test_repeated_lookups_are_fetched_once(self, request_fn):
+        self.ckan.action.package_show(id='pkg-id')
+        self.ckan.action.package_show(id='restaurants')
+        resource = self.ckan.action.resource_show(id='res-id')
+        self.assertEquals(resource['name'], 'Inspections')
+        self.assertEquals(request_fn.call_count, 1)
+        self.assertEquals(self.trace.metrics()['api_cache_hits'], 2)
+        self.assertEquals(self.trace.summary()['resource_show']['cache_hits'], 1)
+
+    def test_results_are_copies(self, request_fn):
+        self.ckan.action.package_show(id='pkg-id')['tags'].append({'name': '_etl'})
+        self.assertEquals(self.ckan.action.package_show(id='pkg-id')['tags'], [])
+
+    def test_writes_invalidate(self, request_fn):
+        self.ckan.action.package_show(id='pkg-id')
+        self.ckan.action.package_patch(id='pkg-id', tags=[])
+        self.ckan.action.resource_show(id='res-id')
+        self.assertEquals(request_fn.call_count, 3)
+        with patch('requests.post', return_value=Mock(status_code=200, content=b'')):
+            ckan_trace.traced_post('http://ckan.example.org/api/action/datastore_upsert', json={})
+        self.ckan.action.resource_show(id='res-id')
+        self.assertEquals(request_fn.call_count, 4)
+
+    def test_other_parameters_are_not_cached(self, request_fn):
+        self.ckan.action.package_show(id='pkg-id', include_tracking=True)
+        self.ckan.action.package_show(id='pkg-id', include_tracking=True)
+        self.assertEquals(request_fn.call_count, 2)
+
+    def test_no_cache_without_a_trace(self, request_fn):
+        ckan_trace.stop_trace()
+        self.ckan.action.package_show(id='pkg-id')
+        self.ckan.action.package_show(id='pkg-id')
+        self.assertEquals(request_fn.call_count, 2)
@@ -31,6 +31,20 @@ class TestCSVConnector(unittest.TestCase):
         self.connector.close()
         self.assertTrue(f.closed)
 
+class TestDirectoryConnector(unittest.TestCase):
+    def setUp(self):
+        self.connector = pl.DirectoryConnector('')
+
+    def test_connect_to_directory(self):
+        filepaths = self.connector.connect(os.path.join(HERE, '../mock'))
+        self.assertEquals(len(filepaths), 5)
+        self.assertEquals(filepaths, sorted(filepaths))
+
+    def test_connect_to_pattern(self):
+        filepaths = self.connector.connect(os.path.join(HERE, '../mock/*_mock.*'))
+        self.assertEquals([os.path.basename(f) for f in filepaths],
+            ['excel_mock.xlsx', 'simple_mock.csv', 'simple_tsv_mock.tsv'])
+
 class TestRemoteFileConnector(unittest.TestCase):
     def setUp(self):
         self.connector = pl.RemoteFileConnector('')
@@ -98,9 +112,9 @@ class TestSFTPConnector(unittest.TestCase):
         self.assertEquals(self.connector.root_dir, '/')
         self.assertEquals(self.connector.conn, None)
 
-    @patch('pipeline.connectors.paramiko.SFTPClient')
-    @patch('pipeline.connectors.paramiko.Transport')
-    @patch('pipeline.connectors.paramiko.SFTPFile')
+    @patch('paramiko.SFTPClient')
+    @patch('paramiko.Transport')
+    @patch('paramiko.SFTPFile')
     def test_connector(self, SFTPFile, Transport, SFTPClient):
         self.assertTrue(self.connector.conn is None)
         self.assertTrue(self.connector.transport is None)
@@ -125,17 +139,17 @@ class TestSFTPConnector(unittest.TestCase):
             '/myfile.txt', 'r'
         )
 
-    @patch('pipeline.connectors.paramiko.SFTPClient')
-    @patch('pipeline.connectors.paramiko.Transport')
+    @patch('paramiko.SFTPClient')
+    @patch('paramiko.Transport')
     def test_bad_sftp(self, Transport, SFTPClient):
         SFTPClient.from_transport().open.side_effect = IOError()
         SFTPClient.from_transport().stat.return_value = Mock(st_size=5)
         with self.assertRaises(IOError):
             self.connector.connect('')
 
-    @patch('pipeline.connectors.paramiko.SFTPClient')
-    @patch('pipeline.connectors.paramiko.Transport')
-    @patch('pipeline.connectors.paramiko.SFTPFile')
+    @patch('paramiko.SFTPClient')
+    @patch('paramiko.Transport')
+    @patch('paramiko.SFTPFile')
     def test_connector_closes_connections(self, SFTPFile, Transport, SFTPClient):
         SFTPFile.open.return_value = io.BytesIO(initial_bytes=None)
         SFTPClient.from_transport.return_value = SFTPFile
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from wprdc_etl.pipeline.delta import RowHashStore
+
+class TestRowHashStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'stores', 'resource.sqlite')
+        self.store = RowHashStore(self.path, ['id'])
+        self.store.start_run()
+        records = [{'id': 1, 'name': 'one'}, {'id': 2, 'name': 'two'}]
+        changed, key_hashes = self.store.changed(records)
+        self.assertEquals(changed, records)
+        self.store.update(key_hashes)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_only_changed_records(self):
+        self.store.start_run()
+        changed, key_hashes = self.store.changed([{'id': 1, 'name': 'one'},
+            {'id': 2, 'name': 'TWO'}, {'id': 3, 'name': 'three'}])
+        self.assertEquals(changed, [{'id': 2, 'name': 'TWO'}, {'id': 3, 'name': 'three'}])
+        self.assertEquals(len(key_hashes), 3)
+
+    def test_vanished(self):
+        self.store.start_run()
+        changed, key_hashes = self.store.changed([{'id': 2, 'name': 'two'}])
+        self.store.update(key_hashes)
+        self.assertEquals(self.store.vanished(), [{'id': 1}])
+        self.store.remove(self.store.vanished())
+        self.assertEquals(len(self.store), 1)
+
+    def test_rebuild(self):
+        self.store.rebuild([{'id': 5, 'name': 'five'}])
+        self.assertEquals(len(self.store), 1)
+        self.store.start_run()
+        changed, _ = self.store.changed([{'id': 5, 'name': 'five'}])
+        self.assertEquals(changed, [])
+        self.assertEquals(self.store.vanished(), [{'id': 5}])
+
+    def test_rebuilt_records_match_loaded_records(self):
+        store = RowHashStore(os.path.join(self.tmpdir.name, 'typed.sqlite'), ['id'],
+            [{'id': 'id', 'type': 'int'}, {'id': 'when', 'type': 'timestamp'}, {'id': 'amount', 'type': 'numeric'}])
+        store.rebuild([{'id': '1', 'when': '2020-01-01T00:00:00', 'amount': '1.50'}])
+        store.start_run()
+        changed, key_hashes = store.changed([{'id': 1, 'when': '2020-01-01T00:00:00+00:00', 'amount': 1.5}])
+        self.assertEquals(changed, [])
+        store.update(key_hashes)
+        self.assertEquals(store.vanished(), [])
+        store.close()
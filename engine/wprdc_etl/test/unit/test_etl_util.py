@@ -0,0 +1,202 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from marshmallow import fields
+import wprdc_etl.pipeline as pl
+from engine.wprdc_etl.pipeline import ckan_trace
+from engine.etl_util import Job, LazyField, BULK_LOAD_ROW_THRESHOLD, post_process
+
+class InspectionSchema(pl.BaseSchema):
+    score = fields.Integer()
+
+def job_dict(**kwargs):
+    return dict({'job_code': 'inspections', 'job_directory': 'health',
+        'source_type': 'local', 'source_file': 'inspections.xlsx',
+        'resource_name': 'Inspections', 'package': 'package-id'}, **kwargs)
+
+class TestDestinations(unittest.TestCase):
+    def test_extra_destinations(self):
+        job = Job(job_dict(destinations=['ckan', {'destination': 'file', 'destination_file': 'archive.parquet'}]))
+        self.assertEqual(job.destination, 'ckan')
+        self.assertEqual([d['destination'] for d in job.extra_destinations], ['file'])
+
+    def test_duplicate_destinations_are_rejected(self):
+        for destinations in [['file', {'destination': 'file', 'destination_file': 'archive.parquet'}],
+                ['ckan', 'ckan_filestore', {'destination': 'ckan_filestore', 'resource_name': 'Raw'}]]:
+            with self.assertRaises(ValueError):
+                Job(job_dict(destinations=destinations, destination_file='inspections.csv'))
+
+    def test_extra_file_destination_needs_a_tabular_file_name(self):
+        with self.assertRaises(ValueError): # (It would otherwise be named after the .xlsx source file.)
+            Job(job_dict(destinations=['ckan', 'file']))
+        with self.assertRaises(ValueError):
+            Job(job_dict(destinations=['ckan', {'destination': 'file', 'destination_file': 'archive.json'}]))
+        Job(job_dict(destinations=['ckan', 'file'], destination_file='archive.csv'))
+
+class TestSourcePaths(unittest.TestCase):
+    def test_local_glob_selects_multiple_files(self):
+        job = Job(job_dict(source_file='snow_plow_data/*.geojson', destination='ckan_filestore'))
+        self.assertTrue(job.multiple_files)
+
+    def test_remote_filenames_are_not_globs(self):
+        for source_type in ['http', 'sftp', 'ftp', 'gcp']:
+            job = Job(job_dict(source_type=source_type, source_file='export?format=csv'))
+            self.assertFalse(job.multiple_files)
+
+@patch('engine.etl_util.datastore_exists', return_value=True)
+class TestShouldBulkLoad(unittest.TestCase):
+    def setUp(self):
+        self.job = Job(job_dict(source_file='inspections.csv'))
+        self.job.package_id = 'package-id' # (Normally set by configure_pipeline_with_options.)
+
+    def test_threshold(self, datastore_exists):
+        for rows, bulk_load in [(BULK_LOAD_ROW_THRESHOLD, False), (BULK_LOAD_ROW_THRESHOLD + 1, True), (None, False)]:
+            with patch.object(Job, 'estimate_row_count', return_value=rows):
+                self.assertEqual(self.job.should_bulk_load(clear_first=False, wipe_data=True), bulk_load)
+
+    @patch.object(Job, 'estimate_row_count', return_value=10*BULK_LOAD_ROW_THRESHOLD)
+    def test_only_jobs_that_replace_the_datastore(self, estimate_row_count, datastore_exists):
+        self.assertFalse(self.job.should_bulk_load(clear_first=False, wipe_data=False))
+        datastore_exists.return_value = False
+        self.assertTrue(self.job.should_bulk_load(clear_first=False, wipe_data=False))
+
+    @patch.object(Job, 'estimate_row_count', return_value=10*BULK_LOAD_ROW_THRESHOLD)
+    def test_not_with_primary_keys_or_filters(self, estimate_row_count, datastore_exists):
+        self.assertTrue(self.job.should_bulk_load(clear_first=True, wipe_data=False))
+        self.job.primary_key_fields = ['id']
+        self.assertFalse(self.job.should_bulk_load(clear_first=True, wipe_data=False))
+        job = Job(job_dict(source_file='inspections.csv', filters=[['facility', '==', 'Cafe']]))
+        self.assertFalse(job.should_bulk_load(clear_first=True, wipe_data=False))
+
+    @patch.object(Job, 'estimate_row_count', return_value=10*BULK_LOAD_ROW_THRESHOLD)
+    def test_override(self, estimate_row_count, datastore_exists):
+        self.assertFalse(Job(job_dict(bulk_load=False)).should_bulk_load(clear_first=True, wipe_data=False))
+        job = Job(job_dict(bulk_load=True, primary_key_fields=['id']))
+        self.assertTrue(job.should_bulk_load(clear_first=False, wipe_data=False))
+        job = Job(job_dict(bulk_load=True, destinations=['ckan', 'ckan_filestore']))
+        self.assertFalse(job.should_bulk_load(clear_first=True, wipe_data=False))
+
+class TestBulkLoadFile(unittest.TestCase):
+    def setUp(self):
+        self.job = Job(job_dict(source_file='inspections.csv', schema=InspectionSchema))
+        self.job.package_id = 'package-id'
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.csv_file_path = os.path.join(self.tmpdir.name, 'bulk_load.csv')
+        open(self.csv_file_path, 'w').close()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @patch('engine.etl_util.wait_for_datastore_load')
+    @patch('engine.etl_util.set_type_overrides')
+    @patch('engine.etl_util.express_load_file', return_value='res-id')
+    @patch('engine.etl_util.get_data_dictionary', return_value=[{'id': 'score', 'type': 'int4'}])
+    @patch('engine.etl_util.find_resource_id', return_value='res-id')
+    def test_types_are_overridden_before_the_upload(self, find_resource_id, get_data_dictionary,
+            express_load_file, set_type_overrides, wait_for_datastore_load):
+        with patch('engine.etl_util.set_data_dictionary'):
+            self.assertEqual(self.job.bulk_load_file(self.csv_file_path, 10), 'res-id')
+        find_resource_id.assert_called_once()
+        self.assertEqual(express_load_file.call_args[0][-1], 'res-id')
+        set_type_overrides.assert_called_once_with('res-id', [{'id': 'score', 'type': 'int'}])
+        wait_for_datastore_load.assert_called_once()
+        self.assertFalse(os.path.exists(self.csv_file_path))
+
+    @patch('engine.etl_util.wait_for_datastore_load')
+    @patch('engine.etl_util.set_type_overrides')
+    @patch('engine.etl_util.express_load_file', return_value='res-id')
+    @patch('engine.etl_util.get_data_dictionary')
+    @patch('engine.etl_util.find_resource_id', return_value=None)
+    @patch('engine.wprdc_etl.pipeline.ckan_trace.TracedRemoteCKAN')
+    def test_new_datastore_is_reloaded_with_types(self, RemoteCKAN, find_resource_id, get_data_dictionary,
+            express_load_file, set_type_overrides, wait_for_datastore_load):
+        get_data_dictionary.side_effect = [[{'id': 'score', 'type': 'text'}], [{'id': 'score', 'type': 'text'}]]
+        with self.assertRaises(RuntimeError): # The reload didn't fix the types.
+            self.job.bulk_load_file(self.csv_file_path, 10)
+        RemoteCKAN.return_value.action.xloader_submit.assert_called_once_with(resource_id='res-id', ignore_hash=True)
+        self.assertEqual(wait_for_datastore_load.call_count, 2)
+        get_data_dictionary.side_effect = [[{'id': 'score', 'type': 'text'}], [{'id': 'score', 'type': 'int4'}]]
+        self.assertEqual(self.job.bulk_load_file(self.csv_file_path, 10), 'res-id')
+
+class TestPostProcess(unittest.TestCase):
+    def setUp(self):
+        self.trace = ckan_trace.start_trace('inspections')
+        self.job = Job(job_dict(time_field='inspection_date', resource_description='Inspections of restaurants'))
+        self.job.package_id = 'test-package' # (Not the package that the resource turns out to be in.)
+
+    def tearDown(self):
+        ckan_trace.stop_trace()
+
+    def mock_ckan(self, RemoteCKAN, **resource):
+        ckan = RemoteCKAN.return_value
+        resource = dict({'id': 'res-id', 'package_id': 'pkg-id',
+            'name': 'Inspections', 'description': 'Already described', 'format': 'CSV',
+            'url_type': 'upload', 'datastore_active': True}, **resource)
+        packages = {'pkg-id': {'id': 'pkg-id', 'tags': [{'name': 'food'}],
+            'extras': [{'key': 'dcat_issued', 'value': '2014-01-07'}], 'resources': [resource]},
+            'test-package': {'id': 'test-package', 'tags': [], 'extras': [], 'resources': []}}
+        ckan.action.resource_show.return_value = resource
+        ckan.action.package_show.side_effect = lambda id: packages[id]
+        ckan.action.resource_view_list.return_value = [{'view_type': 'datatables_view'}]
+        return ckan
+
+    def called_actions(self, ckan):
+        return [c[0] for c in ckan.action.method_calls]
+
+    @patch('engine.wprdc_etl.pipeline.ckan_trace.TracedRemoteCKAN')
+    def test_resource_in_the_jobs_package(self, RemoteCKAN):
+        ckan = self.mock_ckan(RemoteCKAN)
+        self.job.package_id = 'pkg-id'
+        post_process('res-id', self.job)
+        self.assertEqual(self.called_actions(ckan), ['package_show', 'resource_view_list', 'package_patch'])
+
+        ckan.reset_mock()
+        ckan = self.mock_ckan(RemoteCKAN, datastore_active=False) # No view is needed.
+        post_process('res-id', self.job)
+        self.assertEqual(self.called_actions(ckan), ['package_show', 'package_patch'])
+
+    @patch('engine.wprdc_etl.pipeline.ckan_trace.TracedRemoteCKAN')
+    def test_metadata_is_patched_once(self, RemoteCKAN):
+        ckan = self.mock_ckan(RemoteCKAN)
+        post_process('res-id', self.job)
+        # The resource isn't in the job's package, so it's looked up.
+        self.assertEqual(self.called_actions(ckan), ['package_show', 'resource_show',
+            'package_show', 'resource_view_list', 'package_patch'])
+        ckan.action.package_show.assert_called_with(id='pkg-id')
+        ckan.action.package_patch.assert_called_once()
+        changes = ckan.action.package_patch.call_args[1]
+        self.assertEqual(changes['id'], 'pkg-id')
+        self.assertEqual([t['name'] for t in changes['tags']], ['food', '_etl'])
+        extras = {d['key']: d['value'] for d in changes['extras']}
+        self.assertEqual(sorted(extras), ['dcat_issued', 'last_etl_update', 'time_field'])
+        self.assertEqual(json.loads(extras['time_field']), {'res-id': 'inspection_date'})
+        ckan.action.resource_patch.assert_not_called()
+
+class TestLazyFields(unittest.TestCase):
+    def setUp(self):
+        self.find_url = Mock(return_value='https://example.com/data/inspections.csv')
+        self.job = Job(job_dict(source_type='http', source_file=None,
+            source_full_url=LazyField(self.find_url, 'Restaurant Inspections', file_format='CSV')))
+
+    def test_not_resolved_when_the_job_is_created(self):
+        self.find_url.assert_not_called()
+        self.assertIsNone(self.job.source_full_url)
+
+    @patch('engine.etl_util.get_package_id', return_value='package-id')
+    def test_resolved_when_the_pipeline_is_configured(self, get_package_id):
+        self.job.configure_pipeline_with_options(use_local_input_file=False,
+            use_local_output_file=False, test_mode=False)
+        self.find_url.assert_called_once_with('Restaurant Inspections', file_format='CSV')
+        self.assertEqual(self.job.source_full_url, 'https://example.com/data/inspections.csv')
+        self.assertEqual(self.job.target, self.job.source_full_url)
+        self.assertEqual(self.job.source_file, 'inspections.csv')
+        self.assertTrue(self.job.local_cache_filepath.endswith('health/inspections.csv'))
+        self.assertEqual(self.job.extractor, pl.CSVExtractor)
+
+    def test_job_code_and_job_directory_can_not_be_lazy(self):
+        for key in ['job_code', 'job_directory']:
+            with self.assertRaises(ValueError):
+                Job(job_dict(**{key: LazyField(str, 'x')}))
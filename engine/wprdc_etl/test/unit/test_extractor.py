@@ -1,6 +1,7 @@
 import os
 import csv
 import xlrd
+import tempfile
 import unittest
 
 import wprdc_etl.pipeline as pl
@@ -45,6 +46,21 @@ class TestCSVExtractor(unittest.TestCase):
             {'one': '1', 'two_words': '2', 'trailing_spaces': '1'}
         )
 
+    def test_extract_projected_line(self):
+        self.extractor.set_projection({'one', 'trailing_spaces', 'not_a_column'})
+        f = self.extractor.process_connection()
+        self.assertEquals(
+            self.extractor.handle_line(next(f)),
+            {'one': '1', 'trailing_spaces': '1'}
+        )
+
+    def test_partition(self):
+        byte_ranges = self.extractor.partition(range_size=1)
+        lines = [line for byte_range in byte_ranges
+                for line in self.extractor.read_byte_range(byte_range)]
+        with open(self.path) as f:
+            self.assertListEqual(lines, list(csv.reader(f))[1:])
+
     def test_extract_custom_delimiter(self):
         extractor = pl.CSVExtractor(
             self.conn.connect(self.tsv_path), delimiter='\t'
@@ -59,6 +75,39 @@ class TestCSVExtractor(unittest.TestCase):
         )
 
 
+class TestParquetExtractor(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'mock.parquet')
+        loader = pl.ParquetFileLoader(filepath=self.path, file_format='parquet',
+                fields=[{'id': 'one', 'type': 'int'}, {'id': 'Two words', 'type': 'text'},
+                    {'id': 'when', 'type': 'timestamp'}])
+        loader.load([{'one': 1, 'Two words': '2', 'when': '2020-01-02T03:04:05'}])
+        loader.load([{'one': None, 'Two words': 'two', 'when': None}])
+        loader.finalize()
+        self.conn = pl.FileConnector('')
+        self.extractor = pl.ParquetExtractor(self.conn.connect(self.path))
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmpdir.cleanup()
+
+    def test_initialization(self):
+        self.assertListEqual(self.extractor.headers, ['one', 'Two words', 'when'])
+        self.assertListEqual(self.extractor.schema_headers, ['one', 'two_words', 'when'])
+
+    def test_extract_lines(self):
+        lines = [self.extractor.handle_line(line) for line in self.extractor.process_connection()]
+        self.assertEquals(lines, [
+            {'one': '1', 'two_words': '2', 'when': '2020-01-02T03:04:05'},
+            {'one': None, 'two_words': 'two', 'when': None}
+        ])
+
+    def test_extract_projected_line(self):
+        self.extractor.set_projection({'two_words'})
+        f = self.extractor.process_connection()
+        self.assertEquals(self.extractor.handle_line(next(f)), {'two_words': '2'})
+
 class TestExcelExtractor(unittest.TestCase):
     def setUp(self):
         self.path = os.path.join(HERE, '../mock/excel_mock.xlsx')
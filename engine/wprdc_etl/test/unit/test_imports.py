@@ -0,0 +1,39 @@
+import os
+import sys
+import subprocess
+import unittest
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..'))
+
+HEAVY_MODULES = {'ckanapi', 'requests', 'paramiko', 'openpyxl', 'xlrd',
+    'icecream', 'marshmallow', 'pyarrow', 'google.cloud'}
+
+class TestLazyImports(unittest.TestCase):
+    '''Importing the pipeline package (and the classes needed to read a local
+    CSV file) shouldn't import heavy dependencies, since many small cron jobs
+    pay for them.'''
+    def import_in_subprocess(self, statement):
+        code = ('import sys\n'
+                f'sys.path.insert(0, {os.path.join(REPO_DIR, "engine")!r})\n'
+                f'{statement}\n'
+                'print(" ".join(sys.modules))\n')
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=REPO_DIR, text=True)
+        return set(output.strip().split('\n')[-1].split())
+
+    def test_package_import_is_lazy(self):
+        modules = self.import_in_subprocess('import engine.wprdc_etl.pipeline as pl')
+        self.assertNotIn('engine.wprdc_etl.pipeline.loaders', modules)
+        self.assertEqual(modules & HEAVY_MODULES, set())
+
+    def test_local_csv_classes_skip_heavy_dependencies(self):
+        modules = self.import_in_subprocess('import engine.wprdc_etl.pipeline as pl\n'
+            'pl.Pipeline, pl.CSVExtractor, pl.ColumnarChunk, pl.ChunkSpool')
+        self.assertEqual(modules & HEAVY_MODULES, set())
+
+    def test_classes_come_from_the_engine_modules(self):
+        # The tests import the package as wprdc_etl.pipeline, but the modules
+        # raise exceptions that they imported by the engine path.
+        modules = self.import_in_subprocess('import wprdc_etl.pipeline as pl\n'
+            'from engine.wprdc_etl.pipeline import exceptions\n'
+            'assert pl.IsHeaderException is exceptions.IsHeaderException')
+        self.assertNotIn('wprdc_etl.pipeline.exceptions', modules)
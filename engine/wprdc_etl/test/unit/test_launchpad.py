@@ -0,0 +1,93 @@
+import io
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import launchpad
+from launchpad import JobPrefixingStream, dependencies_by_job_code, run_jobs_in_parallel
+
+def stub_job(job_code, depends_on=()):
+    return SimpleNamespace(job_code=job_code, depends_on=list(depends_on))
+
+class TestParallelJobs(unittest.TestCase):
+    def setUp(self):
+        self.finished = []
+        self.failing_codes = set()
+        def run_and_record_job(job, args_dict):
+            time.sleep(0.01)
+            if job.job_code in self.failing_codes:
+                raise RuntimeError(f'{job.job_code} broke')
+            self.finished.append(job.job_code)
+        patcher = patch.object(launchpad, 'run_and_record_job', side_effect=run_and_record_job)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dependencies_finish_first(self):
+        jobs = [stub_job('permits', depends_on=['parcels']), stub_job('parcels'), stub_job('trees')]
+        self.assertEqual(run_jobs_in_parallel(jobs, {}, workers=3), [])
+        self.assertEqual(sorted(self.finished), ['parcels', 'permits', 'trees'])
+        self.assertLess(self.finished.index('parcels'), self.finished.index('permits'))
+
+    def test_dependents_of_failed_jobs_are_skipped(self):
+        self.failing_codes = {'parcels'}
+        jobs = [stub_job('parcels'), stub_job('permits', depends_on=['parcels']),
+            stub_job('inspections', depends_on=['permits']), stub_job('trees')]
+        failures = run_jobs_in_parallel(jobs, {}, workers=2)
+        self.assertEqual([code for code, _, _ in failures], ['parcels', 'permits', 'inspections'])
+        self.assertIn('Skipped', str(failures[1][1]))
+        self.assertEqual(self.finished, ['trees'])
+
+    def test_unselected_dependencies_are_ignored(self):
+        graph = dependencies_by_job_code([stub_job('permits', depends_on=['parcels'])])
+        self.assertEqual(graph, {'permits': set()})
+
+    def test_cycles_are_rejected(self):
+        jobs = [stub_job('a', depends_on=['c']), stub_job('b', depends_on=['a']),
+            stub_job('c', depends_on=['b']), stub_job('d')]
+        with self.assertRaises(ValueError):
+            run_jobs_in_parallel(jobs, {}, workers=2)
+        self.assertEqual(self.finished, [])
+
+    def test_duplicate_codes_are_rejected(self):
+        with self.assertRaises(ValueError):
+            run_jobs_in_parallel([stub_job('trees'), stub_job('parcels'), stub_job('trees')], {}, workers=2)
+        self.assertEqual(self.finished, [])
+
+
+class TestJobPrefixingStream(unittest.TestCase):
+    def setUp(self):
+        self.output = io.StringIO()
+        self.stream = JobPrefixingStream(self.output)
+
+    def test_unprefixed_output_passes_through(self):
+        self.stream.write('no newline')
+        self.assertEqual(self.output.getvalue(), 'no newline')
+
+    def test_lines_are_prefixed(self):
+        self.stream.set_prefix('[trees] ')
+        self.stream.write('one\ntw')
+        self.assertEqual(self.output.getvalue(), '[trees] one\n')
+        self.stream.write('o\n')
+        self.stream.write('three')
+        self.stream.set_prefix(None) # Flushes the incomplete line.
+        self.assertEqual(self.output.getvalue(), '[trees] one\n[trees] two\n[trees] three\n')
+
+    def test_each_thread_has_its_own_prefix(self):
+        def write_lines(code):
+            self.stream.set_prefix(f'[{code}] ')
+            for k in range(50):
+                self.stream.write('line ')
+                self.stream.write(f'{k}\n')
+            self.stream.set_prefix(None)
+        threads = [threading.Thread(target=write_lines, args=(code,)) for code in ['a', 'b', 'c']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        lines = self.output.getvalue().splitlines()
+        self.assertEqual(len(lines), 150)
+        for code in ['a', 'b', 'c']:
+            self.assertEqual([line for line in lines if line.startswith(f'[{code}] ')],
+                [f'[{code}] line {k}' for k in range(50)])
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from wprdc_etl.pipeline.ledger import RunLedger
+
+class TestRunLedger(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.ledger = RunLedger(os.path.join(self.tmpdir.name, 'status.db'))
+        for k, duration in enumerate([100, 110, 90, 105]):
+            self.ledger.record('restaurants', 1000 + k, duration, 'success',
+                {'ckan.records_loaded': 500, 'ckan.request_bytes_sent': 2000})
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_record(self):
+        run = self.ledger.runs('restaurants', limit=1)[0]
+        self.assertEquals(run['rows'], 500)
+        self.assertEquals(run['bytes'], 2000)
+        self.assertEquals(run['api_calls'], None)
+        self.assertEquals(len(self.ledger.runs('restaurants')), 4)
+
+    def test_baseline(self):
+        run = self.ledger.record('restaurants', 2000, 100, 'success', {'records_loaded': 500})
+        baseline = self.ledger.baseline(run, window=3)
+        self.assertEquals(baseline['runs'], 3)
+        self.assertEquals(baseline['duration'], 105)
+        self.assertEquals(baseline['rows'], 500)
+
+    def test_deviations(self):
+        run = self.ledger.record('restaurants', 2000, 104, 'success',
+            {'records_loaded': 50, 'request_bytes_sent': 2100})
+        self.assertEquals([d[0] for d in self.ledger.deviations(run, threshold=0.5)], ['rows'])
+        slow = self.ledger.record('restaurants', 3000, 400, 'success',
+            {'records_loaded': 500, 'request_bytes_sent': 2000})
+        self.assertEquals([d[0] for d in self.ledger.deviations(slow, threshold=0.5)], ['duration'])
+        self.assertEquals([r['job_code'] for r, _ in self.ledger.regressions()], ['restaurants'])
+
+    def test_failed_and_test_runs_are_not_in_the_baseline(self):
+        self.ledger.record('restaurants', 2000, 5, 'failed', {})
+        self.ledger.record('restaurants', 2001, 5, 'success', {'records_loaded': 3}, test_mode=True)
+        run = self.ledger.record('restaurants', 3000, 100, 'success', {'records_loaded': 500})
+        self.assertEquals(self.ledger.baseline(run)['runs'], 4)
+        self.assertEquals(self.ledger.deviations(run), [])
+
+    def test_too_few_runs(self):
+        run = self.ledger.record('new_job', 1000, 1000, 'success', {'records_loaded': 1})
+        self.assertEquals(self.ledger.deviations(run), [])
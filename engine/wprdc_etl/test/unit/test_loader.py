@@ -1,6 +1,10 @@
 import unittest
 import os
 import json
+import tempfile
+import datetime
+
+from decimal import Decimal
 
 from unittest.mock import Mock, patch, PropertyMock
 
@@ -225,10 +229,12 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
         ]
         post.return_value = mock_post
 
+        type(post.return_value).status_code = PropertyMock(return_value=200)
+        self.insert_loader.load([])
         for error in self.error_codes:
-            type(post.return_value).status_code = PropertyMock(side_effect=[200, 500])
-            with self.assertRaises(RuntimeError):
-                self.insert_loader.load([])
+            type(post.return_value).status_code = PropertyMock(return_value=error)
+            with patch('time.sleep'), self.assertRaises(RuntimeError):
+                self.insert_loader.finalize()
 
     @patch('requests.post')
     def test_datastore_load_upsert_update_metadata_failed(self, post):
@@ -239,7 +245,387 @@ class TestCKANDatastoreLoader(TestCKANDatastoreBase):
         ]
         post.return_value = mock_post
 
+        type(post.return_value).status_code = PropertyMock(return_value=200)
+        self.upsert_loader.load([])
         for error in self.error_codes:
             type(post.return_value).status_code = PropertyMock(return_value=error)
+            with patch('time.sleep'), self.assertRaises(RuntimeError):
+                self.upsert_loader.finalize()
+
+
+class TestCKANFilestoreLoaderMultipleFiles(unittest.TestCase):
+    def setUp(self):
+        settings_file = os.path.join(HERE, '../mock/first_test_settings.json')
+        with open(settings_file) as f:
+            self.ckan_config = json.load(f)['loader']['ckan']
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepaths = []
+        for name in ['a.geojson', 'b.geojson', 'c.geojson']:
+            self.filepaths.append(os.path.join(self.tmpdir.name, name))
+            with open(self.filepaths[-1], 'w') as f:
+                f.write(name)
+        self.manifest_filepath = os.path.join(self.tmpdir.name, 'loaded.json')
+        with patch('requests.post'):
+            self.loader = pl.CKANFilestoreLoader(**self.ckan_config, file_format='geojson',
+                    resource_names_from_filenames=True,
+                    manifest_filepath=self.manifest_filepath)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @patch.object(pl.CKANFilestoreLoader, 'get_resource_ids_by_name', return_value={'a': 'id-a'})
+    @patch.object(pl.CKANFilestoreLoader, 'upload_file', side_effect=lambda f, name, resource_id: 'id-' + name)
+    def test_upload_new_files(self, upload_file, get_resource_ids_by_name):
+        self.assertEquals(sorted(self.loader.load(self.filepaths)), ['id-b', 'id-c'])
+        self.assertEquals(upload_file.call_count, 2)
+        # Every file is now in the manifest, so nothing is uploaded again.
+        with patch('requests.post'):
+            loader = pl.CKANFilestoreLoader(**self.ckan_config, file_format='geojson',
+                    resource_names_from_filenames=True, manifest_filepath=self.manifest_filepath)
+        self.assertEquals(loader.load(self.filepaths), [])
+        self.assertEquals(upload_file.call_count, 2)
+
+    @patch.object(pl.CKANFilestoreLoader, 'get_resource_ids_by_name', return_value={})
+    @patch.object(pl.CKANFilestoreLoader, 'upload_file')
+    def test_failed_uploads_are_not_recorded(self, upload_file, get_resource_ids_by_name):
+        upload_file.side_effect = lambda f, name, resource_id: 1/(name != 'b')
+        with self.assertRaises(RuntimeError):
+            self.loader.load(self.filepaths)
+        manifest = pl.loaders.FileManifest(self.manifest_filepath)
+        self.assertFalse(manifest.contains(self.loader.package_id, self.filepaths[1]))
+        self.assertTrue(manifest.contains(self.loader.package_id, self.filepaths[2]))
+
+    @patch('time.sleep')
+    @patch('requests.post')
+    def test_failed_upload_is_retried_from_the_file(self, post, sleep):
+        uploaded = []
+        def respond(url, data=None, files=None, headers=None, verify=None):
+            uploaded.append(files['upload'][1].read() if files else data.read())
+            return Mock(status_code=503 if len(uploaded) == 1 else 200,
+                json=Mock(return_value={'success': True, 'result': {'id': 'id-a'}}))
+        post.side_effect = respond
+        self.assertEquals(self.loader.upload_file(self.filepaths[0], 'a', 'id-a'), 'id-a')
+        self.assertEquals(len(uploaded), 2)
+        self.assertTrue(uploaded[1].endswith(b'a.geojson'))
+        self.assertEquals(self.loader.metrics['upload_retries'], 1)
+
+
+class TestCKANDatastoreLoaderMetadata(unittest.TestCase):
+    def setUp(self):
+        settings_file = os.path.join(HERE, '../mock/first_test_settings.json')
+        with open(settings_file) as f:
+            self.ckan_config = json.load(f)['loader']['ckan']
+        with patch('requests.post'):
+            self.loader = pl.CKANDatastoreLoader(**self.ckan_config, resource_id='1', file_format='csv',
+                    fields=[{'id': 'id', 'type': 'int'}], method='insert')
+        self.loader.generate_datastore = Mock()
+
+    @patch('requests.post', return_value=Mock(status_code=200, content=b''))
+    def test_metadata_is_updated_once_per_load(self, post):
+        for i in range(3):
+            self.loader.load([{'id': i}])
+        self.loader.finalize()
+        actions = [c[0][0].split('/')[-1] for c in post.call_args_list]
+        self.assertEquals(actions, ['datastore_upsert']*3 + ['resource_patch'])
+        self.assertEquals(self.loader.metrics['metadata_updates'], 1)
+        self.assertEquals(self.loader.metrics['metadata_updates_saved'], 2)
+
+    @patch('requests.post')
+    def test_nothing_loaded(self, post):
+        self.loader.finalize()
+        post.assert_not_called()
+
+
+class TestCKANDatastoreLoaderBisection(unittest.TestCase):
+    def setUp(self):
+        settings_file = os.path.join(HERE, '../mock/first_test_settings.json')
+        with open(settings_file) as f:
+            self.ckan_config = json.load(f)['loader']['ckan']
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dead_letter_path = os.path.join(self.tmpdir.name, 'dead_letters.jsonl')
+        with patch('requests.post'):
+            self.loader = pl.CKANDatastoreLoader(**self.ckan_config, resource_id='1', file_format='csv',
+                    fields=[{'id': 'id', 'type': 'int'}], method='insert',
+                    dead_letter_path=self.dead_letter_path)
+        self.loader.generate_datastore = Mock()
+        self.sent = []
+
+        self.bad_ids = {5}
+        self.status_code = 409
+
+        def upsert(resource_id, data, method):
+            self.sent.append(len(data))
+            if any(record['id'] in self.bad_ids for record in data):
+                self.loader.last_error = 'bad record'
+                return self.status_code
+            return 200
+        self.loader.upsert = upsert
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_bad_record_is_isolated(self):
+        data = [{'id': i} for i in range(32)]
+        self.assertEquals(self.loader.load(data), 207)
+        self.assertEquals(self.loader.metrics['records_loaded'], 31)
+        self.assertEquals(self.loader.metrics['chunk_bisections'], 5)
+        self.assertEquals(len(self.sent), 11) # 1 + 2*log2(32) requests
+        with open(self.dead_letter_path) as f:
+            dead_letters = [json.loads(line) for line in f]
+        self.assertEquals(dead_letters, [{'resource_id': '1', 'record': {'id': 5},
+            'status_code': 409, 'error': 'bad record'}])
+
+    def test_good_chunk_is_sent_once(self):
+        self.assertEquals(self.loader.load([{'id': 1}, {'id': 2}]), 200)
+        self.assertEquals(self.sent, [2])
+        self.assertFalse(os.path.exists(self.dead_letter_path))
+
+    def test_validation_errors_are_bisected(self):
+        self.status_code = 400
+        self.loader.last_error = None
+        def upsert(resource_id, data, method):
+            self.sent.append(len(data))
+            if any(record['id'] == 5 for record in data):
+                self.loader.last_error = json.dumps({'success': False,
+                    'error': {'__type': 'Validation Error', 'id': ['bad value']}})
+                return 400
+            return 200
+        self.loader.upsert = upsert
+        self.assertEquals(self.loader.load([{'id': i} for i in range(32)]), 207)
+        self.assertEquals(self.loader.metrics['dead_letter_records'], 1)
+
+    def test_other_errors_are_not_bisected(self):
+        for status_code in [400, 403, 404]:
+            self.sent, self.status_code = [], status_code
             with self.assertRaises(RuntimeError):
-                self.upsert_loader.load([])
+                self.loader.load([{'id': i} for i in range(32)])
+            self.assertEquals(self.sent, [32])
+        self.assertFalse(os.path.exists(self.dead_letter_path))
+
+    def test_rejecting_too_much_of_a_chunk_fails(self):
+        self.bad_ids = set(range(32))
+        with self.assertRaises(RuntimeError):
+            self.loader.load([{'id': i} for i in range(32)])
+        self.assertLess(len(self.sent), 16) # The splitting stops early.
+        self.assertEquals(self.loader.metrics['dead_letter_records'], 2)
+
+
+class TestCKANDatastoreLoaderDeltas(unittest.TestCase):
+    def setUp(self):
+        settings_file = os.path.join(HERE, '../mock/first_test_settings.json')
+        with open(settings_file) as f:
+            self.ckan_config = json.load(f)['loader']['ckan']
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.delta_store_path = os.path.join(self.tmpdir.name, 'resource.sqlite')
+        self.fields = [{'id': 'year', 'type': 'int'}, {'id': 'id', 'type': 'int'},
+            {'id': 'amount', 'type': 'numeric'}, {'id': 'updated', 'type': 'timestamp'}]
+        # The datastore returns numeric values as strings and timestamps without time zones.
+        self.datastore_records = [{'year': 2020, 'id': 1, 'amount': '1.50', 'updated': '2020-01-01T00:00:00'},
+            {'year': 2020, 'id': 2, 'amount': '2', 'updated': '2020-01-02T00:00:00'}]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def loader(self):
+        with patch('requests.post'):
+            loader = pl.CKANDatastoreLoader(**self.ckan_config, resource_id='1', file_format='csv',
+                    fields=self.fields, key_fields=['year', 'id'], method='upsert',
+                    delta_store_path=self.delta_store_path, delete_vanished=True)
+        loader.generate_datastore = Mock()
+        loader.upsert_with_retries = Mock(return_value=200)
+        loader.update_metadata_with_retries = Mock()
+        loader.count_datastore_rows = Mock(return_value=len(self.datastore_records))
+        loader.iterate_datastore_records = Mock(return_value=iter(self.datastore_records))
+        return loader
+
+    @patch('engine.wprdc_etl.pipeline.ckan_trace.TracedRemoteCKAN')
+    def test_rebuilt_store_matches_loaded_records(self, RemoteCKAN):
+        loader = self.loader()
+        loader.load([{'year': 2020, 'id': 1, 'amount': 1.5, 'updated': '2020-01-01T00:00:00+00:00'}])
+        loader.finalize()
+        self.assertEquals(loader.metrics['delta_store_rebuilds'], 1)
+        self.assertEquals(loader.metrics['records_unchanged'], 1)
+        loader.upsert_with_retries.assert_not_called()
+        # Nothing is deleted in the run that rebuilt the store...
+        RemoteCKAN.return_value.action.datastore_delete.assert_not_called()
+
+        loader = self.loader()
+        loader.load([{'year': 2020, 'id': 1, 'amount': 1.5, 'updated': '2020-01-01T00:00:00+00:00'}])
+        loader.finalize()
+        self.assertEquals(loader.metrics['delta_store_rebuilds'], 0)
+        # ...but the record that vanished is deleted in the next run.
+        RemoteCKAN.return_value.action.datastore_delete.assert_called_once_with(id='1',
+            filters={'year': 2020, 'id': [2]}, force=True)
+
+    @patch('engine.wprdc_etl.pipeline.ckan_trace.TracedRemoteCKAN')
+    def test_vanished_records_are_deleted_in_batches(self, RemoteCKAN):
+        self.datastore_records = [{'year': year, 'id': i, 'amount': '1', 'updated': None}
+            for year in [2020, 2021] for i in range(5)]
+        loader = self.loader()
+        loader.delta_store = loader.open_delta_store(emptied=False) # None of the rebuilt keys are seen in this run.
+        loader.delete_vanished_records(batch_size=3)
+        self.assertEquals([c[1]['filters'] for c in RemoteCKAN.return_value.action.datastore_delete.call_args_list],
+            [{'year': 2020, 'id': [0, 1, 2]}, {'year': 2020, 'id': [3, 4]},
+            {'year': 2021, 'id': [0, 1, 2]}, {'year': 2021, 'id': [3, 4]}])
+        self.assertEquals(loader.metrics['vanished_records_deleted'], 10)
+        self.assertEquals(len(loader.delta_store), 0)
+        loader.delta_store.close()
+
+
+class TestCKANDatastoreLoaderSwap(unittest.TestCase):
+    def setUp(self):
+        settings_file = os.path.join(HERE, '../mock/first_test_settings.json')
+        with open(settings_file) as f:
+            self.ckan_config = json.load(f)['loader']['ckan']
+        with patch('requests.post'):
+            self.loader = pl.CKANDatastoreLoader(**self.ckan_config, resource_id='staging',
+                    file_format='csv', fields=[{'id': 'id', 'type': 'int'}], method='insert',
+                    wipe_data=True, swap_data=True)
+        self.loader.live_resource_id = 'live'
+        self.loader.metrics['records_loaded'] = 3
+
+    @patch('engine.wprdc_etl.pipeline.ckan_trace.TracedRemoteCKAN')
+    def test_swap(self, RemoteCKAN):
+        ckan = RemoteCKAN.return_value
+        ckan.action.resource_show.return_value = {'id': 'live', 'package_id': 'p',
+            'name': 'Trees', 'description': 'All the trees', 'url': 'x/live'}
+        ckan.action.package_show.return_value = {'resources': [{'id': 'a'}, {'id': 'live'},
+            {'id': 'b'}, {'id': 'staging'}]}
+        with patch.object(pl.CKANDatastoreLoader, 'count_datastore_rows', return_value=3):
+            self.loader.swap_in_staging_resource()
+        ckan.action.resource_patch.assert_called_once_with(id='staging', name='Trees',
+            description='All the trees')
+        ckan.action.package_resource_reorder.assert_called_once_with(id='p',
+            order=['a', 'staging', 'b'])
+        ckan.action.resource_delete.assert_called_once_with(id='live')
+
+    @patch('engine.wprdc_etl.pipeline.ckan_trace.TracedRemoteCKAN')
+    def test_no_swap_when_rows_are_missing(self, RemoteCKAN):
+        with patch.object(pl.CKANDatastoreLoader, 'count_datastore_rows', return_value=2):
+            with self.assertRaises(RuntimeError):
+                self.loader.swap_in_staging_resource()
+        RemoteCKAN.return_value.action.resource_delete.assert_not_called()
+
+
+class TestTabularFileLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpdir.name, 'output.csv')
+        self.fields = [{'id': 'name', 'type': 'text'}, {'id': 'count', 'type': 'int'}]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_file_is_opened_once(self):
+        loader = pl.TabularFileLoader(filepath=self.filepath, file_format='csv',
+                fields=self.fields, method='insert')
+        with patch.object(pl.TabularFileLoader, 'check_format') as check_format:
+            loader.load([{'name': 'a', 'count': 1}])
+            output_file = loader.output_file
+            loader.load(pl.ColumnarChunk.from_records([{'name': 'b', 'count': 2}]))
+        self.assertIs(loader.output_file, output_file)
+        self.assertEquals(check_format.call_count, 1)
+        loader.finalize()
+        self.assertTrue(output_file.closed)
+        with open(self.filepath) as f:
+            self.assertEquals(f.read(), 'name,count\na,1\nb,2\n')
+
+    def test_append_uses_existing_column_order(self):
+        with open(self.filepath, 'w') as f:
+            f.write('count,name\n1,a\n')
+        loader = pl.TabularFileLoader(filepath=self.filepath, file_format='csv',
+                fields=self.fields, method='insert')
+        loader.load([{'name': 'b', 'count': 2}])
+        loader.finalize()
+        with open(self.filepath) as f:
+            self.assertEquals(f.read(), 'count,name\n1,a\n2,b\n')
+
+
+class TestSQLiteFileLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpdir.name, 'output.csv')
+        self.fields = [{'id': 'name', 'type': 'text'}, {'id': 'count', 'type': 'int'}]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_loader(self, chunks, **kwargs):
+        loader = pl.SQLiteFileLoader(filepath=self.filepath, file_format='csv',
+                fields=self.fields, key_fields=['name'], **kwargs)
+        for chunk in chunks:
+            loader.load(chunk)
+        loader.finalize()
+        with open(self.filepath) as f:
+            return f.read()
+
+    def test_upsert(self):
+        output = self.run_loader([[{'name': 'a', 'count': 1}, {'name': 'b', 'count': 2}],
+            [{'name': 'a', 'count': 3}]], method='upsert')
+        self.assertEquals(output, 'name,count\na,3\nb,2\n')
+        # A later run upserts to the records of the earlier run.
+        output = self.run_loader([[{'name': 'c', 'count': 4}, {'name': 'b', 'count': 5}]], method='upsert')
+        self.assertEquals(output, 'name,count\na,3\nb,5\nc,4\n')
+        output = self.run_loader([[{'name': 'd', 'count': 6}]], method='upsert', clear_first=True)
+        self.assertEquals(output, 'name,count\nd,6\n')
+
+    def test_insert_conflict(self):
+        with self.assertRaises(RuntimeError):
+            self.run_loader([[{'name': 'a', 'count': 1}, {'name': 'a', 'count': 2}]], method='insert')
+
+    def test_upsert_to_existing_file(self):
+        self.fields = [{'id': 'id', 'type': 'int'}, {'id': 'name', 'type': 'text'}]
+        with open(self.filepath, 'w') as f:
+            f.write('id,name\n1,a\n2,b\n')
+        loader = pl.SQLiteFileLoader(filepath=self.filepath, file_format='csv',
+                fields=self.fields, key_fields=['id'], method='upsert')
+        loader.load([{'id': 1, 'name': 'A'}, {'id': 3, 'name': 'c'}])
+        loader.finalize()
+        with open(self.filepath) as f:
+            self.assertEquals(f.read(), 'id,name\n1,A\n2,b\n3,c\n')
+
+
+class TestMultiLoader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source_filepath = os.path.join(self.tmpdir.name, 'source.csv')
+        with open(self.source_filepath, 'w') as f:
+            f.write('name,count\na,1\n')
+        self.fields = [{'id': 'name', 'type': 'text'}, {'id': 'count', 'type': 'int'}]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, filename):
+        return os.path.join(self.tmpdir.name, filename)
+
+    def test_records_and_source_file_fan_out(self):
+        loader = pl.MultiLoader(destinations={
+            'file': (pl.TabularFileLoader, {'filepath': self.path('a.csv'), 'file_format': 'csv',
+                'fields': self.fields, 'method': 'insert'}),
+            'archive': (pl.SQLiteFileLoader, {'filepath': self.path('b.csv'), 'file_format': 'csv',
+                'fields': self.fields, 'key_fields': ['name'], 'method': 'upsert'}),
+            'copy': (pl.NontabularFileLoader, {'filepath': self.path('c.csv'), 'file_format': 'csv'}),
+            }, source_filepath=self.source_filepath)
+        loader.load([{'name': 'a', 'count': 1}])
+        loader.finalize()
+        for filename in ['a.csv', 'b.csv', 'c.csv']:
+            with open(self.path(filename)) as f:
+                self.assertEquals(f.read(), 'name,count\na,1\n')
+        self.assertEquals(loader.metrics['file.records_loaded'], 1)
+        self.assertEquals(loader.metrics['archive.records_loaded'], 1)
+
+    def test_file_destinations_need_a_source_file(self):
+        with self.assertRaises(RuntimeError):
+            pl.MultiLoader(destinations={'copy': (pl.NontabularFileLoader,
+                {'filepath': self.path('c.csv'), 'file_format': 'csv'})})
+
+
+class TestEncodeJson(unittest.TestCase):
+    def test_dates_and_decimals(self):
+        encoded = pl.loaders.encode_json({'records': [
+            {'date': datetime.date(2020, 1, 2), 'amount': Decimal('1.10'), 'name': 'Sé'}
+        ]})
+        self.assertIsInstance(encoded, bytes)
+        self.assertEquals(json.loads(encoded.decode('utf-8')),
+            {'records': [{'date': '2020-01-02', 'amount': '1.10', 'name': 'Sé'}]})
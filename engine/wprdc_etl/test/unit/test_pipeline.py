@@ -1,6 +1,10 @@
 import unittest
 
 import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from marshmallow import fields
 import wprdc_etl.pipeline as pl
 from test.base import TestLoader, TestBase, TestSchema
 
@@ -104,3 +108,173 @@ class TestStatusLogging(TestBase):
 
         status = self.cur.execute('select * from status').fetchall()
         self.assertEquals(len(status), 1)
+
+class CountSchema(pl.BaseSchema):
+    name = fields.String()
+    count = fields.Integer()
+
+class RecordingLoader(TestLoader):
+    has_tabular_output = True
+    chunks = []
+    fail_on_chunk = None
+
+    def load(self, data):
+        if len(RecordingLoader.chunks) == RecordingLoader.fail_on_chunk:
+            raise ConnectionError('The server went away.')
+        RecordingLoader.chunks.append(list(data))
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, 'source.csv')
+        with open(self.source, 'w') as f:
+            f.write('name,count\n' + ''.join('r{0},{0}\n'.format(i) for i in range(5)))
+        self.spool = pl.ChunkSpool(os.path.join(self.tmpdir.name, 'spool'))
+        RecordingLoader.chunks = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def pipeline(self):
+        return pl.Pipeline('test', 'Test', settings_file=os.path.join(HERE, '../mock/first_test_settings.json'),
+                chunk_size=2, spool=self.spool) \
+            .connect(pl.FileConnector, self.source) \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(CountSchema) \
+            .load(RecordingLoader)
+
+    def test_failed_run_is_spooled_and_replayed(self):
+        RecordingLoader.fail_on_chunk = 1
+        with self.assertRaises(ConnectionError):
+            self.pipeline().run()
+        info = self.spool.open_run()
+        self.assertEquals((info['chunks'], info['records'], info['chunks_loaded']), (3, 5, 1))
+
+        RecordingLoader.fail_on_chunk = None
+        self.pipeline().replay()
+        self.assertEquals([len(chunk) for chunk in RecordingLoader.chunks], [2, 2, 1])
+        self.assertEquals(RecordingLoader.chunks[-1], [{'name': 'r4', 'count': 4}])
+        self.assertEquals(self.spool.open_run()['chunks_loaded'], 3)
+
+class CountingLoader(TestLoader):
+    has_tabular_output = True
+
+    def load(self, data):
+        self.metrics['records_loaded'] += len(data)
+
+class UninitializedLoader(CountingLoader):
+    def __init__(self, *args, **kwargs):
+        pass # (Without calling Loader.__init__, which sets up the metrics.)
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmpdir.name, 'source.csv')
+        with open(self.source, 'w') as f:
+            f.write('name,count\n' + ''.join('r{0},{0}\n'.format(i) for i in range(5)))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def pipeline(self, loader):
+        return pl.Pipeline('test', 'Test', settings_file=os.path.join(HERE, '../mock/first_test_settings.json'),
+                chunk_size=2) \
+            .connect(pl.FileConnector, self.source) \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(CountSchema) \
+            .load(loader)
+
+    def test_loader_metrics_are_reported(self):
+        self.assertEqual(self.pipeline(CountingLoader).run().metrics['records_loaded'], 5)
+
+    def test_loaders_must_set_up_their_metrics(self):
+        with self.assertRaisesRegex(AttributeError, 'metrics'):
+            self.pipeline(UninitializedLoader).run()
+
+class SizeSchema(pl.BaseSchema):
+    label = fields.String()
+    size = fields.Float()
+
+class KeyedLoader(TestLoader):
+    has_tabular_output = True
+    loaded = {}
+
+    def __init__(self, *args, key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.key = key
+
+    def load(self, data):
+        if any(record.get('name') == 'partial' for record in data):
+            raise RuntimeError('409 Conflict')
+        KeyedLoader.loaded.setdefault(self.key, []).append(list(data))
+
+def flatten(chunks):
+    return [record for chunk in chunks for record in chunk]
+
+class TestParallelParsing(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        KeyedLoader.loaded = {}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_source(self, filename, header, lines):
+        path = os.path.join(self.tmpdir.name, filename)
+        with open(path, 'w') as f:
+            f.write(header + '\n' + ''.join(line + '\n' for line in lines))
+        return path
+
+    def pipeline(self, source, schema, key, parse_workers=2, parallel_threshold=0, **kwargs):
+        return pl.Pipeline('test', 'Test', settings_file=os.path.join(HERE, '../mock/first_test_settings.json'),
+                chunk_size=7, parse_workers=parse_workers, parallel_threshold=parallel_threshold, **kwargs) \
+            .connect(pl.FileConnector, source) \
+            .extract(pl.CSVExtractor, firstline_headers=True) \
+            .schema(schema) \
+            .load(KeyedLoader, key=key)
+
+    def test_concurrent_pipelines_keep_their_own_schemas(self):
+        counts = self.write_source('counts.csv', 'name,count', ['r{0},{0}'.format(i) for i in range(200)])
+        sizes = self.write_source('sizes.csv', 'label,size', ['s{0},{0}.5'.format(i) for i in range(200)])
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(self.pipeline(counts, CountSchema, 'counts').run),
+                executor.submit(self.pipeline(sizes, SizeSchema, 'sizes').run)]
+            for future in futures:
+                future.result()
+        self.assertEqual(flatten(KeyedLoader.loaded['counts']), [{'name': 'r{}'.format(i), 'count': i} for i in range(200)])
+        self.assertEqual(flatten(KeyedLoader.loaded['sizes']), [{'label': 's{}'.format(i), 'size': i + 0.5} for i in range(200)])
+
+    def test_chunks_keep_the_source_order(self):
+        counts = self.write_source('counts.csv', 'name,count', ['r{0},{0}'.format(i) for i in range(200)])
+        self.pipeline(counts, CountSchema, 'counts').run()
+        chunks = KeyedLoader.loaded['counts']
+        self.assertEqual([len(chunk) for chunk in chunks], [7]*28 + [4])
+        self.assertEqual(flatten(chunks), [{'name': 'r{}'.format(i), 'count': i} for i in range(200)])
+
+    def test_small_files_are_parsed_serially(self):
+        counts = self.write_source('counts.csv', 'name,count', ['r{0},{0}'.format(i) for i in range(20)])
+        with patch.object(pl.Pipeline, 'run_parallel') as run_parallel:
+            self.pipeline(counts, CountSchema, 'counts', parallel_threshold=os.path.getsize(counts) + 1).run()
+        run_parallel.assert_not_called()
+        self.assertEqual(len(flatten(KeyedLoader.loaded['counts'])), 20)
+
+        with patch.object(pl.Pipeline, 'run_parallel') as run_parallel:
+            self.pipeline(counts, CountSchema, 'counts', parallel_threshold=os.path.getsize(counts)).run()
+        run_parallel.assert_called_once()
+
+    def test_worker_errors_are_raised(self):
+        lines = ['r{0},{0}'.format(i) for i in range(200)]
+        lines[150] = 'r150,not a number'
+        counts = self.write_source('counts.csv', 'name,count', lines)
+        with self.assertRaisesRegex(RuntimeError, 'not a number'):
+            self.pipeline(counts, CountSchema, 'counts').run()
+
+    def test_retry_without_last_line_in_both_modes(self):
+        counts = self.write_source('counts.csv', 'name,count', ['r{0},{0}'.format(i) for i in range(199)] + ['partial,1'])
+        for parse_workers in [0, 2]:
+            KeyedLoader.loaded = {}
+            with self.assertRaises(RuntimeError):
+                self.pipeline(counts, CountSchema, 'counts', parse_workers=parse_workers).run()
+            KeyedLoader.loaded = {}
+            self.pipeline(counts, CountSchema, 'counts', parse_workers=parse_workers, retry_without_last_line=True).run()
+            self.assertEqual(flatten(KeyedLoader.loaded['counts']), [{'name': 'r{}'.format(i), 'count': i} for i in range(199)])
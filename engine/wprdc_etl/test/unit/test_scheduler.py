@@ -0,0 +1,146 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+from engine.scheduler import CronExpression, Scheduler
+
+class TestCronExpression(unittest.TestCase):
+    def next_time(self, expression, after):
+        return CronExpression(expression).next_time(after)
+
+    def test_steps(self):
+        self.assertEqual(self.next_time('*/15 * * * *', datetime(2026, 10, 19, 10, 7, 30)),
+            datetime(2026, 10, 19, 10, 15))
+        self.assertEqual(self.next_time('*/15 * * * *', datetime(2026, 10, 19, 10, 45)),
+            datetime(2026, 10, 19, 11, 0))
+        self.assertEqual(self.next_time('0 8-18/4 * * *', datetime(2026, 10, 19, 12, 30)),
+            datetime(2026, 10, 19, 16, 0))
+        self.assertEqual(self.next_time('0 8-18/4 * * *', datetime(2026, 10, 19, 16, 0)),
+            datetime(2026, 10, 20, 8, 0))
+
+    def test_ranges_and_lists(self):
+        # From Friday morning, weekdays at 9:30 next come on Monday.
+        self.assertEqual(self.next_time('30 9 * * 1-5', datetime(2026, 10, 23, 10, 0)),
+            datetime(2026, 10, 26, 9, 30))
+        self.assertEqual(self.next_time('0 0 1,15 * *', datetime(2026, 10, 2)),
+            datetime(2026, 10, 15))
+        self.assertEqual(self.next_time('0 0 1 1 *', datetime(2026, 10, 19)), datetime(2027, 1, 1))
+        self.assertEqual(self.next_time('@monthly', datetime(2026, 10, 19)), datetime(2026, 11, 1))
+
+    def test_day_of_month_or_day_of_week(self):
+        # When both are restricted, either one can match: the 13th or any Friday.
+        self.assertEqual(self.next_time('0 0 13 * 5', datetime(2026, 10, 19)), datetime(2026, 10, 23))
+        self.assertEqual(self.next_time('0 0 13 * 5', datetime(2026, 11, 10)), datetime(2026, 11, 13))
+        self.assertEqual(self.next_time('0 0 20 * 5', datetime(2026, 10, 19)), datetime(2026, 10, 20))
+        # Otherwise, both have to match.
+        self.assertEqual(self.next_time('0 0 13 * *', datetime(2026, 10, 19)), datetime(2026, 11, 13))
+
+    def test_seven_means_sunday(self):
+        sunday_noon = datetime(2026, 10, 25, 12, 0)
+        self.assertEqual(self.next_time('0 12 * * 7', datetime(2026, 10, 19)), sunday_noon)
+        self.assertEqual(self.next_time('0 12 * * 0', datetime(2026, 10, 19)), sunday_noon)
+        self.assertEqual(self.next_time('0 12 * * 5-7', datetime(2026, 10, 19)), datetime(2026, 10, 23, 12, 0))
+
+    def test_never_matching_expressions(self):
+        for expression in ['0 0 30 2 *', '0 0 31 4 *']:
+            with self.assertRaises(ValueError):
+                self.next_time(expression, datetime(2026, 10, 19))
+
+    def test_invalid_expressions(self):
+        for expression in ['60 * * * *', '* * * *', '0 0 0 * *', '*/0 * * * *', '0 12-8 * * *']:
+            with self.assertRaises(ValueError):
+                CronExpression(expression)
+
+
+class FakeExecutor:
+    '''Collects the submitted calls (so the test decides when each one finishes)'''
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, function, *args):
+        self.calls.append((function, args))
+
+    def finish(self, k):
+        function, args = self.calls[k]
+        function(*args)
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.schedule_filepath = os.path.join(self.tmpdir.name, 'schedule.json')
+        self.write_schedule()
+        self.run_entry = Mock()
+        self.scheduler = Scheduler(self.schedule_filepath, self.run_entry)
+        self.executor = FakeExecutor()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_schedule(self, county_limit=1, workers=4):
+        with open(self.schedule_filepath, 'w') as f:
+            json.dump({'workers': workers, 'source_limits': {'county_sftp': county_limit}, 'entries': [
+                {'payload': 'ac_hd/restaurants', 'cron': '0 3 * * *', 'source': 'county_sftp'},
+                {'payload': 'ac_hd/inspections', 'cron': '0 3 * * *', 'source': 'county_sftp'},
+                {'payload': 'pgh/trees', 'cron': '0 3 * * *'}]}, f)
+
+    def make_entries_due(self):
+        for entry in self.scheduler.entries:
+            entry.next_run = datetime.now() - timedelta(minutes=1)
+
+    def started(self):
+        return [args[0].payload for _, args in self.executor.calls]
+
+    def test_source_limits(self):
+        self.make_entries_due()
+        self.scheduler.start_due_entries(self.executor)
+        self.assertEqual(self.started(), ['ac_hd/restaurants', 'pgh/trees'])
+        # The other county entry stays due until the running one finishes.
+        self.scheduler.start_due_entries(self.executor)
+        self.assertEqual(len(self.executor.calls), 2)
+        self.executor.finish(0)
+        self.scheduler.start_due_entries(self.executor)
+        self.assertEqual(self.started(), ['ac_hd/restaurants', 'pgh/trees', 'ac_hd/inspections'])
+
+    def test_running_entries_are_skipped(self):
+        self.make_entries_due()
+        self.scheduler.start_due_entries(self.executor)
+        self.make_entries_due()
+        self.scheduler.start_due_entries(self.executor)
+        self.assertEqual(self.started(), ['ac_hd/restaurants', 'pgh/trees'])
+        trees = self.scheduler.entries[2]
+        self.assertGreater(trees.next_run, datetime.now()) # Its next run was scheduled instead.
+        self.executor.finish(1)
+        trees.next_run = datetime.now() - timedelta(minutes=1)
+        self.scheduler.start_due_entries(self.executor)
+        self.assertEqual(self.started()[-1], 'pgh/trees')
+
+    def test_reloading_keeps_counting_running_entries(self):
+        self.make_entries_due()
+        self.scheduler.start_due_entries(self.executor)
+        self.write_schedule(county_limit=1)
+        self.scheduler.load()
+        self.make_entries_due()
+        self.scheduler.start_due_entries(self.executor)
+        self.assertEqual(self.started().count('ac_hd/inspections'), 0)
+        self.write_schedule(county_limit=2) # A raised limit applies right away.
+        self.scheduler.load()
+        self.make_entries_due()
+        self.scheduler.start_due_entries(self.executor)
+        self.assertEqual(self.started().count('ac_hd/inspections'), 1)
+
+    def test_pool_is_replaced_when_workers_change(self):
+        self.scheduler.update_pool()
+        executor = self.scheduler.executor
+        self.scheduler.update_pool()
+        self.assertIs(self.scheduler.executor, executor)
+        self.write_schedule(workers=2)
+        self.scheduler.load()
+        self.scheduler.update_pool()
+        self.assertIsNot(self.scheduler.executor, executor)
+        self.assertEqual(self.scheduler.executor._max_workers, 2)
+        self.assertEqual(self.scheduler.retired_executors, [executor])
+        self.scheduler.executor.shutdown()
@@ -2,7 +2,7 @@ from operator import itemgetter
 from unittest import TestCase
 
 import wprdc_etl.pipeline as pl
-from marshmallow import fields
+from marshmallow import fields, pre_load
 
 class FakeSchema(pl.BaseSchema):
     str = fields.String()
@@ -12,6 +12,22 @@ class FakeSchema(pl.BaseSchema):
     date = fields.Date(dump_to='a_different_name')
     not_there = fields.String(load_only=True)
 
+class DeclaredHookSchema(pl.BaseSchema):
+    str = fields.String(load_from='string_column')
+    made_up = fields.String(dump_only=True)
+
+    @pre_load
+    @pl.reads_columns('extra_column')
+    def use_extra_column(self, data):
+        pass
+
+class UndeclaredHookSchema(pl.BaseSchema):
+    str = fields.String()
+
+    @pre_load
+    def use_anything(self, data):
+        pass
+
 class TestSchema(TestCase):
     def test_ckan_serialization(self):
         fields = FakeSchema().serialize_to_ckan_fields()
@@ -38,3 +54,18 @@ class TestSchema(TestCase):
                 {'id': 'STR', 'type': 'text'}
             ]
         )
+
+    def test_source_columns(self):
+        self.assertSetEqual(
+            FakeSchema().source_columns(),
+            {'str', 'int', 'num', 'datetime', 'date', 'not_there'}
+        )
+
+    def test_source_columns_with_declared_hook(self):
+        self.assertSetEqual(
+            DeclaredHookSchema().source_columns(),
+            {'str', 'string_column', 'extra_column'}
+        )
+
+    def test_source_columns_with_undeclared_hook(self):
+        self.assertIsNone(UndeclaredHookSchema().source_columns())
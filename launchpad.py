@@ -1,19 +1,17 @@
-import os, sys, requests, csv, json, traceback, re
-from marshmallow import fields, pre_load, post_load
+import os, sys, json, traceback, re, threading, time, multiprocessing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from engine.wprdc_etl import pipeline as pl
 
 from engine.credentials import API_key
-from engine.parameters.local_parameters import BASE_DIR, LOG_DIR, PRODUCTION
+from engine.parameters.local_parameters import BASE_DIR, LOG_DIR, PRODUCTION, SETTINGS_FILE
 from engine.etl_util import post_process, Job, get_data_dictionary, set_data_dictionary, get_package_id, find_resource_id, delete_datatable_views, save_to_waiting_room
 from engine.notify import send_to_slack
+from engine.wprdc_etl.pipeline.ledger import RunLedger, format_deviations, format_time
 
 CLEAR_FIRST = False
-
-try:
-    from icecream import ic
-except ImportError:  # Graceful fallback if IceCream isn't installed.
-    ic = lambda *a: None if not a else (a[0] if len(a) == 1 else a)  # noqa
+REGRESSION_THRESHOLD = 0.5 # How far (as a fraction of the rolling baseline) a run's duration,
+# rows, or bytes can deviate before it gets flagged in the run ledger.
 
 def import_module(path,name):
     import importlib.util
@@ -49,6 +47,9 @@ def parse_args(args, job_dicts, payload_location, module_name):
     migrate_schema = False
     ignore_empty_rows = False
     retry_without_last_line = False
+    parallel_parse = False
+    replay = False
+    parallel = 1
     logging = False
     test_mode = not PRODUCTION # Use PRODUCTION boolean from parameters/local_parameters.py to set whether test_mode defaults to True or False
     wake_me_when_found = False
@@ -87,6 +88,15 @@ def parse_args(args, job_dicts, payload_location, module_name):
         elif arg in ['retry_without_last_line']:
             retry_without_last_line= True
             args.remove(arg)
+        elif arg in ['parallel_parse']:
+            parallel_parse = True
+            args.remove(arg)
+        elif arg in ['replay']: # Load the validated records spooled by the last run.
+            replay = True
+            args.remove(arg)
+        elif re.match(r'^parallel=\d+$', arg): # Run up to N independent jobs at once.
+            parallel = max(1, int(arg.split('=')[1]))
+            args.remove(arg)
         elif arg in ['log']:
             logging = True
             log_path_plus = LOG_DIR + payload_location + '/' + module_name
@@ -136,6 +146,9 @@ def parse_args(args, job_dicts, payload_location, module_name):
         'migrate_schema': migrate_schema,
         'ignore_empty_rows': ignore_empty_rows,
         'retry_without_last_line': retry_without_last_line,
+        'parallel_parse': parallel_parse,
+        'replay': replay,
+        'parallel': parallel,
         'test_mode': test_mode,
         'wake_me_when_found': wake_me_when_found,
         'mute_alerts': mute_alerts,
@@ -171,7 +184,7 @@ def code_is_in_job_dict(code, job_dict):
     """Identify jobs by a command-line-specified job code which could be 1) the full name of
     the source file, 2) the name of the source file without the extension, or 3) the
     explicitly specified 'job_code' in the job_dict."""
-    if 'source_file' in job_dict:
+    if isinstance(job_dict.get('source_file'), str): # (It could be a LazyField.)
         if code == job_dict['source_file'] or code == job_dict['source_file'].split('.')[0]:
             return True
     if 'job_code' in job_dict:
@@ -219,7 +232,182 @@ def run_job_and_post_processing(job, args_dict):
                 results = set_data_dictionary(resource_id, job.saved_data_dictionary)
                 # Attempt to restore data dictionary, taking into account the deletion and addition of fields, and ignoring any changes in type.
 
-def main(**kwargs):
+run_ledger = None
+
+def get_run_ledger():
+    """Open the run ledger, which is kept in the status DB (or in the log
+    directory, if the settings file keeps the status DB in memory)."""
+    global run_ledger
+    if run_ledger is None:
+        with open(SETTINGS_FILE) as f:
+            status_db = json.load(f).get('general', {}).get('statusdb', ':memory:')
+        if status_db == ':memory:':
+            os.makedirs(LOG_DIR, exist_ok=True)
+            status_db = LOG_DIR + 'run_ledger.db'
+        run_ledger = RunLedger(status_db)
+    return run_ledger
+
+def record_run(job, start, status, args_dict):
+    """Add a run of a job to the run ledger, warning if it deviates from the
+    job's rolling baseline."""
+    try:
+        ledger = get_run_ledger()
+        run = ledger.record(job.job_code, start, time.time() - start, status, job.metrics,
+                job_directory=job.job_directory, test_mode=args_dict.get('test_mode', False))
+        deviations = ledger.deviations(run, REGRESSION_THRESHOLD)
+        if deviations:
+            print(f"Possible regression: This run of {job.job_code} deviates from its baseline: {format_deviations(deviations)}")
+    except Exception: # A problem with the ledger shouldn't fail the job.
+        print("Unable to record this run in the run ledger:")
+        traceback.print_exc()
+
+def run_and_record_job(job, args_dict):
+    """Run a job (with post-processing), tracing its CKAN API calls, printing
+    a summary of them, and recording the run in the run ledger."""
+    from engine.wprdc_etl.pipeline import ckan_trace
+    start = time.time()
+    status = 'failed'
+    ckan_trace.start_trace(job.job_code)
+    try:
+        run_job_and_post_processing(job, args_dict)
+        status = 'success'
+    except FileNotFoundError:
+        status = 'file_not_found'
+        raise
+    finally:
+        trace = ckan_trace.stop_trace()
+        trace.report()
+        job.metrics = dict(job.metrics, **trace.metrics())
+        record_run(job, start, status, args_dict)
+
+class JobPrefixingStream(object):
+    """Wrap an output stream so that each line written by a thread that is
+    running a job is prefixed with that job's code (keeping the output of
+    jobs running in parallel readable)."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        prefix = getattr(self.local, 'prefix', None)
+        if prefix is None:
+            with self.lock:
+                return self.stream.write(text)
+        buffered = getattr(self.local, 'buffer', '') + text
+        *lines, self.local.buffer = buffered.split('\n')
+        if lines:
+            with self.lock:
+                self.stream.write(''.join(f'{prefix}{line}\n' for line in lines))
+        return len(text)
+
+    def set_prefix(self, prefix):
+        if prefix is None and getattr(self.local, 'buffer', ''):
+            self.write('\n') # Flush any incomplete last line.
+        self.local.prefix = prefix
+        self.local.buffer = ''
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def dependencies_by_job_code(selected_jobs):
+    """Build the dependency graph of the selected jobs from the 'depends_on'
+    fields of their job_dicts. Dependencies on jobs that were not selected
+    are ignored.
+
+    Raises:
+        ValueError if two jobs have the same code or the dependencies are
+        circular
+    """
+    codes = [job.job_code for job in selected_jobs] # (A job_code defaults to the resource_name.)
+    duplicates = sorted(set(code for code in codes if codes.count(code) > 1))
+    if duplicates:
+        raise ValueError(f"Jobs can only be run in parallel if their job codes are unique, but these codes are shared: {duplicates}")
+    selected_codes = set(codes)
+    graph = {}
+    for job in selected_jobs:
+        graph[job.job_code] = {code for code in job.depends_on if code in selected_codes}
+
+    # Check for cycles (which would leave jobs waiting forever).
+    unresolved, resolved = dict(graph), set()
+    while unresolved:
+        ready = [code for code, deps in unresolved.items() if deps <= resolved]
+        if not ready:
+            raise ValueError(f"These jobs have circular 'depends_on' values: {sorted(unresolved)}")
+        for code in ready:
+            resolved.add(code)
+            del unresolved[code]
+    return graph
+
+def run_jobs_in_parallel(selected_jobs, args_dict, workers):
+    """Run the selected jobs in a pool of worker threads, starting each
+    job once all the jobs it depends on have succeeded. (Jobs that depend on
+    a job that failed are skipped.) Each line of output is prefixed with the
+    code of the job that printed it.
+
+    Returns:
+        A list of (job_code, exception, formatted traceback) tuples for the
+        jobs that failed or were skipped
+    """
+    graph = dependencies_by_job_code(selected_jobs)
+    jobs_by_code = {job.job_code: job for job in selected_jobs}
+    stdout, stderr = sys.stdout, sys.stderr
+    if not isinstance(stdout, JobPrefixingStream): # (The scheduler daemon installs its own.)
+        sys.stdout, sys.stderr = JobPrefixingStream(stdout), JobPrefixingStream(stderr)
+
+    def run(job):
+        for stream in [sys.stdout, sys.stderr]:
+            stream.set_prefix(f'[{job.job_code}] ')
+        try:
+            run_and_record_job(job, args_dict)
+        finally:
+            for stream in [sys.stdout, sys.stderr]:
+                stream.set_prefix(None)
+
+    succeeded, failures, running = set(), [], {}
+    pending = [job.job_code for job in selected_jobs]
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                failed_codes = {code for code, _, _ in failures}
+                for code in list(pending):
+                    if graph[code] & failed_codes:
+                        pending.remove(code)
+                        e = RuntimeError(f'Skipped because these jobs failed: {sorted(graph[code] & failed_codes)}')
+                        failures.append((code, e, str(e)))
+                    elif graph[code] <= succeeded:
+                        pending.remove(code)
+                        running[executor.submit(run, jobs_by_code[code])] = code
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    code = running.pop(future)
+                    e = future.exception()
+                    if e is None:
+                        succeeded.add(code)
+                    else:
+                        lines = traceback.format_exception(type(e), e, e.__traceback__)
+                        failures.append((code, e, ''.join(lines)))
+                        print(f'[{code}] failed with {type(e).__name__}: {e}')
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+    return failures
+
+def raise_job_failures(failures, job_count):
+    """Raise one exception summarizing the failures of jobs run in parallel
+    (so that only one notification gets sent)."""
+    summary = f'{len(failures)} of {job_count} jobs failed: ' + ', '.join(code for code, _, _ in failures)
+    details = '\n'.join(f'== {code} ==\n{formatted}' for code, _, formatted in failures)
+    exception_type = RuntimeError
+    if all(isinstance(e, FileNotFoundError) for _, e, _ in failures):
+        exception_type = FileNotFoundError # Keep wake_me_when_found working.
+    raise exception_type(f'{summary}\n{details}')
+
+def main(job_dicts, **kwargs):
     selected_job_codes = kwargs.get('selected_job_codes', [])
     use_local_input_file = kwargs.get('use_local_input_file', False)
     use_local_output_file = kwargs.get('use_local_output_file', False)
@@ -239,50 +427,242 @@ def main(**kwargs):
 
     # [ ] Add in script-level post-processing here, allowing the data.json file of an ArcGIS
     # server to be searched for unharvested tables.
+    workers = kwargs.get('parallel', 1)
+    if workers > 1 and len(selected_jobs) > 1:
+        failures = run_jobs_in_parallel(selected_jobs, kwargs, workers)
+        if failures:
+            raise_job_failures(failures, len(selected_jobs))
+        return
+
     try:
         for job in selected_jobs:
-            run_job_and_post_processing(job, kwargs)
+            run_and_record_job(job, kwargs)
     except Exception as e:
         import sys
         raise type(e)(f'{e} [for job_code == "{job.job_code}"]').with_traceback(sys.exc_info()[2])
 
+def run_payload(args, job_dicts, payload_location, module_name):
+    """Parse the command-line arguments for a payload's jobs and run them,
+    sending Slack notifications when they fail (or when a file that
+    wake_me_when_found was waiting for shows up)."""
+    try:
+        kwargs, args = parse_args(args, job_dicts, payload_location, module_name)
+        main(job_dicts, **kwargs)
+
+        if kwargs['wake_me_when_found']:
+            msg = "A file that was not expected (one of these: {}) has resurfaced!\nIf this was a one-time outage, you can remove the wake_me_when_found parameter from the cron job for this ETL process.\nIf this is a source file that appears on some schedule, the file has appeared at an unexpected time. The cron job date specification might need to be altered.".format(list(set([j_dict['source_file'] for j_dict in job_dicts])))
+            print(msg)
+            if not kwargs['mute_alerts']:
+                channel = "@david" if (kwargs['test_mode'] or not PRODUCTION) else "#etl-hell"
+                send_to_slack(msg, username='{}/{} ETL assistant'.format(payload_location, module_name), channel=channel, icon=':illuminati:')
+    except:
+        e = sys.exc_info()[0]
+        if e == FileNotFoundError and kwargs['wake_me_when_found']:
+            print("As expected, this script threw an exception because the ETL framework could not find a source file.")
+        elif e == KeyboardInterrupt:
+            print("(Suppressing Slack notification for keyboard interrupt.)")
+        else:
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
+            msg = ''.join('!! ' + line for line in lines)
+            print(msg) # Log it or whatever here
+            if not kwargs['mute_alerts']:
+                channel = "@david" if (kwargs['test_mode'] or not PRODUCTION) else "#etl-hell"
+                if channel != "@david":
+                    msg = f"@david {msg}"
+                send_to_slack(msg, username='{}/{} ETL assistant'.format(payload_location, module_name), channel=channel, icon=':illuminati:')
+
+def run_scheduled_entry(entry):
+    """Run an entry of the scheduler daemon's schedule (in a worker thread),
+    prefixing its output with the entry's name."""
+    sys.stdout.set_prefix(f'[{entry.name}] ')
+    sys.stderr.set_prefix(f'[{entry.name}] ')
+    try:
+        job_dicts, payload_location, module_name = get_job_dicts(entry.payload) # The payload is
+        # imported again for each run, so that changes to it are picked up.
+        args = [arg for arg in entry.args if arg != 'log'] + entry.job_codes # (The daemon's output
+        # can't be redirected per entry.)
+        run_payload(args, job_dicts, payload_location, module_name)
+    finally:
+        sys.stdout.set_prefix(None)
+        sys.stderr.set_prefix(None)
+
+def run_daemon(schedule_filepath):
+    """Run the jobs in the schedule file whenever they're due (see engine/scheduler.py)."""
+    from engine.scheduler import Scheduler
+    sys.stdout, sys.stderr = JobPrefixingStream(sys.stdout), JobPrefixingStream(sys.stderr)
+    Scheduler(schedule_filepath, run_scheduled_entry).run_forever()
+
+TEST_ALL_KWARGS = {'selected_job_codes': [],
+    'use_local_input_file': False,
+    'use_local_output_file': False,
+    'clear_first': False,
+    'wipe_data': False,
+    'test_mode': True,
+    'migrate_schema': False,
+    'ignore_empty_rows': False,
+    'retry_without_last_line': False,
+    'parallel_parse': False,
+    'parallel': 1,
+    }
+
+def find_payload_modules():
+    """Find all the scripts in the payload directories (skipping directories
+    that start with a double underscore and modules that start with an
+    underscore)."""
+    full_payload_path = BASE_DIR + 'engine/payload/'
+    module_paths = []
+    for dir_path in sorted(f.path for f in os.scandir(full_payload_path) if f.is_dir() and f.name[:2] != '__'):
+        module_paths += sorted(f.path for f in os.scandir(dir_path) if f.is_file() and f.name[0] != '_' and f.name[-3:] == '.py')
+    return module_paths
+
+def test_module(module_path, log_filepath, results):
+    """Run all the jobs in a payload module in test mode (in a worker process
+    of test_all), writing the output to a log file and putting a summary of
+    each job (duration, number of rows loaded, and status) on the results
+    queue."""
+    sys.stdout = sys.stderr = open(log_filepath, 'w', buffering=1)
+    module_name = module_path.split('/')[-1][:-3]
+    summary = {'module': '/'.join(module_path.split('/')[-2:]), 'job_code': None,
+            'status': 'ok', 'duration': 0, 'rows': None, 'error': None}
+    try:
+        job_dicts = import_module(module_path, module_name).job_dicts # We want to import job_dicts
+    except Exception as e:
+        traceback.print_exc()
+        results.put(dict(summary, status='import_failed', error=f'{type(e).__name__}: {e}'))
+        return
+
+    for job_dict in job_dicts:
+        job_dict['job_directory'] = module_path.split('/')[-2] # Add 'job_directory' field to each job.
+        job_summary = dict(summary, job_code=job_dict.get('job_code', job_dict.get('resource_name', None)))
+        start = time.time()
+        try:
+            job = Job(job_dict)
+            run_job_and_post_processing(job, TEST_ALL_KWARGS)
+            rows = [v for k, v in job.metrics.items() if k.split('.')[-1] == 'records_loaded'] # (Metrics from
+            job_summary['rows'] = max(rows) if rows else None # several destinations are prefixed.)
+        except Exception as e:
+            traceback.print_exc()
+            job_summary['status'] = 'file_not_found' if isinstance(e, FileNotFoundError) else 'failed'
+            job_summary['error'] = f'{type(e).__name__}: {e}'
+        job_summary['duration'] = round(time.time() - start, 2)
+        results.put(job_summary)
+
+def test_all(workers, timeout):
+    """Find all the jobs in the payload directories and run them in test mode,
+    one module per worker process (so that a module that fails, hangs, or
+    crashes can't stop the sweep). A module that is still running after
+    timeout seconds is terminated.
+
+    Each module's output is logged to test_all/<payload directory>/<module>.log
+    in the log directory, and a JSON summary of all the jobs is written to
+    test_all/summary.json.
+
+    Returns:
+        The summary (a dict)
+    """
+    log_dir = LOG_DIR + 'test_all/'
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    pending, running, jobs = find_payload_modules(), {}, []
+    sweep_start = time.time()
+    while pending or running:
+        while pending and len(running) < workers:
+            module_path = pending.pop(0)
+            log_filepath = log_dir + '/'.join(module_path.split('/')[-2:])[:-3] + '.log'
+            os.makedirs(os.path.dirname(log_filepath), exist_ok=True)
+            process = context.Process(target=test_module, args=(module_path, log_filepath, results))
+            process.start()
+            running[module_path] = (process, time.time())
+        time.sleep(0.2)
+        while not results.empty():
+            jobs.append(results.get())
+        for module_path, (process, start) in list(running.items()):
+            module = '/'.join(module_path.split('/')[-2:])
+            status = None
+            if not process.is_alive():
+                process.join()
+                if process.exitcode != 0:
+                    status = 'crashed'
+            elif time.time() - start > timeout:
+                process.terminate()
+                process.join()
+                status = 'timed_out'
+            else:
+                continue
+            del running[module_path]
+            print(f"{module}: {status or 'done'} ({round(time.time() - start, 1)} seconds)")
+            if status is not None:
+                jobs.append({'module': module, 'job_code': None, 'status': status,
+                    'duration': round(time.time() - start, 2), 'rows': None, 'error': None})
+    while not results.empty():
+        jobs.append(results.get())
+
+    summary = {'duration': round(time.time() - sweep_start, 2), 'workers': workers, 'timeout': timeout,
+            'counts': {status: sum(1 for j in jobs if j['status'] == status) for status in sorted({j['status'] for j in jobs})},
+            'jobs': sorted(jobs, key=lambda j: (j['module'], j['job_code'] or ''))}
+    os.makedirs(log_dir, exist_ok=True)
+    with open(log_dir + 'summary.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def show_ledger(job_codes, runs, threshold, window):
+    """Print the recent runs of the given jobs (or, by default, the latest run
+    of every job in the run ledger, next to its rolling baseline), marking
+    the runs that deviate from their baselines by more than the threshold.
+
+    Returns:
+        The number of flagged runs
+    """
+    ledger = get_run_ledger()
+    flagged = 0
+    def describe(run):
+        nonlocal flagged
+        deviations = ledger.deviations(run, threshold, window)
+        flagged += bool(deviations)
+        values = '  '.join(f"{field} {'-' if run[field] is None else run[field]}" for field in ['duration', 'rows', 'bytes', 'api_calls'])
+        line = f"{format_time(run['start_time'])}  {run['status']:<14} {values}{'  (test)' if run['test_mode'] else ''}"
+        return line + (f"\n    !! {format_deviations(deviations)}" if deviations else '')
+
+    if job_codes:
+        for job_code in job_codes:
+            print(f"== {job_code} ==")
+            for run in ledger.runs(job_code, limit=runs):
+                print(describe(run))
+    else:
+        for job_code in ledger.job_codes():
+            run = ledger.runs(job_code, limit=1)[0]
+            baseline = ledger.baseline(run, window)
+            medians = '  '.join(f"{field} {'-' if baseline[field] is None else format(baseline[field], 'g')}" for field in ledger.COMPARED_FIELDS)
+            print(f"{job_code}: {describe(run)}\n    baseline ({baseline['runs']} runs): {medians}")
+    print(f"{flagged} run{'s' if flagged != 1 else ''} deviated from the baseline by more than {threshold:.0%}.")
+    return flagged
+
 if __name__ == '__main__':
-    if len(sys.argv) == 2 and sys.argv[1] == 'test_all':
-        # This is an option to find and run all jobs in the payload directories sequentially.
+    if len(sys.argv) == 3 and sys.argv[1] == 'daemon':
+        run_daemon(sys.argv[2])
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'ledger':
+        # Show the history of job runs from the run ledger, flagging possible regressions.
+        options = dict(arg.split('=') for arg in sys.argv[2:] if re.match(r'^(runs|window)=\d+$|^threshold=[\d.]+$', arg))
+        job_codes = [arg for arg in sys.argv[2:] if '=' not in arg]
+        flagged = show_ledger(job_codes, runs=int(options.get('runs', 20)),
+                threshold=float(options.get('threshold', REGRESSION_THRESHOLD)), window=int(options.get('window', 10)))
+        if flagged:
+            sys.exit(1)
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'test_all':
+        # This is an option to find and run all jobs in the payload directories.
         # This serves as a kind of test of the ETL system after new changes have been
         # deployed.
         # What is missing from this approach is validation by checking the resulting
         # CKAN resources against some reference.
-
-        # Searching payloads
-        full_payload_path = BASE_DIR + 'engine/payload/'
-        dir_paths = [f.path for f in os.scandir(full_payload_path) if f.is_dir() and f.name[:2] != '__']
-        # dir_paths excludes directories that start with a double underscore.
-        for dir_path in dir_paths:
-            # For each payload directory, find all scripts that are valid jobs and run them in test mode.
-            file_paths = [f.path for f in os.scandir(dir_path) if f.is_file() and f.name != '__init__.py' and f.name[0] != '_']
-            for module_path in file_paths:
-                if module_path[-3:] == '.py':
-                    module_name = module_path.split('/')[-1][:-3]
-                    module = import_module(module_path, module_name) # We want to import job_dicts
-                    job_dicts = module.job_dicts
-                    jobs_directory = module_path.split('/')[-2]
-                    for job_dict in job_dicts:
-                        job_dict['job_directory'] = jobs_directory # Add 'job_directory' field to each job.
-                    kwargs = {'selected_job_codes': [],
-                        'use_local_input_file': False,
-                        'use_local_output_file': False,
-                        'clear_first': False,
-                        'wipe_data': False,
-                        'test_mode': True,
-                        'migrate_schema': False,
-                        'ignore_empty_rows': False,
-                        'retry_without_last_line': False,
-                        }
-                    try:
-                        main(**kwargs) # Try to run all jobs in the module.
-                    except FileNotFoundError:
-                        print("*** {} terminated with a FileNotFoundError. ***".format(module))
+        options = dict(arg.split('=') for arg in sys.argv[2:] if re.match(r'^(parallel|timeout)=\d+$', arg))
+        summary = test_all(workers=int(options.get('parallel', os.cpu_count())), timeout=int(options.get('timeout', 3600)))
+        print(f"Ran {len(summary['jobs'])} jobs in {summary['duration']} seconds: {summary['counts']}")
+        for j in summary['jobs']:
+            if j['status'] not in ['ok', 'file_not_found']:
+                print(f"  {j['module']} {j['job_code'] or ''}: {j['status']} {j['error'] or ''}")
+        if any(j['status'] not in ['ok', 'file_not_found'] for j in summary['jobs']):
+            sys.exit(1)
 
     elif len(sys.argv) != 1:
         try:
@@ -307,31 +687,6 @@ if __name__ == '__main__':
 
         if not PRODUCTION and 'test' not in original_args and 'production' not in original_args:
             print("Remember that to make changes to production datasets when PRODUCTION == False, it's necessary to use the command-line parameter 'production'.")
-        try:
-            kwargs, args = parse_args(args, job_dicts, payload_location, module_name)
-            main(**kwargs)
-
-            if kwargs['wake_me_when_found']:
-                msg = "A file that was not expected (one of these: {}) has resurfaced!\nIf this was a one-time outage, you can remove the wake_me_when_found parameter from the cron job for this ETL process.\nIf this is a source file that appears on some schedule, the file has appeared at an unexpected time. The cron job date specification might need to be altered.".format(list(set([j_dict['source_file'] for j_dict in job_dicts])))
-                print(msg)
-                if not mute_alerts:
-                    channel = "@david" if (kwargs['test_mode'] or not PRODUCTION) else "#etl-hell"
-                    send_to_slack(msg, username='{}/{} ETL assistant'.format(payload_location, module_name), channel=channel, icon=':illuminati:')
-        except:
-            e = sys.exc_info()[0]
-            if e == FileNotFoundError and kwargs['wake_me_when_found']:
-                print("As expected, this script threw an exception because the ETL framework could not find a source file.")
-            elif e == KeyboardInterrupt:
-                print("(Suppressing Slack notification for keyboard interrupt.)")
-            else:
-                exc_type, exc_value, exc_traceback = sys.exc_info()
-                lines = traceback.format_exception(exc_type, exc_value, exc_traceback)
-                msg = ''.join('!! ' + line for line in lines)
-                print(msg) # Log it or whatever here
-                if not kwargs['mute_alerts']:
-                    channel = "@david" if (kwargs['test_mode'] or not PRODUCTION) else "#etl-hell"
-                    if channel != "@david":
-                        msg = f"@david {msg}"
-                    send_to_slack(msg, username='{}/{} ETL assistant'.format(payload_location, module_name), channel=channel, icon=':illuminati:')
+        run_payload(args, job_dicts, payload_location, module_name)
     else:
         print("The first argument should be the payload descriptor (where the script for the job is).")